@@ -169,6 +169,31 @@ SPECTACULAR_SETTINGS = {
     'SCHEMA_PATH_PREFIX': r'/api/',
 }
 
+# Vendas
+VENDAS_LOTE_MAX = env.int('VENDAS_LOTE_MAX', default=1000)  # Máximo de vendas por lote (/api/vendas/lote/)
+IDEMPOTENCIA_TTL_HORAS = env.int('IDEMPOTENCIA_TTL_HORAS', default=24)  # Validade das respostas por Idempotency-Key
+CARRITO_RESERVA_MINUTOS = env.int('CARRITO_RESERVA_MINUTOS', default=15)  # Duração da reserva de estoque dos carrinhos
+CARRITO_ABANDONO_DIAS = env.int('CARRITO_ABANDONO_DIAS', default=30)  # Carrinhos sem alteração há mais dias são removidos
+CARRITO_BACKEND = env('CARRITO_BACKEND', default='banco')  # 'banco' ou 'cache' (carrinhos anônimos no cache até o checkout/login)
+CARRITO_CACHE_ALIAS = env('CARRITO_CACHE_ALIAS', default='default')
+
+# Kanban
+KANBAN_SNAPSHOT_TTL = env.int('KANBAN_SNAPSHOT_TTL', default=3600)  # Segundos que o quadro completo fica no cache
+KANBAN_EVENTOS_HISTORICO = env.int('KANBAN_EVENTOS_HISTORICO', default=500)  # Eventos guardados por quadro para retomada
+KANBAN_EVENTOS_DURACAO = env.int('KANBAN_EVENTOS_DURACAO', default=300)  # Segundos de cada conexão SSE (o cliente reconecta)
+KANBAN_EVENTOS_PING = 15  # Segundos entre comentários de keep-alive
+KANBAN_EVENTOS_RETRY_MS = 3000  # Espera sugerida ao EventSource antes de reconectar
+KANBAN_EVENTOS_RETRY_WSGI_MS = env.int('KANBAN_EVENTOS_RETRY_WSGI_MS', default=10000)  # Intervalo de consulta quando servido por WSGI
+KANBAN_MUDANCAS_MARGEM = 5  # Segundos que o cursor de /mudancas/ recua para cobrir transações em andamento
+KANBAN_REMOCOES_DIAS = env.int('KANBAN_REMOCOES_DIAS', default=30)  # Janela de sincronização (registros de remoção)
+KANBAN_ARQUIVO_HISTORICO_DIAS = env.int('KANBAN_ARQUIVO_HISTORICO_DIAS', default=365)  # Movimentações mais antigas vão para o arquivo
+KANBAN_ARQUIVO_LOGS_DIAS = env.int('KANBAN_ARQUIVO_LOGS_DIAS', default=90)  # Logs de notificação mais antigos vão para o arquivo
+
+# Cache (em produção use um cache compartilhado, ex.: CACHE_URL=redis://...)
+CACHES = {
+    'default': env.cache('CACHE_URL', default='locmemcache://'),
+}
+
 # Supabase configuration
 SUPABASE_URL = env('SUPABASE_URL', default='')
 SUPABASE_KEY = env('SUPABASE_KEY', default='')
@@ -224,12 +249,19 @@ CORS_ALLOW_HEADERS = [
     'user-agent',
     'x-csrftoken',
     'x-requested-with',
+    'idempotency-key',
+    'if-none-match',
+    'last-event-id',
 ]
 
 # Headers expostos ao frontend
 CORS_EXPOSE_HEADERS = [
     'content-type',
     'x-csrftoken',
+    'idempotent-replayed',
+    'etag',
+    'x-ultimo-evento',
+    'x-cursor-mudancas',
 ]
 
 # Configuração adicional de CORS
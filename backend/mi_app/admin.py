@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Usuario, Cliente, Categoria, Produto, Venta, VentaItem, Carrito
+from .models import Usuario, Cliente, Categoria, Produto, Venta, VentaItem, Carrito, ChaveIdempotencia, ResumoVendas
 from .models_kanban import Kanban, Coluna, Card, RegraAutomacao, HistoricoMovimentacao, LogNotificacao
 
 # Registrar modelos no admin do Django
@@ -49,6 +49,20 @@ class CarritoAdmin(admin.ModelAdmin):
     search_fields = ('session_id',)
     readonly_fields = ('created_at', 'updated_at')
 
+@admin.register(ResumoVendas)
+class ResumoVendasAdmin(admin.ModelAdmin):
+    list_display = ('id', 'granularidade', 'dimensao', 'periodo', 'chave', 'quantidade', 'total', 'num_vendas')
+    list_filter = ('granularidade', 'dimensao')
+    search_fields = ('chave',)
+    ordering = ('-periodo',)
+
+@admin.register(ChaveIdempotencia)
+class ChaveIdempotenciaAdmin(admin.ModelAdmin):
+    list_display = ('id', 'chave', 'endpoint', 'status_code', 'created_at', 'expira_em')
+    list_filter = ('endpoint', 'status_code')
+    search_fields = ('chave',)
+    readonly_fields = ('created_at',)
+
 
 # Kanban System Admin
 @admin.register(Kanban)
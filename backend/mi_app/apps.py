@@ -6,4 +6,5 @@ class MiAppConfig(AppConfig):
     name = 'mi_app'
 
     def ready(self):
+        import mi_app.checks
         import mi_app.signals
@@ -0,0 +1,17 @@
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+
+class JWTQueryParamAuthentication(JWTAuthentication):
+    """
+    JWT enviado no parâmetro ``token`` da URL
+
+    Para conexões que não permitem definir o header Authorization, como o
+    EventSource do navegador (eventos do Kanban).
+    """
+
+    def authenticate(self, request):
+        token = request.query_params.get('token')
+        if not token:
+            return None
+        validated_token = self.get_validated_token(token.encode())
+        return self.get_user(validated_token), validated_token
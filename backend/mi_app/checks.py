@@ -0,0 +1,29 @@
+from django.conf import settings
+from django.core.checks import Error, register
+
+# Backends que guardam os dados na memória de cada processo (ou não guardam)
+CACHES_LOCAIS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+@register()
+def verificar_cache_do_carrinho(app_configs, **kwargs):
+    """
+    Com CARRITO_BACKEND = 'cache' o carrinho precisa de um cache compartilhado
+
+    Com um cache por processo cada worker do gunicorn veria um carrinho
+    diferente e o bloqueio por cache.add não valeria entre eles.
+    """
+    if settings.CARRITO_BACKEND != 'cache':
+        return []
+    backend = settings.CACHES.get(settings.CARRITO_CACHE_ALIAS, {}).get('BACKEND')
+    if backend in CACHES_LOCAIS:
+        return [Error(
+            f'CARRITO_BACKEND = "cache" exige um cache compartilhado entre os processos, '
+            f'mas o cache "{settings.CARRITO_CACHE_ALIAS}" usa {backend}',
+            hint='Configure CACHE_URL (ou CARRITO_CACHE_ALIAS) para Redis, Memcached ou o cache em banco',
+            id='mi_app.E001',
+        )]
+    return []
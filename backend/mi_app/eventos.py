@@ -0,0 +1,155 @@
+"""
+Eventos do Kanban em tempo real (Server-Sent Events)
+
+O transmissor guarda, por quadro, os últimos eventos publicados e entrega
+cada novo evento às conexões abertas daquele quadro. Funciona dentro do
+processo, sem serviços externos: com vários workers cada processo só vê as
+alterações feitas por ele, então o fluxo contínuo deve ser servido por um
+único processo ASGI. Em WSGI a view usa sincronizar(), uma resposta curta
+que não prende o worker e aponta o cliente para /mudancas/.
+
+Os IDs de evento têm a forma ``<instância>-<sequência>``: a sequência é
+crescente por quadro e a instância muda a cada reinício do processo. Ao
+reconectar com um ID que ainda está no histórico o cliente recebe o que
+perdeu; caso contrário recebe ``recarregar`` e deve baixar o quadro
+completo de novo.
+"""
+import asyncio
+import json
+import threading
+import uuid
+from collections import deque, namedtuple
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+
+Evento = namedtuple('Evento', ['sequencia', 'id', 'tipo', 'dados'])
+
+
+class Transmissor:
+    """Pub/sub em memória de eventos por quadro, com histórico para retomada"""
+
+    def __init__(self, tamanho_historico=None):
+        self.instancia = uuid.uuid4().hex[:8]
+        self.tamanho_historico = tamanho_historico
+        self._lock = threading.Lock()
+        self._sequencias = {}
+        self._historico = {}
+        self._assinantes = {}
+
+    def publicar(self, kanban_id, tipo, dados):
+        """Registra o evento e o entrega às conexões abertas do quadro (seguro entre threads)"""
+        with self._lock:
+            sequencia = self._sequencias.get(kanban_id, 0) + 1
+            self._sequencias[kanban_id] = sequencia
+            evento = Evento(sequencia, f'{self.instancia}-{sequencia}', tipo, dados)
+            tamanho = self.tamanho_historico or settings.KANBAN_EVENTOS_HISTORICO
+            self._historico.setdefault(kanban_id, deque(maxlen=tamanho)).append(evento)
+            assinantes = list(self._assinantes.get(kanban_id, ()))
+
+        for loop, fila in assinantes:
+            try:
+                loop.call_soon_threadsafe(fila.put_nowait, evento)
+            except RuntimeError:
+                # Loop da conexão já encerrado; ela é removida ao sair do fluxo
+                pass
+        return evento
+
+    def ultimo_id(self, kanban_id):
+        """ID do evento mais recente do quadro (ponto de partida para um cliente novo)"""
+        with self._lock:
+            return f'{self.instancia}-{self._sequencias.get(kanban_id, 0)}'
+
+    def assinar(self, kanban_id, ultimo_id=None):
+        """
+        Abre uma fila para o quadro no loop atual
+
+        Returns:
+            tuple: (fila, pendentes) - pendentes são os eventos após
+                   ultimo_id, ou None se não for possível retomar a partir dele
+        """
+        fila = asyncio.Queue()
+        with self._lock:
+            self._assinantes.setdefault(kanban_id, set()).add((asyncio.get_running_loop(), fila))
+            historico = list(self._historico.get(kanban_id, ()))
+            atual = self._sequencias.get(kanban_id, 0)
+        return fila, self._pendentes(historico, atual, ultimo_id)
+
+    def cancelar(self, kanban_id, fila):
+        with self._lock:
+            assinantes = self._assinantes.get(kanban_id, set())
+            assinantes.difference_update({item for item in assinantes if item[1] is fila})
+            if not assinantes:
+                self._assinantes.pop(kanban_id, None)
+
+    def _pendentes(self, historico, atual, ultimo_id):
+        if not ultimo_id:
+            return []
+        instancia, _, sequencia = str(ultimo_id).partition('-')
+        if instancia != self.instancia or not sequencia.isdigit() or int(sequencia) > atual:
+            return None
+        sequencia = int(sequencia)
+        # Eventos já descartados do histórico não podem ser reenviados
+        if sequencia < atual and (not historico or historico[0].sequencia > sequencia + 1):
+            return None
+        return [evento for evento in historico if evento.sequencia > sequencia]
+
+
+transmissor = Transmissor()
+
+
+def publicar(kanban_id, tipo, dados):
+    """Publica o evento do quadro depois do commit da transação atual"""
+    transaction.on_commit(lambda: transmissor.publicar(kanban_id, tipo, dados))
+
+
+def formatar(tipo, dados, evento_id=None):
+    """Mensagem no formato text/event-stream"""
+    linhas = [f'id: {evento_id}'] if evento_id else []
+    linhas += [f'event: {tipo}', f'data: {json.dumps(dados, cls=DjangoJSONEncoder)}']
+    return '\n'.join(linhas) + '\n\n'
+
+
+async def fluxo(kanban_id, ultimo_id=None, duracao=None):
+    """
+    Gerador assíncrono com os eventos do quadro para uma conexão SSE
+
+    Reenvia o que foi perdido desde ultimo_id, depois espera novos eventos
+    (com comentários de keep-alive) até completar a duração da conexão; o
+    EventSource reconecta sozinho enviando o último ID recebido.
+    """
+    loop = asyncio.get_running_loop()
+    fila, pendentes = transmissor.assinar(kanban_id, ultimo_id)
+    try:
+        yield f'retry: {settings.KANBAN_EVENTOS_RETRY_MS}\n\n'
+        if pendentes is None:
+            yield formatar('recarregar', {'kanban': kanban_id}, transmissor.ultimo_id(kanban_id))
+            pendentes = []
+        for evento in pendentes:
+            yield formatar(evento.tipo, evento.dados, evento.id)
+
+        fim = loop.time() + (settings.KANBAN_EVENTOS_DURACAO if duracao is None else duracao)
+        while (restante := fim - loop.time()) > 0:
+            try:
+                evento = await asyncio.wait_for(fila.get(), timeout=min(restante, settings.KANBAN_EVENTOS_PING))
+            except asyncio.TimeoutError:
+                yield ': ping\n\n'
+                continue
+            yield formatar(evento.tipo, evento.dados, evento.id)
+    finally:
+        transmissor.cancelar(kanban_id, fila)
+
+
+def sincronizar(kanban_id, versao):
+    """
+    Resposta curta para servidores WSGI (gerador síncrono e limitado)
+
+    Um worker síncrono ficaria preso durante toda a conexão e os eventos
+    publicados por outros workers não chegariam a ele, então não há fluxo:
+    o cliente recebe a versão atual do quadro (lida do banco, vale para
+    todos os workers), busca /mudancas/ se ela mudou e reconecta depois de
+    KANBAN_EVENTOS_RETRY_WSGI_MS.
+    """
+    yield f'retry: {settings.KANBAN_EVENTOS_RETRY_WSGI_MS}\n\n'
+    yield formatar('sincronizar', {'kanban': kanban_id, 'versao': versao})
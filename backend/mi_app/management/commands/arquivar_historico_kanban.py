@@ -0,0 +1,41 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from mi_app.services import ArquivamentoKanbanService
+
+
+class Command(BaseCommand):
+    help = 'Move movimentações e logs de notificação antigos para as tabelas de arquivo'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dias-historico',
+            type=int,
+            default=settings.KANBAN_ARQUIVO_HISTORICO_DIAS,
+            help=f'Mantém as movimentações dos últimos N dias (padrão: {settings.KANBAN_ARQUIVO_HISTORICO_DIAS})'
+        )
+        parser.add_argument(
+            '--dias-logs',
+            type=int,
+            default=settings.KANBAN_ARQUIVO_LOGS_DIAS,
+            help=f'Mantém os logs de notificação dos últimos N dias (padrão: {settings.KANBAN_ARQUIVO_LOGS_DIAS})'
+        )
+        parser.add_argument(
+            '--tamanho-lote',
+            type=int,
+            default=ArquivamentoKanbanService.TAMANHO_LOTE,
+            help=f'Registros movidos por transação (padrão: {ArquivamentoKanbanService.TAMANHO_LOTE})'
+        )
+
+    def handle(self, *args, **options):
+        def progresso(tipo):
+            return lambda arquivados: self.stdout.write(f'  {arquivados} {tipo} arquivados...')
+
+        historico = ArquivamentoKanbanService.arquivar_historico(
+            options['dias_historico'], options['tamanho_lote'], progresso('registros de histórico')
+        )
+        logs = ArquivamentoKanbanService.arquivar_logs(
+            options['dias_logs'], options['tamanho_lote'], progresso('logs de notificação')
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'{historico} movimentações e {logs} logs de notificação arquivados'
+        ))
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from mi_app.services import ReservaService
+
+
+class Command(BaseCommand):
+    help = 'Libera as reservas de estoque dos carrinhos que já venceram'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--lote',
+            type=int,
+            default=ReservaService.LOTE_EXPIRACAO,
+            help=f'Linhas de carrinho liberadas por transação (padrão: {ReservaService.LOTE_EXPIRACAO})'
+        )
+        parser.add_argument(
+            '--reconciliar',
+            action='store_true',
+            help='Recalcula o estoque reservado de todos os produtos a partir dos carrinhos'
+        )
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            liberadas = ReservaService.expirar(limite=options['lote'])
+            if not liberadas:
+                break
+            total += liberadas
+            self.stdout.write(f'  {total} reservas liberadas...')
+
+        self.stdout.write(self.style.SUCCESS(f'{total} reservas vencidas liberadas'))
+
+        if options['reconciliar']:
+            produtos = ReservaService.reconciliar()
+            self.stdout.write(self.style.SUCCESS(f'Estoque reservado recalculado para {produtos} produtos'))
@@ -0,0 +1,65 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Sum
+from django.utils import timezone
+from mi_app.services import CarrinhoService
+
+
+class Command(BaseCommand):
+    help = 'Remove em lotes os carrinhos sem alterações há mais de N dias'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dias',
+            type=int,
+            default=settings.CARRITO_ABANDONO_DIAS,
+            help=f'Dias sem alteração para considerar o carrinho abandonado (padrão: {settings.CARRITO_ABANDONO_DIAS})'
+        )
+        parser.add_argument(
+            '--lote',
+            type=int,
+            default=1000,
+            help='Linhas removidas por transação (padrão: 1000)'
+        )
+        parser.add_argument(
+            '--incluir-usuarios',
+            action='store_true',
+            help='Inclui carrinhos de usuários autenticados (por padrão só os anônimos)'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Apenas informa quantas linhas e carrinhos seriam removidos'
+        )
+
+    def handle(self, *args, **options):
+        limite_data = timezone.now() - timedelta(days=options['dias'])
+        incluir_usuarios = options['incluir_usuarios']
+
+        if options['dry_run']:
+            linhas = CarrinhoService.abandonados(limite_data, incluir_usuarios)
+            sessoes = linhas.filter(usuario_id__isnull=True).values('session_id').distinct().count()
+            usuarios = linhas.filter(usuario_id__isnull=False).values('usuario_id').distinct().count()
+            reservadas = linhas.filter(reservado_ate__isnull=False).aggregate(total=Sum('quantidade'))['total'] or 0
+            self.stdout.write(
+                f'{linhas.count()} linhas seriam removidas '
+                f'({sessoes} carrinhos anônimos, {usuarios} carrinhos de usuários, '
+                f'{reservadas} unidades reservadas liberadas)'
+            )
+            return
+
+        total = 0
+        while True:
+            removidas = CarrinhoService.purgar_abandonados(
+                limite_data,
+                incluir_usuarios=incluir_usuarios,
+                limite=options['lote']
+            )
+            if not removidas:
+                break
+            total += removidas
+            self.stdout.write(f'  {total} linhas removidas...')
+
+        self.stdout.write(self.style.SUCCESS(f'{total} linhas de carrinhos abandonados removidas'))
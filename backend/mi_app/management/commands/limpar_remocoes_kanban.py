@@ -0,0 +1,19 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from mi_app.services import SincronizacaoKanbanService
+
+
+class Command(BaseCommand):
+    help = 'Apaga os registros de colunas e cards excluídos que já saíram da janela de sincronização'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dias',
+            type=int,
+            default=settings.KANBAN_REMOCOES_DIAS,
+            help=f'Mantém os registros dos últimos N dias (padrão: {settings.KANBAN_REMOCOES_DIAS})'
+        )
+
+    def handle(self, *args, **options):
+        apagados = SincronizacaoKanbanService.purgar_remocoes(options['dias'])
+        self.stdout.write(self.style.SUCCESS(f'{apagados} registros de remoção apagados'))
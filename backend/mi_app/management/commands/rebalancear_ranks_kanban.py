@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from mi_app.models_kanban import Card, Coluna
+from mi_app.services import OrdenacaoKanbanService
+
+
+class Command(BaseCommand):
+    help = 'Redistribui os ranks de colunas e cards que ficaram longos demais após muitas movimentações'
+
+    def handle(self, *args, **options):
+        for modelo, grupo in ((Coluna, 'quadros'), (Card, 'colunas')):
+            total = 0
+            for grupo_id in OrdenacaoKanbanService.grupos_para_rebalancear(modelo):
+                OrdenacaoKanbanService.rebalancear(modelo, grupo_id)
+                total += 1
+                self.stdout.write(f'  {total} {grupo} rebalanceados...')
+
+            self.stdout.write(self.style.SUCCESS(f'{modelo._meta.verbose_name_plural}: {total} {grupo} rebalanceados'))
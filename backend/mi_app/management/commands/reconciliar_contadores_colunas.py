@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from mi_app.services import ContadorCardsService
+
+
+class Command(BaseCommand):
+    help = 'Recalcula o total de cards (cards_count) das colunas do Kanban a partir dos cards'
+
+    def handle(self, *args, **options):
+        corrigidas = ContadorCardsService.reconciliar()
+        self.stdout.write(self.style.SUCCESS(f'{corrigidas} colunas com total de cards corrigido'))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from mi_app.services import MetricasKanbanService
+
+
+class Command(BaseCommand):
+    help = 'Recalcula os intervalos dos cards nas colunas e o fluxo diário (métricas do Kanban) a partir do histórico'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--tamanho-lote',
+            type=int,
+            default=500,
+            help='Quantidade de cards processados por lote (padrão: 500)'
+        )
+
+    def handle(self, *args, **options):
+        def progresso(processados):
+            self.stdout.write(f'  {processados} cards processados...')
+
+        total = MetricasKanbanService.reconstruir(
+            tamanho_lote=options['tamanho_lote'],
+            progresso=progresso
+        )
+        self.stdout.write(self.style.SUCCESS(f'Métricas do Kanban reconstruídas a partir de {total} cards'))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from mi_app.services import ResumoVendasService
+
+
+class Command(BaseCommand):
+    help = 'Recalcula os resumos de vendas (relatórios) a partir de todas as vendas'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--tamanho-lote',
+            type=int,
+            default=2000,
+            help='Quantidade de vendas processadas por lote (padrão: 2000)'
+        )
+
+    def handle(self, *args, **options):
+        def progresso(processadas):
+            self.stdout.write(f'  {processadas} vendas processadas...')
+
+        total = ResumoVendasService.reconstruir(
+            tamanho_lote=options['tamanho_lote'],
+            progresso=progresso
+        )
+        self.stdout.write(self.style.SUCCESS(f'Resumos de vendas reconstruídos a partir de {total} vendas'))
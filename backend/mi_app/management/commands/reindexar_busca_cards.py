@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from mi_app.services import BuscaCardsService
+
+
+class Command(BaseCommand):
+    help = 'Reconstrói o índice de texto completo dos cards (busca em /api/cards/busca/)'
+
+    def handle(self, *args, **options):
+        total = BuscaCardsService.reindexar()
+        self.stdout.write(self.style.SUCCESS(f'{total} cards indexados'))
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.4 on 2026-10-17 19:51
+
+import django.core.serializers.json
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mi_app', '0008_produto_cliente_alter_usuario_password'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChaveIdempotencia',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('chave', models.CharField(max_length=255)),
+                ('endpoint', models.CharField(max_length=100)),
+                ('hash_requisicao', models.CharField(max_length=64)),
+                ('status_code', models.IntegerField(blank=True, null=True)),
+                ('resposta', models.JSONField(blank=True, encoder=django.core.serializers.json.DjangoJSONEncoder, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('expira_em', models.DateTimeField(db_index=True)),
+            ],
+            options={
+                'db_table': 'idempotencia',
+                'constraints': [models.UniqueConstraint(fields=('chave', 'endpoint'), name='unique_idempotencia_chave_endpoint')],
+            },
+        ),
+    ]
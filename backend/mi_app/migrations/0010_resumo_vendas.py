@@ -0,0 +1,31 @@
+# Generated by Django 5.2.4 on 2026-10-17 19:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mi_app', '0009_chave_idempotencia'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResumoVendas',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('granularidade', models.CharField(choices=[('dia', 'Dia'), ('mes', 'Mês')], max_length=3)),
+                ('dimensao', models.CharField(choices=[('total', 'Total'), ('produto', 'Produto'), ('cliente', 'Cliente'), ('cidade', 'Cidade')], max_length=10)),
+                ('periodo', models.DateField()),
+                ('chave', models.CharField(blank=True, default='', max_length=100)),
+                ('quantidade', models.IntegerField(default=0)),
+                ('total', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('num_vendas', models.IntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'resumo_vendas',
+                'ordering': ['periodo', 'chave'],
+                'constraints': [models.UniqueConstraint(fields=('granularidade', 'dimensao', 'periodo', 'chave'), name='unique_resumo_vendas')],
+            },
+        ),
+    ]
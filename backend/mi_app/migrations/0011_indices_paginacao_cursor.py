@@ -0,0 +1,33 @@
+# Generated by Django 5.2.4 on 2026-10-17 19:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mi_app', '0010_resumo_vendas'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='card',
+            index=models.Index(fields=['ordem', '-data_criacao', 'id'], name='card_ordem_criacao_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='historicomovimentacao',
+            index=models.Index(fields=['data', 'id'], name='historico_data_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='lognotificacao',
+            index=models.Index(fields=['data_envio', 'id'], name='log_notif_envio_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='produto',
+            index=models.Index(fields=['created_at', 'id'], name='produtos_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='venta',
+            index=models.Index(fields=['created_at', 'id'], name='vendas_created_id_idx'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.4 on 2026-10-17 19:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mi_app', '0011_indices_paginacao_cursor'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='venta',
+            index=models.Index(fields=['cliente_cedula', 'created_at'], name='vendas_cliente_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ventaitem',
+            index=models.Index(fields=['venda_id'], name='detalles_venda_venda_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ventaitem',
+            index=models.Index(fields=['produto_id', 'created_at'], name='detalles_venda_produto_idx'),
+        ),
+    ]
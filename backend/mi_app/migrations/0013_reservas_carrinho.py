@@ -0,0 +1,27 @@
+# Generated by Django 5.2.4 on 2026-10-17 19:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mi_app', '0012_indices_vendas'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='carrito',
+            name='reservado_ate',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='produto',
+            name='estoque_reservado',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='carrito',
+            index=models.Index(condition=models.Q(('reservado_ate__isnull', False)), fields=['reservado_ate'], name='carrito_reserva_idx'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.4 on 2026-10-17 20:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mi_app', '0013_reservas_carrinho'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='carrito',
+            index=models.Index(fields=['session_id', 'updated_at'], name='carrito_session_upd_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='carrito',
+            index=models.Index(fields=['updated_at'], name='carrito_updated_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-17 20:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mi_app', '0014_indices_limpeza_carrinho'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='kanban',
+            name='versao',
+            field=models.PositiveBigIntegerField(default=1, help_text='Incrementada a cada alteração de colunas, cards ou regras do quadro', verbose_name='Versão'),
+        ),
+    ]
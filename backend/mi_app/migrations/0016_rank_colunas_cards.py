@@ -0,0 +1,67 @@
+# Generated by Django 5.2.4 on 2026-10-17 20:09
+
+from django.db import migrations, models
+
+from mi_app.rank import espalhados
+
+
+def preencher_ranks(apps, schema_editor):
+    """Ranks iniciais seguindo a ordem atual (ordem, data de criação) de colunas e cards"""
+    Coluna = apps.get_model('mi_app', 'Coluna')
+    Card = apps.get_model('mi_app', 'Card')
+
+    for modelo, pai, ordenacao in (
+        (Coluna, 'kanban_id', ('ordem', 'id')),
+        (Card, 'coluna_id', ('ordem', '-data_criacao', 'id')),
+    ):
+        pais = modelo.objects.order_by(pai).values_list(pai, flat=True).distinct()
+        for pai_id in pais.iterator():
+            itens = list(modelo.objects.filter(**{pai: pai_id}).order_by(*ordenacao).only('id'))
+            for item, rank in zip(itens, espalhados(len(itens))):
+                item.rank = rank
+            modelo.objects.bulk_update(itens, ['rank'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mi_app', '0015_versao_kanban'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='card',
+            options={'ordering': ['rank', 'id'], 'verbose_name': 'Card', 'verbose_name_plural': 'Cards'},
+        ),
+        migrations.AlterModelOptions(
+            name='coluna',
+            options={'ordering': ['rank', 'id'], 'verbose_name': 'Coluna', 'verbose_name_plural': 'Colunas'},
+        ),
+        migrations.RemoveIndex(
+            model_name='card',
+            name='card_ordem_criacao_idx',
+        ),
+        migrations.AddField(
+            model_name='card',
+            name='rank',
+            field=models.CharField(blank=True, default='', help_text='Posição do card na coluna (ordem lexicográfica, ver mi_app/rank.py)', max_length=64, verbose_name='Posição'),
+        ),
+        migrations.AddField(
+            model_name='coluna',
+            name='rank',
+            field=models.CharField(blank=True, default='', help_text='Posição da coluna no quadro (ordem lexicográfica, ver mi_app/rank.py)', max_length=64, verbose_name='Posição'),
+        ),
+        migrations.RunPython(preencher_ranks, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='card',
+            index=models.Index(fields=['coluna', 'rank'], name='card_coluna_rank_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='card',
+            index=models.Index(fields=['rank', 'id'], name='card_rank_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='coluna',
+            index=models.Index(fields=['kanban', 'rank'], name='coluna_kanban_rank_idx'),
+        ),
+    ]
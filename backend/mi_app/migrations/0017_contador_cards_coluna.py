@@ -0,0 +1,30 @@
+# Generated by Django 5.2.4 on 2026-10-17 20:16
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def contar_cards(apps, schema_editor):
+    """Total inicial de cards de cada coluna"""
+    Coluna = apps.get_model('mi_app', 'Coluna')
+    Card = apps.get_model('mi_app', 'Card')
+
+    total = Card.objects.filter(coluna=OuterRef('pk')).order_by().values('coluna').annotate(total=Count('id')).values('total')
+    Coluna.objects.update(cards_count=Coalesce(Subquery(total), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mi_app', '0016_rank_colunas_cards'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='coluna',
+            name='cards_count',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Total de cards na coluna, mantido a cada criação, movimentação e exclusão', verbose_name='Total de Cards'),
+        ),
+        migrations.RunPython(contar_cards, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.4 on 2026-10-17 20:22
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mi_app', '0017_contador_cards_coluna'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RemocaoKanban',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kanban_id', models.BigIntegerField(verbose_name='Quadro')),
+                ('tipo', models.CharField(choices=[('coluna', 'Coluna'), ('card', 'Card')], max_length=10, verbose_name='Tipo')),
+                ('objeto_id', models.BigIntegerField(verbose_name='ID Excluído')),
+                ('removido_em', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Removido em')),
+            ],
+            options={
+                'verbose_name': 'Remoção',
+                'verbose_name_plural': 'Remoções',
+                'db_table': 'kanban_remocao',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='card',
+            index=models.Index(fields=['coluna', 'updated_at'], name='card_coluna_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='coluna',
+            index=models.Index(fields=['kanban', 'updated_at'], name='coluna_kanban_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='remocaokanban',
+            index=models.Index(fields=['kanban_id', 'removido_em'], name='remocao_kanban_data_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='remocaokanban',
+            index=models.Index(fields=['removido_em'], name='remocao_data_idx'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+from django.db import migrations
+
+
+def criar_indice_busca(apps, schema_editor):
+    """
+    Índice de texto completo dos cards (titulo com peso maior que descricao)
+
+    PostgreSQL: coluna tsvector em kanban_card com índice GIN.
+    SQLite: tabela virtual FTS5 com rowid igual ao id do card.
+    Nos dois casos o conteúdo é mantido por BuscaCardsService.
+    """
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute('ALTER TABLE kanban_card ADD COLUMN busca tsvector')
+        schema_editor.execute(
+            "UPDATE kanban_card SET busca = "
+            "setweight(to_tsvector('portuguese', coalesce(titulo, '')), 'A') || "
+            "setweight(to_tsvector('portuguese', coalesce(descricao, '')), 'B')"
+        )
+        schema_editor.execute('CREATE INDEX card_busca_gin_idx ON kanban_card USING gin (busca)')
+    elif vendor == 'sqlite':
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE kanban_card_busca USING fts5("
+            "titulo, descricao, tokenize='unicode61 remove_diacritics 2')"
+        )
+        schema_editor.execute(
+            "INSERT INTO kanban_card_busca (rowid, titulo, descricao) "
+            "SELECT id, titulo, coalesce(descricao, '') FROM kanban_card"
+        )
+
+
+def remover_indice_busca(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS card_busca_gin_idx')
+        schema_editor.execute('ALTER TABLE kanban_card DROP COLUMN IF EXISTS busca')
+    elif vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS kanban_card_busca')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mi_app', '0018_remocoes_kanban'),
+    ]
+
+    operations = [
+        migrations.RunPython(criar_indice_busca, remover_indice_busca),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.2.4 on 2026-10-17 20:28
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mi_app', '0019_busca_cards'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FluxoDiarioColuna',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('kanban_id', models.BigIntegerField(verbose_name='Quadro')),
+                ('coluna_id', models.BigIntegerField(verbose_name='Coluna')),
+                ('data', models.DateField(verbose_name='Data')),
+                ('entradas', models.IntegerField(default=0)),
+                ('saidas', models.IntegerField(default=0)),
+                ('segundos_permanencia', models.BigIntegerField(default=0)),
+                ('segundos_ate_entrada', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Fluxo Diário',
+                'verbose_name_plural': 'Fluxos Diários',
+                'db_table': 'kanban_fluxo_diario',
+                'ordering': ['data', 'coluna_id'],
+                'indexes': [models.Index(fields=['kanban_id', 'data'], name='fluxo_kanban_data_idx')],
+                'constraints': [models.UniqueConstraint(fields=('coluna_id', 'data'), name='unique_fluxo_coluna_dia')],
+            },
+        ),
+        migrations.CreateModel(
+            name='PermanenciaColuna',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('entrada', models.DateTimeField(verbose_name='Entrada')),
+                ('saida', models.DateTimeField(blank=True, null=True, verbose_name='Saída')),
+                ('card', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='permanencias', to='mi_app.card', verbose_name='Card')),
+                ('coluna', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='permanencias', to='mi_app.coluna', verbose_name='Coluna')),
+            ],
+            options={
+                'verbose_name': 'Permanência em Coluna',
+                'verbose_name_plural': 'Permanências em Colunas',
+                'db_table': 'kanban_permanencia_coluna',
+                'ordering': ['entrada', 'id'],
+                'indexes': [models.Index(fields=['card', 'saida'], name='permanencia_card_saida_idx')],
+            },
+        ),
+    ]
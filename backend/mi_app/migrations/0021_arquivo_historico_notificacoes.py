@@ -0,0 +1,64 @@
+# Generated by Django 5.2.4 on 2026-10-17 20:34
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mi_app', '0020_metricas_kanban'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HistoricoMovimentacaoArquivo',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('kanban_id', models.BigIntegerField(null=True, verbose_name='Quadro')),
+                ('card_id', models.BigIntegerField(verbose_name='Card')),
+                ('card_titulo', models.CharField(max_length=200, verbose_name='Título do Card')),
+                ('coluna_origem_id', models.BigIntegerField(null=True, verbose_name='Coluna Origem')),
+                ('coluna_origem_nome', models.CharField(blank=True, max_length=100, null=True)),
+                ('coluna_destino_id', models.BigIntegerField(null=True, verbose_name='Coluna Destino')),
+                ('coluna_destino_nome', models.CharField(blank=True, max_length=100, null=True)),
+                ('usuario_id', models.UUIDField(null=True, verbose_name='Usuário')),
+                ('usuario_nome', models.CharField(blank=True, max_length=255, null=True)),
+                ('data', models.DateTimeField(verbose_name='Data')),
+                ('observacao', models.TextField(blank=True, null=True, verbose_name='Observação')),
+                ('arquivado_em', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Arquivado em')),
+            ],
+            options={
+                'verbose_name': 'Histórico Arquivado',
+                'verbose_name_plural': 'Históricos Arquivados',
+                'db_table': 'kanban_historico_arquivo',
+                'ordering': ['-data'],
+                'indexes': [models.Index(fields=['data', 'id'], name='hist_arq_data_id_idx'), models.Index(fields=['kanban_id', 'data'], name='hist_arq_kanban_data_idx'), models.Index(fields=['card_id', 'data'], name='hist_arq_card_data_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='LogNotificacaoArquivo',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('kanban_id', models.BigIntegerField(null=True, verbose_name='Quadro')),
+                ('card_id', models.BigIntegerField(verbose_name='Card')),
+                ('card_titulo', models.CharField(max_length=200, verbose_name='Título do Card')),
+                ('regra_id', models.BigIntegerField(null=True, verbose_name='Regra')),
+                ('regra_nome', models.CharField(blank=True, max_length=200, null=True)),
+                ('destinatario', models.CharField(max_length=20, verbose_name='Destinatário')),
+                ('mensagem', models.TextField(verbose_name='Mensagem')),
+                ('status', models.CharField(choices=[('enviado', 'Enviado'), ('erro', 'Erro'), ('pendente', 'Pendente')], max_length=10, verbose_name='Status')),
+                ('erro_mensagem', models.TextField(blank=True, null=True, verbose_name='Mensagem de Erro')),
+                ('data_envio', models.DateTimeField(verbose_name='Data de Envio')),
+                ('tentativas', models.IntegerField(default=0, verbose_name='Tentativas')),
+                ('arquivado_em', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Arquivado em')),
+            ],
+            options={
+                'verbose_name': 'Log de Notificação Arquivado',
+                'verbose_name_plural': 'Logs de Notificações Arquivados',
+                'db_table': 'kanban_log_notificacao_arquivo',
+                'ordering': ['-data_envio'],
+                'indexes': [models.Index(fields=['data_envio', 'id'], name='log_arq_envio_id_idx'), models.Index(fields=['kanban_id', 'data_envio'], name='log_arq_kanban_envio_idx'), models.Index(fields=['card_id', 'data_envio'], name='log_arq_card_envio_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.4 on 2026-10-17 20:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mi_app', '0021_arquivo_historico_notificacoes'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='chaveidempotencia',
+            name='unique_idempotencia_chave_endpoint',
+        ),
+        migrations.AddField(
+            model_name='chaveidempotencia',
+            name='escopo',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+        migrations.AddConstraint(
+            model_name='chaveidempotencia',
+            constraint=models.UniqueConstraint(fields=('escopo', 'chave', 'endpoint'), name='unique_idempotencia_escopo_chave'),
+        ),
+    ]
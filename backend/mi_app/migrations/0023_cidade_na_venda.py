@@ -0,0 +1,32 @@
+# Generated by Django 5.2.4 on 2026-10-17 20:44
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def preencher_cidades(apps, schema_editor):
+    """Cidade atual do cliente nas vendas existentes (a mesma usada até aqui nos resumos)"""
+    Venta = apps.get_model('mi_app', 'Venta')
+    Cliente = apps.get_model('mi_app', 'Cliente')
+
+    cidade = Cliente.objects.filter(cedula=OuterRef('cliente_cedula')).values('cidade')[:1]
+    Venta.objects.filter(cliente_cedula__isnull=False).exclude(cliente_cedula='').update(
+        cliente_cidade=Coalesce(Subquery(cidade), Value(''))
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mi_app', '0022_escopo_idempotencia'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='venta',
+            name='cliente_cidade',
+            field=models.CharField(blank=True, max_length=50, null=True),
+        ),
+        migrations.RunPython(preencher_cidades, migrations.RunPython.noop),
+    ]
@@ -1,5 +1,6 @@
 from django.db import models
 from django.contrib.auth.models import AbstractUser
+from django.core.serializers.json import DjangoJSONEncoder
 from django.utils import timezone
 from django.contrib.auth.hashers import make_password
 import uuid
@@ -82,6 +83,7 @@ class Produto(models.Model):
     descricao = models.TextField(null=True, blank=True)
     preco = models.DecimalField(max_digits=10, decimal_places=2)
     estoque = models.IntegerField()
+    estoque_reservado = models.IntegerField(default=0)  # Soma das reservas ativas dos carrinhos
     imagem_url = models.URLField(null=True, blank=True)
     categoria = models.ForeignKey(Categoria, on_delete=models.SET_NULL, null=True, blank=True)
     cliente = models.ForeignKey(
@@ -98,26 +100,41 @@ class Produto(models.Model):
     class Meta:
         db_table = 'produtos'
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='produtos_created_id_idx')
+        ]
 
     def __str__(self):
         return f"{self.nome} - R$ {self.preco}"
     
+    @property
+    def estoque_disponivel(self):
+        """Estoque livre: total menos o que está reservado em carrinhos"""
+        return max(self.estoque - self.estoque_reservado, 0)
+
     def tem_estoque(self, quantidade=1):
         """Verifica se há estoque suficiente disponível"""
-        return self.estoque >= quantidade
+        return self.estoque_disponivel >= quantidade
     
     def reduzir_estoque(self, quantidade):
-        """Reduz o estoque do produto"""
-        if self.tem_estoque(quantidade):
-            self.estoque -= quantidade
-            self.save()
-            return True
-        return False
+        """Reduz o estoque do produto com um UPDATE condicional (seguro sob concorrência)"""
+        atualizados = Produto.objects.filter(
+            pk=self.pk,
+            estoque__gte=models.F('estoque_reservado') + quantidade
+        ).update(
+            estoque=models.F('estoque') - quantidade,
+            updated_at=timezone.now()
+        )
+        self.refresh_from_db(fields=['estoque', 'estoque_reservado', 'updated_at'])
+        return atualizados == 1
     
     def aumentar_estoque(self, quantidade):
         """Aumenta o estoque do produto (para devoluções)"""
-        self.estoque += quantidade
-        self.save()
+        Produto.objects.filter(pk=self.pk).update(
+            estoque=models.F('estoque') + quantidade,
+            updated_at=timezone.now()
+        )
+        self.refresh_from_db(fields=['estoque', 'updated_at'])
 
 class Carrito(models.Model):
     id = models.BigAutoField(primary_key=True)
@@ -126,12 +143,22 @@ class Carrito(models.Model):
     produto_id = models.BigIntegerField()
     quantidade = models.IntegerField(default=1)
     preco_unitario = models.DecimalField(max_digits=10, decimal_places=2)
+    reservado_ate = models.DateTimeField(null=True, blank=True)  # Fim da reserva de estoque (nulo = sem reserva)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         db_table = 'carrito'
         ordering = ['-created_at']
+        indexes = [
+            models.Index(
+                fields=['reservado_ate'],
+                name='carrito_reserva_idx',
+                condition=models.Q(reservado_ate__isnull=False)
+            ),
+            models.Index(fields=['session_id', 'updated_at'], name='carrito_session_upd_idx'),
+            models.Index(fields=['updated_at'], name='carrito_updated_idx'),
+        ]
         constraints = [
             models.UniqueConstraint(
                 fields=['session_id', 'produto_id'],
@@ -162,6 +189,8 @@ class Carrito(models.Model):
 class Venta(models.Model):
     id = models.BigAutoField(primary_key=True)
     cliente_cedula = models.CharField(max_length=20, null=True, blank=True)  # Referencia directa por cédula
+    # Cidade do cliente no momento da venda (dimensão dos resumos); None = ainda não resolvida
+    cliente_cidade = models.CharField(max_length=50, null=True, blank=True)
     total = models.DecimalField(max_digits=10, decimal_places=2)
     fecha = models.DateTimeField(auto_now_add=True)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -170,6 +199,10 @@ class Venta(models.Model):
     class Meta:
         db_table = 'vendas'
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='vendas_created_id_idx'),
+            models.Index(fields=['cliente_cedula', 'created_at'], name='vendas_cliente_created_idx')
+        ]
 
     def __str__(self):
         return f"Venda #{self.id} - {self.cliente_cedula} - R$ {self.total}"
@@ -186,6 +219,71 @@ class VentaItem(models.Model):
     class Meta:
         db_table = 'detalles_venda'
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['venda_id'], name='detalles_venda_venda_idx'),
+            models.Index(fields=['produto_id', 'created_at'], name='detalles_venda_produto_idx')
+        ]
 
     def __str__(self):
         return f"Detalhe venda #{self.venda_id} - Produto #{self.produto_id} x{self.quantidade}"
+
+class ResumoVendas(models.Model):
+    """Totais de vendas pré-agregados por período e dimensão (mantidos a cada venda)"""
+    GRANULARIDADE_CHOICES = [
+        ('dia', 'Dia'),
+        ('mes', 'Mês'),
+    ]
+
+    DIMENSAO_CHOICES = [
+        ('total', 'Total'),
+        ('produto', 'Produto'),
+        ('cliente', 'Cliente'),
+        ('cidade', 'Cidade'),
+    ]
+
+    id = models.BigAutoField(primary_key=True)
+    granularidade = models.CharField(max_length=3, choices=GRANULARIDADE_CHOICES)
+    dimensao = models.CharField(max_length=10, choices=DIMENSAO_CHOICES)
+    periodo = models.DateField()  # Dia da venda ou primeiro dia do mês
+    chave = models.CharField(max_length=100, blank=True, default='')  # ID do produto, cédula, cidade ou fatia do total
+    quantidade = models.IntegerField(default=0)
+    total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    num_vendas = models.IntegerField(default=0)
+
+    class Meta:
+        db_table = 'resumo_vendas'
+        ordering = ['periodo', 'chave']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['granularidade', 'dimensao', 'periodo', 'chave'],
+                name='unique_resumo_vendas'
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.get_dimensao_display()} {self.chave} - {self.periodo} ({self.granularidade}): R$ {self.total}"
+
+class ChaveIdempotencia(models.Model):
+    """Resposta armazenada para um Idempotency-Key (replay de requisições repetidas)"""
+    id = models.BigAutoField(primary_key=True)
+    # Dono da chave (usuário autenticado ou sessão): a mesma chave de outro cliente não reaproveita a resposta
+    escopo = models.CharField(max_length=100, default='', blank=True)
+    chave = models.CharField(max_length=255)
+    endpoint = models.CharField(max_length=100)
+    hash_requisicao = models.CharField(max_length=64)
+    status_code = models.IntegerField(null=True, blank=True)  # Nulo enquanto a requisição está em processamento
+    resposta = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expira_em = models.DateTimeField(db_index=True)
+
+    class Meta:
+        db_table = 'idempotencia'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['escopo', 'chave', 'endpoint'],
+                name='unique_idempotencia_escopo_chave'
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.endpoint} - {self.chave} ({self.status_code or 'em processamento'})"
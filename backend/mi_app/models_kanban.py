@@ -1,9 +1,20 @@
 """
 Modelos para Sistema Kanban com Automação WhatsApp
 """
-from django.db import models
+from django.db import models, transaction
+from django.db.models.functions import Greatest
 from django.utils import timezone
 from .models import Usuario, Cliente, Produto
+from . import rank
+
+
+class LimiteCardsError(Exception):
+    """A coluna destino já atingiu o limite de cards"""
+
+    def __init__(self, coluna_id, limite_cards=None):
+        self.coluna_id = coluna_id
+        self.limite_cards = limite_cards
+        super().__init__(f'A coluna destino atingiu o limite de {limite_cards} cards')
 
 
 class Kanban(models.Model):
@@ -26,6 +37,11 @@ class Kanban(models.Model):
     )
     data_criacao = models.DateTimeField(default=timezone.now, verbose_name="Data de Criação")
     ativo = models.BooleanField(default=True, verbose_name="Ativo")
+    versao = models.PositiveBigIntegerField(
+        default=1,
+        help_text="Incrementada a cada alteração de colunas, cards ou regras do quadro",
+        verbose_name="Versão"
+    )
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -50,6 +66,13 @@ class Coluna(models.Model):
     )
     nome = models.CharField(max_length=100, verbose_name="Nome da Coluna")
     ordem = models.IntegerField(default=0, verbose_name="Ordem")
+    rank = models.CharField(
+        max_length=rank.TAMANHO_MAXIMO,
+        default='',
+        blank=True,
+        help_text="Posição da coluna no quadro (ordem lexicográfica, ver mi_app/rank.py)",
+        verbose_name="Posição"
+    )
     cor = models.CharField(
         max_length=7,
         default='#3B82F6',
@@ -62,22 +85,39 @@ class Coluna(models.Model):
         help_text="Limite máximo de cards nesta coluna",
         verbose_name="Limite de Cards"
     )
+    cards_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        help_text="Total de cards na coluna, mantido a cada criação, movimentação e exclusão",
+        verbose_name="Total de Cards"
+    )
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         db_table = 'kanban_coluna'
-        ordering = ['ordem']
+        ordering = ['rank', 'id']
         verbose_name = 'Coluna'
         verbose_name_plural = 'Colunas'
         unique_together = [['kanban', 'ordem']]
+        indexes = [
+            models.Index(fields=['kanban', 'rank'], name='coluna_kanban_rank_idx'),
+            models.Index(fields=['kanban', 'updated_at'], name='coluna_kanban_updated_idx'),
+        ]
 
     def __str__(self):
         return f"{self.kanban.nome} - {self.nome}"
 
+    def save(self, *args, **kwargs):
+        # Novas colunas vão para o fim do quadro
+        if not self.rank:
+            ultimo = Coluna.objects.filter(kanban_id=self.kanban_id).order_by('-rank').values_list('rank', flat=True).first()
+            self.rank = rank.entre(ultimo, None)
+        super().save(*args, **kwargs)
+
     def total_cards(self):
         """Retorna o total de cards na coluna"""
-        return self.cards.count()
+        return self.cards_count
 
     def pode_adicionar_card(self):
         """Verifica se pode adicionar mais cards (respeita limite)"""
@@ -85,6 +125,25 @@ class Coluna(models.Model):
             return True
         return self.total_cards() < self.limite_cards
 
+    @staticmethod
+    def ocupar_vagas(coluna_id, quantidade=1):
+        """
+        Soma quantidade ao total de cards com um UPDATE condicional: só
+        aplica se o limite da coluna comportar (seguro sob concorrência)
+        """
+        atualizados = Coluna.objects.filter(
+            models.Q(limite_cards__isnull=True) | models.Q(limite_cards__gte=models.F('cards_count') + quantidade),
+            pk=coluna_id
+        ).update(cards_count=models.F('cards_count') + quantidade)
+        return atualizados == 1
+
+    @staticmethod
+    def liberar_vagas(coluna_id, quantidade=1):
+        """Subtrai quantidade do total de cards"""
+        Coluna.objects.filter(pk=coluna_id).update(
+            cards_count=Greatest(models.F('cards_count') - quantidade, 0)
+        )
+
 
 class Card(models.Model):
     """Cards/Tarefas do Kanban"""
@@ -142,6 +201,13 @@ class Card(models.Model):
         verbose_name="Prioridade"
     )
     ordem = models.IntegerField(default=0, verbose_name="Ordem")
+    rank = models.CharField(
+        max_length=rank.TAMANHO_MAXIMO,
+        default='',
+        blank=True,
+        help_text="Posição do card na coluna (ordem lexicográfica, ver mi_app/rank.py)",
+        verbose_name="Posição"
+    )
     data_criacao = models.DateTimeField(default=timezone.now, verbose_name="Data de Criação")
     data_movimentacao = models.DateTimeField(default=timezone.now, verbose_name="Última Movimentação")
 
@@ -150,13 +216,48 @@ class Card(models.Model):
 
     class Meta:
         db_table = 'kanban_card'
-        ordering = ['ordem', '-data_criacao']
+        ordering = ['rank', 'id']
         verbose_name = 'Card'
         verbose_name_plural = 'Cards'
+        indexes = [
+            models.Index(fields=['coluna', 'rank'], name='card_coluna_rank_idx'),
+            models.Index(fields=['rank', 'id'], name='card_rank_id_idx'),
+            models.Index(fields=['coluna', 'updated_at'], name='card_coluna_updated_idx'),
+        ]
 
     def __str__(self):
         return f"{self.titulo} ({self.coluna.nome})"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Coluna lida do banco, para atualizar os totais quando o card mudar de coluna
+        instance._coluna_id_original = instance.__dict__.get('coluna_id')
+        return instance
+
+    def save(self, *args, **kwargs):
+        """
+        Salva o card mantendo Coluna.cards_count
+
+        Raises:
+            LimiteCardsError: Se a coluna (nova ou destino) estiver cheia
+        """
+        # Novos cards vão para o fim da coluna
+        if not self.rank:
+            ultimo = Card.objects.filter(coluna_id=self.coluna_id).order_by('-rank').values_list('rank', flat=True).first()
+            self.rank = rank.entre(ultimo, None)
+
+        original = None if self._state.adding else getattr(self, '_coluna_id_original', None)
+        entrando = self._state.adding or (original is not None and original != self.coluna_id)
+        with transaction.atomic():
+            if entrando:
+                if not Coluna.ocupar_vagas(self.coluna_id):
+                    raise LimiteCardsError(self.coluna_id, self.coluna.limite_cards)
+                if original is not None:
+                    Coluna.liberar_vagas(original)
+            super().save(*args, **kwargs)
+        self._coluna_id_original = self.coluna_id
+
     def esta_atrasado(self):
         """Verifica se o card está atrasado"""
         if self.data_vencimento:
@@ -294,6 +395,9 @@ class HistoricoMovimentacao(models.Model):
         ordering = ['-data']
         verbose_name = 'Histórico de Movimentação'
         verbose_name_plural = 'Históricos de Movimentação'
+        indexes = [
+            models.Index(fields=['data', 'id'], name='historico_data_id_idx')
+        ]
 
     def __str__(self):
         origem = self.coluna_origem.nome if self.coluna_origem else 'Início'
@@ -301,6 +405,32 @@ class HistoricoMovimentacao(models.Model):
         return f"{self.card.titulo}: {origem} → {destino}"
 
 
+class RemocaoKanban(models.Model):
+    """Registro (tombstone) de colunas e cards excluídos, para a sincronização incremental"""
+    TIPO_CHOICES = [
+        ('coluna', 'Coluna'),
+        ('card', 'Card'),
+    ]
+
+    # Sem FK: o registro sobrevive à exclusão do quadro, da coluna e do card
+    kanban_id = models.BigIntegerField(verbose_name="Quadro")
+    tipo = models.CharField(max_length=10, choices=TIPO_CHOICES, verbose_name="Tipo")
+    objeto_id = models.BigIntegerField(verbose_name="ID Excluído")
+    removido_em = models.DateTimeField(default=timezone.now, verbose_name="Removido em")
+
+    class Meta:
+        db_table = 'kanban_remocao'
+        verbose_name = 'Remoção'
+        verbose_name_plural = 'Remoções'
+        indexes = [
+            models.Index(fields=['kanban_id', 'removido_em'], name='remocao_kanban_data_idx'),
+            models.Index(fields=['removido_em'], name='remocao_data_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_tipo_display()} {self.objeto_id} (quadro {self.kanban_id})"
+
+
 class LogNotificacao(models.Model):
     """Log de notificações WhatsApp enviadas"""
     STATUS_CHOICES = [
@@ -346,6 +476,134 @@ class LogNotificacao(models.Model):
         ordering = ['-data_envio']
         verbose_name = 'Log de Notificação'
         verbose_name_plural = 'Logs de Notificações'
+        indexes = [
+            models.Index(fields=['data_envio', 'id'], name='log_notif_envio_id_idx')
+        ]
+
+    def __str__(self):
+        return f"{self.destinatario} - {self.status} ({self.data_envio.strftime('%d/%m/%Y %H:%M')})"
+
+
+class PermanenciaColuna(models.Model):
+    """Intervalo em que um card ficou numa coluna (mantido a cada criação, movimentação e exclusão)"""
+    card = models.ForeignKey(
+        Card,
+        on_delete=models.CASCADE,
+        related_name='permanencias',
+        verbose_name="Card"
+    )
+    coluna = models.ForeignKey(
+        Coluna,
+        on_delete=models.CASCADE,
+        related_name='permanencias',
+        verbose_name="Coluna"
+    )
+    entrada = models.DateTimeField(verbose_name="Entrada")
+    saida = models.DateTimeField(blank=True, null=True, verbose_name="Saída")  # Nula enquanto o card está na coluna
+
+    class Meta:
+        db_table = 'kanban_permanencia_coluna'
+        ordering = ['entrada', 'id']
+        verbose_name = 'Permanência em Coluna'
+        verbose_name_plural = 'Permanências em Colunas'
+        indexes = [
+            models.Index(fields=['card', 'saida'], name='permanencia_card_saida_idx'),
+        ]
+
+    def __str__(self):
+        return f"Card {self.card_id} na coluna {self.coluna_id}: {self.entrada} → {self.saida or 'atual'}"
+
+
+class FluxoDiarioColuna(models.Model):
+    """Entradas, saídas e tempos por coluna e dia (base do fluxo cumulativo e dos tempos de ciclo)"""
+    id = models.BigAutoField(primary_key=True)
+    # Sem FK: os totais são gravados também durante a exclusão em cascata do quadro e da coluna
+    kanban_id = models.BigIntegerField(verbose_name="Quadro")
+    coluna_id = models.BigIntegerField(verbose_name="Coluna")
+    data = models.DateField(verbose_name="Data")
+    entradas = models.IntegerField(default=0)
+    saidas = models.IntegerField(default=0)
+    segundos_permanencia = models.BigIntegerField(default=0)  # Soma das permanências encerradas no dia
+    segundos_ate_entrada = models.BigIntegerField(default=0)  # Soma da idade dos cards ao entrar na coluna
+
+    class Meta:
+        db_table = 'kanban_fluxo_diario'
+        ordering = ['data', 'coluna_id']
+        verbose_name = 'Fluxo Diário'
+        verbose_name_plural = 'Fluxos Diários'
+        constraints = [
+            models.UniqueConstraint(fields=['coluna_id', 'data'], name='unique_fluxo_coluna_dia')
+        ]
+        indexes = [
+            models.Index(fields=['kanban_id', 'data'], name='fluxo_kanban_data_idx'),
+        ]
+
+    def __str__(self):
+        return f"Coluna {self.coluna_id} - {self.data}: +{self.entradas} -{self.saidas}"
+
+
+class HistoricoMovimentacaoArquivo(models.Model):
+    """
+    Movimentações antigas retiradas de kanban_historico_movimentacao
+
+    Sem FKs e com o quadro e os nomes copiados no arquivamento: a consulta
+    não precisa de joins e o registro sobrevive à exclusão do card.
+    """
+    id = models.BigIntegerField(primary_key=True)  # Mesmo ID do registro original
+    kanban_id = models.BigIntegerField(null=True, verbose_name="Quadro")
+    card_id = models.BigIntegerField(verbose_name="Card")
+    card_titulo = models.CharField(max_length=200, verbose_name="Título do Card")
+    coluna_origem_id = models.BigIntegerField(null=True, verbose_name="Coluna Origem")
+    coluna_origem_nome = models.CharField(max_length=100, blank=True, null=True)
+    coluna_destino_id = models.BigIntegerField(null=True, verbose_name="Coluna Destino")
+    coluna_destino_nome = models.CharField(max_length=100, blank=True, null=True)
+    usuario_id = models.UUIDField(null=True, verbose_name="Usuário")
+    usuario_nome = models.CharField(max_length=255, blank=True, null=True)
+    data = models.DateTimeField(verbose_name="Data")
+    observacao = models.TextField(blank=True, null=True, verbose_name="Observação")
+    arquivado_em = models.DateTimeField(default=timezone.now, verbose_name="Arquivado em")
+
+    class Meta:
+        db_table = 'kanban_historico_arquivo'
+        ordering = ['-data']
+        verbose_name = 'Histórico Arquivado'
+        verbose_name_plural = 'Históricos Arquivados'
+        indexes = [
+            models.Index(fields=['data', 'id'], name='hist_arq_data_id_idx'),
+            models.Index(fields=['kanban_id', 'data'], name='hist_arq_kanban_data_idx'),
+            models.Index(fields=['card_id', 'data'], name='hist_arq_card_data_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.card_titulo}: {self.coluna_origem_nome or 'Início'} → {self.coluna_destino_nome or 'Desconhecido'}"
+
+
+class LogNotificacaoArquivo(models.Model):
+    """Notificações antigas retiradas de kanban_log_notificacao (mesmo formato compacto do histórico arquivado)"""
+    id = models.BigIntegerField(primary_key=True)  # Mesmo ID do registro original
+    kanban_id = models.BigIntegerField(null=True, verbose_name="Quadro")
+    card_id = models.BigIntegerField(verbose_name="Card")
+    card_titulo = models.CharField(max_length=200, verbose_name="Título do Card")
+    regra_id = models.BigIntegerField(null=True, verbose_name="Regra")
+    regra_nome = models.CharField(max_length=200, blank=True, null=True)
+    destinatario = models.CharField(max_length=20, verbose_name="Destinatário")
+    mensagem = models.TextField(verbose_name="Mensagem")
+    status = models.CharField(max_length=10, choices=LogNotificacao.STATUS_CHOICES, verbose_name="Status")
+    erro_mensagem = models.TextField(blank=True, null=True, verbose_name="Mensagem de Erro")
+    data_envio = models.DateTimeField(verbose_name="Data de Envio")
+    tentativas = models.IntegerField(default=0, verbose_name="Tentativas")
+    arquivado_em = models.DateTimeField(default=timezone.now, verbose_name="Arquivado em")
+
+    class Meta:
+        db_table = 'kanban_log_notificacao_arquivo'
+        ordering = ['-data_envio']
+        verbose_name = 'Log de Notificação Arquivado'
+        verbose_name_plural = 'Logs de Notificações Arquivados'
+        indexes = [
+            models.Index(fields=['data_envio', 'id'], name='log_arq_envio_id_idx'),
+            models.Index(fields=['kanban_id', 'data_envio'], name='log_arq_kanban_envio_idx'),
+            models.Index(fields=['card_id', 'data_envio'], name='log_arq_card_envio_idx'),
+        ]
 
     def __str__(self):
         return f"{self.destinatario} - {self.status} ({self.data_envio.strftime('%d/%m/%Y %H:%M')})"
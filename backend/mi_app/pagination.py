@@ -0,0 +1,197 @@
+import json
+
+from django.db import connections
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import Cursor, CursorPagination, _reverse_ordering
+from rest_framework.response import Response
+
+
+class CursorPaginacao(CursorPagination):
+    """
+    Paginação por cursor (keyset) sobre a ordenação de cada endpoint
+
+    É ativada quando a requisição envia ``cursor`` ou ``tamanho``; sem
+    esses parâmetros o endpoint continua devolvendo a lista completa, como
+    o frontend atual espera. A ordenação vem do atributo
+    ``ordenacao_cursor`` da view. Com ``contar=1`` a resposta inclui um
+    ``total_estimado`` obtido do planejador do PostgreSQL, sem COUNT(*).
+
+    Diferente do CursorPagination do DRF (que busca só pelo primeiro campo
+    e usa OFFSET nos empates), o cursor guarda todos os campos da ordenação
+    e a página seguinte é (a, b) > (x, y), então empates no primeiro campo
+    não repetem nem pulam registros. O último campo da ordenação deve ser
+    único e nenhum deles pode ser nulo.
+    """
+    page_size = 50
+    page_size_query_param = 'tamanho'
+    max_page_size = 500
+    ordering = ('-created_at', '-id')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.cursor_query_param not in request.query_params and \
+                self.page_size_query_param not in request.query_params:
+            return None
+
+        self.total_estimado = None
+        if request.query_params.get('contar') in ('1', 'true'):
+            self.total_estimado = self._total_estimado(queryset)
+
+        self.page_size = self.get_page_size(request)
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+        reverse = self.cursor is not None and self.cursor.reverse
+        self.posicao = self._ler_posicao(self.cursor)
+
+        ordenacao = _reverse_ordering(self.ordering) if reverse else self.ordering
+        queryset = queryset.order_by(*ordenacao)
+        if self.posicao is not None:
+            queryset = queryset.filter(self._depois_de(ordenacao, self.posicao))
+
+        resultados = list(queryset[:self.page_size + 1])
+        self.page = resultados[:self.page_size]
+        tem_mais = len(resultados) > self.page_size
+
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = self.posicao is not None, tem_mais
+        else:
+            self.has_next, self.has_previous = tem_mais, self.posicao is not None
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        posicao = self._posicao(self.page[-1]) if self.page else self.posicao
+        return self.encode_cursor(Cursor(offset=0, reverse=False, position=json.dumps(posicao)))
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        posicao = self._posicao(self.page[0]) if self.page else self.posicao
+        return self.encode_cursor(Cursor(offset=0, reverse=True, position=json.dumps(posicao)))
+
+    def get_ordering(self, request, queryset, view):
+        return getattr(view, 'ordenacao_cursor', self.ordering)
+
+    def _posicao(self, instancia):
+        """Valores de todos os campos da ordenação (como texto) de um registro"""
+        return [str(getattr(instancia, campo.lstrip('-'))) for campo in self.ordering]
+
+    def _ler_posicao(self, cursor):
+        if cursor is None or cursor.position is None:
+            return None
+        try:
+            posicao = json.loads(cursor.position)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(posicao, list) or len(posicao) != len(self.ordering) or \
+                not all(isinstance(valor, str) for valor in posicao):
+            raise NotFound(self.invalid_cursor_message)
+        return posicao
+
+    @staticmethod
+    def _depois_de(ordenacao, posicao):
+        """
+        Registros depois da posição na ordenação dada: (a, b) > (x, y)
+
+        Expandido em a > x OR (a = x AND b > y), com a >= x repetido fora do
+        OR para que o banco use o índice da ordenação como faixa.
+        """
+        campos = [(campo.lstrip('-'), 'lt' if campo.startswith('-') else 'gt') for campo in ordenacao]
+        condicao = Q()
+        iguais = {}
+        for (campo, operador), valor in zip(campos, posicao):
+            condicao |= Q(**iguais, **{f'{campo}__{operador}': valor})
+            iguais[campo] = valor
+        primeiro, operador = campos[0]
+        return Q(**{f'{primeiro}__{operador}e': posicao[0]}) & condicao
+
+    def get_paginated_response(self, data):
+        resposta = {
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        }
+        if self.total_estimado is not None:
+            resposta['total_estimado'] = self.total_estimado
+        return Response(resposta)
+
+    @staticmethod
+    def _total_estimado(queryset):
+        """Estimativa de linhas do planejador (PostgreSQL); COUNT exato nos demais bancos"""
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql' or isinstance(queryset, ConsultaComArquivo):
+            return queryset.count()
+
+        sql, params = queryset.order_by().query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+            plano = cursor.fetchone()[0]
+        if isinstance(plano, str):
+            plano = json.loads(plano)
+        return int(plano[0]['Plan']['Plan Rows'])
+
+
+class ConsultaComArquivo:
+    """
+    Registros da tabela principal seguidos dos arquivados, como uma única consulta
+
+    O arquivo só recebe registros mais antigos que os da tabela principal,
+    então ordenar cada parte pela data e concatenar mantém a ordem geral.
+    Implementa o necessário de QuerySet para a CursorPaginacao (order_by,
+    filter e fatias) e para get_object (get). Os filtros são aplicados às
+    duas partes, que devem ter os mesmos nomes de campo.
+    """
+
+    def __init__(self, recentes, arquivados):
+        self.recentes = recentes
+        self.arquivados = arquivados
+        self.model = recentes.model
+        self.db = recentes.db
+
+    def _partes(self):
+        # Ordem crescente (página anterior do cursor): arquivados primeiro
+        ordenacao = self.recentes.query.order_by
+        if ordenacao and not str(ordenacao[0]).startswith('-'):
+            return self.arquivados, self.recentes
+        return self.recentes, self.arquivados
+
+    def order_by(self, *campos):
+        return ConsultaComArquivo(self.recentes.order_by(*campos), self.arquivados.order_by(*campos))
+
+    def filter(self, *args, **kwargs):
+        return ConsultaComArquivo(self.recentes.filter(*args, **kwargs), self.arquivados.filter(*args, **kwargs))
+
+    def get(self, **kwargs):
+        for parte in (self.recentes, self.arquivados):
+            try:
+                return parte.get(**kwargs)
+            except parte.model.DoesNotExist:
+                pass
+        raise self.model.DoesNotExist(f'{self.model._meta.object_name} não encontrado')
+
+    def count(self):
+        return self.recentes.count() + self.arquivados.count()
+
+    def __iter__(self):
+        primeira, segunda = self._partes()
+        yield from primeira
+        yield from segunda
+
+    def __getitem__(self, indice):
+        if not isinstance(indice, slice):
+            return self[indice:indice + 1][0]
+        inicio, fim = indice.start or 0, indice.stop
+        primeira, segunda = self._partes()
+        itens = list(primeira[inicio:fim])
+        if fim is not None and len(itens) == fim - inicio:
+            return itens
+        # A primeira parte acabou: continua na segunda descontando o que ela tinha
+        tamanho = inicio + len(itens) if itens or not inicio else primeira.count()
+        deslocamento = max(inicio - tamanho, 0)
+        return itens + list(segunda[deslocamento:None if fim is None else fim - tamanho])
@@ -0,0 +1,114 @@
+"""
+Ordenação fracionária (rank) de colunas e cards do Kanban
+
+Cada item guarda uma string em base 36 ('0'-'9', 'a'-'z') e a ordem é a
+ordem lexicográfica dessas strings. Para inserir ou mover um item basta
+calcular uma string entre as dos vizinhos, sem renumerar os demais. Só são
+usados dígitos e letras minúsculas, que têm a mesma ordem no SQLite e nas
+collations do PostgreSQL.
+
+Um rank nunca termina em '0' (sempre existe espaço antes dele). Inserções
+repetidas no mesmo ponto aumentam o tamanho das strings; o rebalanceamento
+(espalhados) redistribui os ranks de uma coluna com tamanho mínimo.
+"""
+
+ALFABETO = '0123456789abcdefghijklmnopqrstuvwxyz'
+BASE = len(ALFABETO)
+
+# Tamanho máximo do campo e tamanho a partir do qual a coluna deve ser rebalanceada
+TAMANHO_MAXIMO = 64
+LIMIAR_REBALANCEAMENTO = 24
+
+
+def entre(antes=None, depois=None):
+    """
+    Rank estritamente entre antes e depois
+
+    Args:
+        antes (str, optional): Rank do item anterior (None = início da lista)
+        depois (str, optional): Rank do item seguinte (None = fim da lista)
+
+    Returns:
+        str: Novo rank
+
+    Raises:
+        ValueError: Se antes não for menor que depois
+    """
+    antes = antes or ''
+    depois = depois or None
+    if depois is not None and antes >= depois:
+        raise ValueError(f'Rank anterior ({antes!r}) deve ser menor que o seguinte ({depois!r})')
+
+    # Inserção no fim ou no início: avança/recua um dígito do prefixo mais curto possível,
+    # para que adicionar cards sempre no fim não faça os ranks crescerem rapidamente
+    if depois is None and antes:
+        for posicao, caractere in enumerate(antes):
+            digito = ALFABETO.index(caractere)
+            if digito < BASE - 1:
+                return antes[:posicao] + ALFABETO[digito + 1]
+        return antes + ALFABETO[1]
+    elif depois is not None and not antes:
+        for posicao, caractere in enumerate(depois):
+            digito = ALFABETO.index(caractere)
+            if digito > 1:
+                return depois[:posicao] + ALFABETO[digito - 1]
+
+    resultado = ''
+    posicao = 0
+    while True:
+        digito_antes = ALFABETO.index(antes[posicao]) if posicao < len(antes) else 0
+        digito_depois = ALFABETO.index(depois[posicao]) if depois is not None else BASE
+        if digito_antes == digito_depois:
+            resultado += ALFABETO[digito_antes]
+            posicao += 1
+            continue
+        meio = (digito_antes + digito_depois) // 2
+        if meio > digito_antes:
+            return resultado + ALFABETO[meio]
+        # Dígitos vizinhos: fixa o menor e procura espaço na próxima posição, já sem limite superior
+        resultado += ALFABETO[digito_antes]
+        posicao += 1
+        depois = None
+
+
+def varios_entre(antes=None, depois=None, quantidade=1):
+    """
+    Ranks crescentes, todos entre antes e depois, para inserir um bloco de itens
+
+    A divisão é feita ao meio recursivamente, então o tamanho dos ranks cresce
+    com log2(quantidade) e não com a quantidade.
+    """
+    if quantidade <= 0:
+        return []
+    meio = entre(antes, depois)
+    metade = (quantidade - 1) // 2
+    return varios_entre(antes, meio, metade) + [meio] + varios_entre(meio, depois, quantidade - 1 - metade)
+
+
+def espalhados(quantidade):
+    """
+    Ranks crescentes e igualmente espaçados para uma lista inteira
+
+    Usado na criação inicial e no rebalanceamento: todos os ranks têm o
+    menor tamanho possível e sobra espaço entre quaisquer dois vizinhos.
+    """
+    if quantidade <= 0:
+        return []
+    tamanho = 1
+    while BASE ** tamanho <= quantidade * 2:
+        tamanho += 1
+    intervalo = BASE ** tamanho
+
+    ranks = []
+    for indice in range(1, quantidade + 1):
+        valor = indice * intervalo // (quantidade + 1)
+        digitos = ''
+        for _ in range(tamanho):
+            valor, resto = divmod(valor, BASE)
+            digitos = ALFABETO[resto] + digitos
+        ranks.append(digitos.rstrip('0'))
+    return ranks
+
+
+def precisa_rebalancear(rank):
+    return len(rank) > LIMIAR_REBALANCEAMENTO
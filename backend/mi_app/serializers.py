@@ -1,12 +1,101 @@
 from rest_framework import serializers
+from django.db import models
+from django.db.models import Count, OuterRef, Prefetch, Subquery, Sum
+from django.db.models.functions import Coalesce
 from django.contrib.auth import get_user_model
 from django.contrib.auth.password_validation import validate_password
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 from .models import Cliente, Categoria, Produto, Venta, VentaItem, Carrito
-from .models_kanban import Kanban, Coluna, Card, RegraAutomacao, HistoricoMovimentacao, LogNotificacao
+from .models_kanban import (
+    Kanban, Coluna, Card, RegraAutomacao, HistoricoMovimentacao, HistoricoMovimentacaoArquivo,
+    LogNotificacao, LogNotificacaoArquivo
+)
 
 Usuario = get_user_model()
 
+
+class CacheRequisicao:
+    """
+    Identity map por requisição usado pelos serializers para carregar
+    produtos, clientes e itens de venda em lote (evita consultas N+1).
+    Fica no request quando disponível, para ser compartilhado por todos
+    os serializers da mesma requisição.
+    """
+
+    def __init__(self):
+        self.produtos = {}
+        self.clientes_nomes = {}
+        self.items_venda = {}
+
+    @classmethod
+    def obter(cls, context):
+        request = context.get('request')
+        if request is None:
+            return context.setdefault('_cache_requisicao', cls())
+        cache = getattr(request, '_cache_requisicao', None)
+        if cache is None:
+            cache = cls()
+            request._cache_requisicao = cache
+        return cache
+
+    def carregar_produtos(self, produto_ids):
+        """Carrega em uma consulta os produtos ainda não conhecidos"""
+        faltantes = {pid for pid in produto_ids if pid is not None} - self.produtos.keys()
+        if faltantes:
+            encontrados = Produto.objects.in_bulk(faltantes)
+            for produto_id in faltantes:
+                self.produtos[produto_id] = encontrados.get(produto_id)
+
+    def produto(self, produto_id):
+        self.carregar_produtos([produto_id])
+        return self.produtos.get(produto_id)
+
+    def descartar_produtos(self, produto_ids):
+        """Esquece produtos alterados na requisição para que sejam relidos"""
+        for produto_id in produto_ids:
+            self.produtos.pop(produto_id, None)
+
+    def carregar_clientes(self, cedulas):
+        """Carrega em uma consulta os nomes dos clientes ainda não conhecidos"""
+        faltantes = {cedula for cedula in cedulas if cedula} - self.clientes_nomes.keys()
+        if faltantes:
+            nomes = dict(Cliente.objects.filter(cedula__in=faltantes).values_list('cedula', 'nome'))
+            for cedula in faltantes:
+                self.clientes_nomes[cedula] = nomes.get(cedula)
+
+    def cliente_nome(self, cedula):
+        self.carregar_clientes([cedula])
+        return self.clientes_nomes.get(cedula)
+
+    def carregar_items_venda(self, venda_ids):
+        """Carrega em uma consulta os itens das vendas e, em outra, os seus produtos"""
+        faltantes = set(venda_ids) - self.items_venda.keys()
+        if not faltantes:
+            return
+        for venda_id in faltantes:
+            self.items_venda[venda_id] = []
+        items = VentaItem.objects.filter(venda_id__in=faltantes).order_by('-created_at')
+        for item in items:
+            self.items_venda[item.venda_id].append(item)
+        self.carregar_produtos({item.produto_id for item in items})
+
+    def items_de_venda(self, venda_id):
+        self.carregar_items_venda([venda_id])
+        return self.items_venda[venda_id]
+
+    def carregar_vendas(self, vendas):
+        self.carregar_items_venda([venda.id for venda in vendas])
+        self.carregar_clientes([venda.cliente_cedula for venda in vendas])
+
+
+class CarregamentoEmLoteListSerializer(serializers.ListSerializer):
+    """ListSerializer que pré-carrega as relações de todos os objetos antes de serializar"""
+
+    def to_representation(self, data):
+        objetos = list(data.all() if isinstance(data, models.manager.BaseManager) else data)
+        self.child.carregar_em_lote(CacheRequisicao.obter(self.context), objetos)
+        return super().to_representation(objetos)
+
 class UsuarioSerializer(serializers.ModelSerializer):
     password = serializers.CharField(write_only=True, required=False, validators=[validate_password])
     is_admin = serializers.SerializerMethodField()
@@ -84,9 +173,9 @@ class ProdutoSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Produto
-        fields = ['id', 'nome', 'descricao', 'preco', 'estoque', 'imagem_url', 
+        fields = ['id', 'nome', 'descricao', 'preco', 'estoque', 'estoque_reservado', 'imagem_url', 
                  'categoria', 'categoria_nome', 'cliente', 'cliente_nome', 'created_at', 'updated_at']
-        read_only_fields = ['created_at', 'updated_at']
+        read_only_fields = ['created_at', 'updated_at', 'estoque_reservado']
 
     def validate_preco(self, value):
         if value <= 0:
@@ -109,28 +198,35 @@ class CarritoSerializer(serializers.ModelSerializer):
         model = Carrito
         fields = ['id', 'session_id', 'usuario_id', 'produto_id', 'produto_nome', 
                  'produto_preco', 'produto_imagem', 'produto_estoque', 'quantidade', 
-                 'preco_unitario', 'subtotal', 'created_at', 'updated_at']
-        read_only_fields = ['created_at', 'updated_at', 'subtotal', 'preco_unitario']
+                 'preco_unitario', 'subtotal', 'reservado_ate', 'created_at', 'updated_at']
+        read_only_fields = ['created_at', 'updated_at', 'subtotal', 'preco_unitario', 'reservado_ate']
+        list_serializer_class = CarregamentoEmLoteListSerializer
         extra_kwargs = {
             'usuario_id': {'required': False, 'allow_null': True},
             'preco_unitario': {'required': False}
         }
 
+    def carregar_em_lote(self, cache, items):
+        cache.carregar_produtos({item.produto_id for item in items})
+
+    def _produto(self, obj):
+        return CacheRequisicao.obter(self.context).produto(obj.produto_id)
+
     def get_produto_nome(self, obj):
-        produto = obj.get_produto()
+        produto = self._produto(obj)
         return produto.nome if produto else None
 
     def get_produto_preco(self, obj):
-        produto = obj.get_produto()
+        produto = self._produto(obj)
         return produto.preco if produto else None
 
     def get_produto_imagem(self, obj):
-        produto = obj.get_produto()
+        produto = self._produto(obj)
         return produto.imagem_url if produto else None
     
     def get_produto_estoque(self, obj):
-        produto = obj.get_produto()
-        return produto.estoque if produto else 0
+        produto = self._produto(obj)
+        return produto.estoque_disponivel if produto else 0
     
     def get_subtotal(self, obj):
         return obj.get_subtotal()
@@ -139,16 +235,16 @@ class CarritoSerializer(serializers.ModelSerializer):
         produto_id = data.get('produto_id')
         quantidade = data.get('quantidade', 1)
         
-        try:
-            produto = Produto.objects.get(id=produto_id)
-            if not produto.tem_estoque(quantidade):
-                raise serializers.ValidationError(
-                    f"Estoque insuficiente. Apenas {produto.estoque} unidades disponíveis."
-                )
-            # Estabelecer o preço unitário atual do produto
-            data['preco_unitario'] = produto.preco
-        except Produto.DoesNotExist:
+        produto = CacheRequisicao.obter(self.context).produto(produto_id)
+        if produto is None:
             raise serializers.ValidationError("O produto não existe.")
+        # O estoque livre é conferido pela reserva na view (reservas vencidas ainda podem ser liberadas)
+        if quantidade > produto.estoque:
+            raise serializers.ValidationError(
+                f"Estoque insuficiente. Apenas {produto.estoque} unidades disponíveis."
+            )
+        # Estabelecer o preço unitário atual do produto
+        data['preco_unitario'] = produto.preco
         
         return data
 
@@ -162,27 +258,25 @@ class VentaItemSerializer(serializers.ModelSerializer):
         fields = ['id', 'venda_id', 'produto_id', 'produto_nome', 'produto_preco', 'produto_imagem', 
                  'quantidade', 'preco_unitario', 'created_at', 'updated_at']
         read_only_fields = ['created_at', 'updated_at']
+        list_serializer_class = CarregamentoEmLoteListSerializer
+
+    def carregar_em_lote(self, cache, items):
+        cache.carregar_produtos({item.produto_id for item in items})
+
+    def _produto(self, obj):
+        return CacheRequisicao.obter(self.context).produto(obj.produto_id)
 
     def get_produto_nome(self, obj):
-        try:
-            produto = Produto.objects.get(id=obj.produto_id)
-            return produto.nome
-        except Produto.DoesNotExist:
-            return None
+        produto = self._produto(obj)
+        return produto.nome if produto else None
 
     def get_produto_preco(self, obj):
-        try:
-            produto = Produto.objects.get(id=obj.produto_id)
-            return produto.preco
-        except Produto.DoesNotExist:
-            return None
+        produto = self._produto(obj)
+        return produto.preco if produto else None
 
     def get_produto_imagem(self, obj):
-        try:
-            produto = Produto.objects.get(id=obj.produto_id)
-            return produto.imagem_url
-        except Produto.DoesNotExist:
-            return None
+        produto = self._produto(obj)
+        return produto.imagem_url if produto else None
 
     def validate_quantidade(self, value):
         if value <= 0:
@@ -198,18 +292,18 @@ class VentaSerializer(serializers.ModelSerializer):
         fields = ['id', 'cliente_cedula', 'cliente_nome', 'total', 'fecha', 
                  'items', 'created_at', 'updated_at']
         read_only_fields = ['created_at', 'updated_at']
+        list_serializer_class = CarregamentoEmLoteListSerializer
+
+    def carregar_em_lote(self, cache, vendas):
+        cache.carregar_vendas(vendas)
 
     def get_items(self, obj):
-        # Obter os itens de venda manualmente usando venda_id
-        items = VentaItem.objects.filter(venda_id=obj.id)
-        return VentaItemSerializer(items, many=True).data
+        # Itens (e produtos) vêm do cache da requisição, carregados em lote
+        items = CacheRequisicao.obter(self.context).items_de_venda(obj.id)
+        return VentaItemSerializer(items, many=True, context=self.context).data
 
     def get_cliente_nome(self, obj):
-        try:
-            cliente = Cliente.objects.get(cedula=obj.cliente_cedula)
-            return cliente.nome
-        except Cliente.DoesNotExist:
-            return None
+        return CacheRequisicao.obter(self.context).cliente_nome(obj.cliente_cedula)
 
     def create(self, validated_data):
         # Os itens serão criados separadamente usando VentaItemSerializer
@@ -233,9 +327,9 @@ class ColunaSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Coluna
-        fields = ['id', 'kanban', 'nome', 'ordem', 'cor', 'limite_cards',
+        fields = ['id', 'kanban', 'nome', 'ordem', 'rank', 'cor', 'limite_cards',
                  'total_cards', 'pode_adicionar', 'created_at', 'updated_at']
-        read_only_fields = ['created_at', 'updated_at']
+        read_only_fields = ['created_at', 'updated_at', 'rank']
 
     def get_total_cards(self, obj):
         return obj.total_cards()
@@ -258,9 +352,9 @@ class CardSerializer(serializers.ModelSerializer):
         fields = ['id', 'coluna', 'coluna_nome', 'titulo', 'descricao',
                  'cliente', 'cliente_nome', 'produto', 'produto_nome',
                  'responsavel', 'responsavel_nome', 'data_vencimento',
-                 'prioridade', 'ordem', 'esta_atrasado', 'dias_vencimento',
+                 'prioridade', 'ordem', 'rank', 'esta_atrasado', 'dias_vencimento',
                  'data_criacao', 'data_movimentacao', 'created_at', 'updated_at']
-        read_only_fields = ['created_at', 'updated_at', 'data_criacao', 'data_movimentacao']
+        read_only_fields = ['created_at', 'updated_at', 'data_criacao', 'data_movimentacao', 'rank']
 
     def get_esta_atrasado(self, obj):
         return obj.esta_atrasado()
@@ -269,15 +363,26 @@ class CardSerializer(serializers.ModelSerializer):
         return obj.dias_para_vencimento()
 
     def validate(self, data):
-        # Validar se a coluna pode receber mais cards
+        # Validar se a coluna pode receber mais cards (o card já contado nela não conta de novo)
         coluna = data.get('coluna')
-        if coluna and not coluna.pode_adicionar_card():
+        mudando_de_coluna = self.instance is None or self.instance.coluna_id != getattr(coluna, 'id', None)
+        if coluna and mudando_de_coluna and not coluna.pode_adicionar_card():
             raise serializers.ValidationError(
                 f"A coluna '{coluna.nome}' atingiu o limite de {coluna.limite_cards} cards."
             )
         return data
 
 
+class CardBuscaSerializer(CardSerializer):
+    """Resultado de /api/cards/busca/: card com o quadro e a relevância"""
+    kanban = serializers.IntegerField(source='coluna.kanban_id', read_only=True)
+    kanban_nome = serializers.CharField(source='coluna.kanban.nome', read_only=True)
+    relevancia = serializers.FloatField(read_only=True)
+
+    class Meta(CardSerializer.Meta):
+        fields = CardSerializer.Meta.fields + ['kanban', 'kanban_nome', 'relevancia']
+
+
 class KanbanSerializer(serializers.ModelSerializer):
     """Serializer para Quadro Kanban"""
     criado_por_nome = serializers.CharField(source='criado_por.nome', read_only=True)
@@ -293,10 +398,27 @@ class KanbanSerializer(serializers.ModelSerializer):
         read_only_fields = ['created_at', 'updated_at', 'data_criacao', 'criado_por']
 
     def get_total_colunas(self, obj):
+        # Anotado por otimizar_queryset; na resposta de create/update conta direto
+        if hasattr(obj, 'colunas_anotadas'):
+            return obj.colunas_anotadas
         return obj.colunas.count()
 
     def get_total_cards(self, obj):
-        return Card.objects.filter(coluna__kanban=obj).count()
+        if hasattr(obj, 'cards_anotados'):
+            return obj.cards_anotados
+        return Coluna.objects.filter(kanban=obj).aggregate(total=Sum('cards_count'))['total'] or 0
+
+    @staticmethod
+    def otimizar_queryset(queryset):
+        """
+        Lista de quadros em uma consulta: criador e cliente por JOIN e os
+        totais de colunas e cards (somando Coluna.cards_count) por subconsultas
+        """
+        colunas = Coluna.objects.filter(kanban=OuterRef('pk')).order_by().values('kanban')
+        return queryset.select_related('criado_por', 'cliente').annotate(
+            colunas_anotadas=Coalesce(Subquery(colunas.annotate(total=Count('id')).values('total')), 0),
+            cards_anotados=Coalesce(Subquery(colunas.annotate(total=Sum('cards_count')).values('total')), 0),
+        )
 
 
 class KanbanCompletoSerializer(serializers.ModelSerializer):
@@ -327,17 +449,37 @@ class KanbanCompletoSerializer(serializers.ModelSerializer):
             }
         return None
 
+    @staticmethod
+    def otimizar_queryset(queryset):
+        """
+        Carrega o quadro inteiro em um número fixo de consultas: quadro, colunas
+        e cards (com cliente, produto e responsável); os cards são agrupados por
+        coluna em memória pelo prefetch.
+        """
+        cards = Card.objects.select_related('cliente', 'produto', 'responsavel').order_by('rank', 'id')
+        return queryset.select_related('cliente', 'criado_por').prefetch_related(
+            Prefetch('colunas', queryset=Coluna.objects.order_by('rank', 'id').prefetch_related(
+                Prefetch('cards', queryset=cards)
+            ))
+        )
+
     def get_colunas(self, obj):
-        colunas = obj.colunas.all().order_by('ordem')
-        return [{
-            'id': coluna.id,
-            'nome': coluna.nome,
-            'ordem': coluna.ordem,
-            'cor': coluna.cor,
-            'limite_cards': coluna.limite_cards,
-            'total_cards': coluna.total_cards(),
-            'cards': CardSerializer(coluna.cards.all().order_by('ordem', '-data_criacao'), many=True).data
-        } for coluna in colunas]
+        # Usa o prefetch de otimizar_queryset quando presente (a ordenação padrão dos modelos é a mesma)
+        colunas = obj.colunas.all()
+        resultado = []
+        for coluna in colunas:
+            cards = list(coluna.cards.all())
+            resultado.append({
+                'id': coluna.id,
+                'nome': coluna.nome,
+                'ordem': coluna.ordem,
+                'rank': coluna.rank,
+                'cor': coluna.cor,
+                'limite_cards': coluna.limite_cards,
+                'total_cards': len(cards),
+                'cards': CardSerializer(cards, many=True).data
+            })
+        return resultado
 
 
 class RegraAutomacaoSerializer(serializers.ModelSerializer):
@@ -383,6 +525,25 @@ class HistoricoMovimentacaoSerializer(serializers.ModelSerializer):
                  'data', 'observacao']
         read_only_fields = ['data']
 
+    def to_representation(self, instance):
+        # Listagens com ?incluir_arquivo=1 misturam registros ativos e arquivados
+        if isinstance(instance, HistoricoMovimentacaoArquivo):
+            return HistoricoMovimentacaoArquivoSerializer(instance, context=self.context).data
+        return super().to_representation(instance)
+
+
+class HistoricoMovimentacaoArquivoSerializer(serializers.ModelSerializer):
+    """Histórico arquivado, no mesmo formato de HistoricoMovimentacaoSerializer"""
+    card = serializers.IntegerField(source='card_id', read_only=True)
+    coluna_origem = serializers.IntegerField(source='coluna_origem_id', read_only=True)
+    coluna_destino = serializers.IntegerField(source='coluna_destino_id', read_only=True)
+    usuario = serializers.UUIDField(source='usuario_id', read_only=True)
+
+    class Meta:
+        model = HistoricoMovimentacaoArquivo
+        fields = HistoricoMovimentacaoSerializer.Meta.fields
+        read_only_fields = fields
+
 
 class LogNotificacaoSerializer(serializers.ModelSerializer):
     """Serializer para Log de Notificações WhatsApp"""
@@ -394,4 +555,20 @@ class LogNotificacaoSerializer(serializers.ModelSerializer):
         fields = ['id', 'card', 'card_titulo', 'regra', 'regra_nome',
                  'destinatario', 'mensagem', 'status', 'erro_mensagem',
                  'data_envio', 'tentativas']
-        read_only_fields = ['data_envio']
\ No newline at end of file
+        read_only_fields = ['data_envio']
+
+    def to_representation(self, instance):
+        if isinstance(instance, LogNotificacaoArquivo):
+            return LogNotificacaoArquivoSerializer(instance, context=self.context).data
+        return super().to_representation(instance)
+
+
+class LogNotificacaoArquivoSerializer(serializers.ModelSerializer):
+    """Log de notificação arquivado, no mesmo formato de LogNotificacaoSerializer"""
+    card = serializers.IntegerField(source='card_id', read_only=True)
+    regra = serializers.IntegerField(source='regra_id', read_only=True)
+
+    class Meta:
+        model = LogNotificacaoArquivo
+        fields = LogNotificacaoSerializer.Meta.fields
+        read_only_fields = fields
@@ -1,7 +1,35 @@
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+import csv
+import hashlib
+import base64
+import json
+import re
+import time
+import uuid
+from django.core.cache import cache, caches
 from django.core.mail import send_mail
 from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, connection, transaction
+from django.db.models import BooleanField, Case, Count, DateTimeField, Exists, F, FloatField, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Coalesce, Greatest, Length
 from django.template.loader import render_to_string
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from django.utils.html import strip_tags
+from rest_framework import status
+from .models import Carrito, ChaveIdempotencia, Cliente, Produto, ResumoVendas, Venta, VentaItem
+from .models_kanban import (
+    Card, Coluna, FluxoDiarioColuna, HistoricoMovimentacao, HistoricoMovimentacaoArquivo, Kanban,
+    LogNotificacao, LogNotificacaoArquivo, PermanenciaColuna, RemocaoKanban
+)
+from . import eventos
+from . import rank as ranks
 import logging
 
 logger = logging.getLogger(__name__)
@@ -139,4 +167,2475 @@ class NotificationService:
             
         except Exception as e:
             logger.error(f"Erro ao processar template: {str(e)}")
-            return template  # Retorna template original em caso de erro
\ No newline at end of file
+            return template  # Retorna template original em caso de erro
+
+
+class EstoqueService:
+    """Serviço para baixa e reposição atômica de estoque"""
+
+    class _BaixaIncompleta(Exception):
+        pass
+
+    @staticmethod
+    def baixar(quantidades, reservados=None, excluir=()):
+        """
+        Baixa o estoque de vários produtos em um único UPDATE condicional
+
+        A baixa só é aplicada se todos os produtos tiverem estoque livre
+        suficiente (UPDATE ... WHERE estoque - estoque_reservado >= n). Apenas
+        as linhas dos produtos são bloqueadas, nunca a tabela inteira, e não
+        há janela entre leitura e escrita: duas baixas concorrentes nunca
+        vendem a mesma unidade. Se faltar estoque livre, as reservas vencidas
+        dos produtos em falta são liberadas e o UPDATE é tentado mais uma vez.
+
+        Args:
+            quantidades (dict): Quantidade a baixar por ID de produto
+            reservados (dict, optional): Parte da quantidade que já estava
+                reservada pelo carrinho e é consumida (liberada) nesta baixa
+            excluir (iterable, optional): IDs das linhas de carrinho consumidas
+                nesta baixa, que não podem ser liberadas como vencidas
+
+        Returns:
+            list: IDs dos produtos sem estoque suficiente (vazia se a baixa foi aplicada)
+        """
+        quantidades = {produto_id: quantidade for produto_id, quantidade in quantidades.items() if quantidade}
+        if not quantidades:
+            return []
+        reservados = {
+            produto_id: quantidade for produto_id, quantidade in (reservados or {}).items()
+            if quantidade and produto_id in quantidades
+        }
+
+        falhas = EstoqueService._aplicar(quantidades, reservados)
+        if falhas and ReservaService.expirar(produto_ids=falhas, excluir=excluir):
+            falhas = EstoqueService._aplicar(quantidades, reservados)
+        return falhas
+
+    @staticmethod
+    def _aplicar(quantidades, reservados):
+        condicao = Q()
+        for produto_id, quantidade in quantidades.items():
+            necessario = quantidade - reservados.get(produto_id, 0)
+            condicao |= Q(id=produto_id, estoque__gte=F('estoque_reservado') + necessario)
+
+        campos = {
+            'estoque': EstoqueService._delta(quantidades, -1),
+            'updated_at': timezone.now(),
+        }
+        if reservados:
+            campos['estoque_reservado'] = Case(
+                *[When(id=produto_id, then=Greatest(F('estoque_reservado') - quantidade, 0))
+                  for produto_id, quantidade in reservados.items()],
+                default=F('estoque_reservado')
+            )
+
+        try:
+            with transaction.atomic():
+                atualizados = Produto.objects.filter(condicao).update(**campos)
+                if atualizados != len(quantidades):
+                    # Desfaz a baixa parcial dos produtos que tinham estoque
+                    raise EstoqueService._BaixaIncompleta()
+        except EstoqueService._BaixaIncompleta:
+            estoques = {
+                produto_id: estoque - reservado
+                for produto_id, estoque, reservado in Produto.objects.filter(id__in=quantidades)
+                                                                     .values_list('id', 'estoque', 'estoque_reservado')
+            }
+            falhas = [
+                produto_id for produto_id, quantidade in quantidades.items()
+                if estoques.get(produto_id, -1) + reservados.get(produto_id, 0) < quantidade
+            ]
+            # Se o estoque foi reposto entre o UPDATE e a consulta, reportar todos
+            return sorted(falhas or quantidades)
+
+        return []
+
+    @staticmethod
+    def repor(quantidades):
+        """
+        Repõe o estoque de vários produtos em um único UPDATE (devoluções)
+
+        Args:
+            quantidades (dict): Quantidade a repor por ID de produto
+        """
+        quantidades = {produto_id: quantidade for produto_id, quantidade in quantidades.items() if quantidade}
+        if not quantidades:
+            return
+        Produto.objects.filter(id__in=quantidades).update(
+            estoque=EstoqueService._delta(quantidades, 1),
+            updated_at=timezone.now()
+        )
+
+    @staticmethod
+    def _delta(quantidades, sinal):
+        return Case(
+            *[When(id=produto_id, then=F('estoque') + sinal * quantidade)
+              for produto_id, quantidade in quantidades.items()],
+            default=F('estoque')
+        )
+
+
+class ReservaService:
+    """Serviço para reservas temporárias de estoque feitas pelos carrinhos"""
+
+    LOTE_EXPIRACAO = 500
+
+    @staticmethod
+    def prazo():
+        """Fim da reserva para uma linha de carrinho criada ou alterada agora"""
+        return timezone.now() + timedelta(minutes=settings.CARRITO_RESERVA_MINUTOS)
+
+    class _ReservaIncompleta(Exception):
+        pass
+
+    @staticmethod
+    def reservar(produto_id, quantidade):
+        """
+        Reserva estoque livre de um produto com um UPDATE condicional
+
+        Args:
+            produto_id (int): ID do produto
+            quantidade (int): Quantidade a reservar
+
+        Returns:
+            bool: True se a reserva foi feita
+        """
+        return not ReservaService.ajustar({produto_id: quantidade})
+
+    @staticmethod
+    def liberar(produto_id, quantidade):
+        """Devolve ao estoque livre uma quantidade reservada"""
+        if quantidade > 0:
+            ReservaService.ajustar({produto_id: -quantidade})
+
+    @staticmethod
+    def ajustar(variacoes):
+        """
+        Aplica as variações de reserva de vários produtos em um único UPDATE
+
+        Variações positivas reservam (só se houver estoque livre), negativas
+        liberam. Ou todas são aplicadas ou nenhuma. Se faltar estoque livre,
+        as reservas vencidas dos produtos em falta são liberadas e o UPDATE
+        é tentado mais uma vez.
+
+        Args:
+            variacoes (dict): Variação da reserva por ID de produto
+
+        Returns:
+            list: IDs dos produtos sem estoque livre (vazia se as reservas foram aplicadas)
+        """
+        variacoes = {produto_id: variacao for produto_id, variacao in variacoes.items() if variacao}
+        if not variacoes:
+            return []
+
+        falhas = ReservaService._aplicar(variacoes)
+        if falhas and ReservaService.expirar(produto_ids=falhas):
+            falhas = ReservaService._aplicar(variacoes)
+        return falhas
+
+    @staticmethod
+    def _aplicar(variacoes):
+        condicao = Q()
+        for produto_id, variacao in variacoes.items():
+            if variacao > 0:
+                condicao |= Q(id=produto_id, estoque__gte=F('estoque_reservado') + variacao)
+            else:
+                condicao |= Q(id=produto_id)
+
+        try:
+            with transaction.atomic():
+                atualizados = Produto.objects.filter(condicao).update(
+                    estoque_reservado=ReservaService._variacao(variacoes)
+                )
+                if atualizados != len(variacoes):
+                    raise ReservaService._ReservaIncompleta()
+        except ReservaService._ReservaIncompleta:
+            livres = {
+                produto_id: estoque - reservado
+                for produto_id, estoque, reservado in Produto.objects.filter(id__in=variacoes)
+                                                                     .values_list('id', 'estoque', 'estoque_reservado')
+            }
+            falhas = [
+                produto_id for produto_id, variacao in variacoes.items()
+                if produto_id not in livres or livres[produto_id] < variacao
+            ]
+            return sorted(falhas or variacoes)
+
+        return []
+
+    @staticmethod
+    def _variacao(variacoes):
+        return Case(
+            *[When(id=produto_id, then=Greatest(F('estoque_reservado') + variacao, 0))
+              for produto_id, variacao in variacoes.items()],
+            default=F('estoque_reservado')
+        )
+
+    @staticmethod
+    def expirar(produto_ids=None, limite=LOTE_EXPIRACAO, excluir=()):
+        """
+        Libera um lote de reservas vencidas
+
+        As linhas bloqueadas por um checkout em andamento são ignoradas
+        (SKIP LOCKED) e ficam para o próximo lote.
+
+        Args:
+            produto_ids (list, optional): Restringe a estes produtos
+            limite (int): Máximo de linhas de carrinho processadas
+            excluir (iterable, optional): IDs de linhas de carrinho a manter
+                (as do próprio checkout, que a transação atual já bloqueou)
+
+        Returns:
+            int: Quantidade de linhas de carrinho liberadas
+        """
+        with transaction.atomic():
+            linhas = Carrito.objects.select_for_update(skip_locked=True).filter(
+                reservado_ate__lte=timezone.now()
+            )
+            if produto_ids is not None:
+                linhas = linhas.filter(produto_id__in=produto_ids)
+            if excluir:
+                linhas = linhas.exclude(id__in=excluir)
+            linhas = list(linhas.order_by('reservado_ate').values_list('id', 'produto_id', 'quantidade')[:limite])
+            if not linhas:
+                return 0
+
+            por_produto = defaultdict(int)
+            for _, produto_id, quantidade in linhas:
+                por_produto[produto_id] -= quantidade
+
+            Produto.objects.filter(id__in=por_produto).update(
+                estoque_reservado=ReservaService._variacao(por_produto)
+            )
+            Carrito.objects.filter(id__in=[linha[0] for linha in linhas]).update(reservado_ate=None)
+
+        return len(linhas)
+
+    @staticmethod
+    def reconciliar():
+        """Recalcula estoque_reservado de todos os produtos a partir dos carrinhos"""
+        reservas = Carrito.objects.filter(
+            produto_id=OuterRef('id'),
+            reservado_ate__isnull=False
+        ).order_by().values('produto_id').annotate(total=Sum('quantidade')).values('total')
+        return Produto.objects.update(estoque_reservado=Coalesce(Subquery(reservas), 0))
+
+
+class ResumoVendasService:
+    """Serviço para manter os totais de vendas pré-agregados (ResumoVendas)"""
+
+    LOTE_UPSERT = 500
+    # O total geral é dividido em fatias (chave = ID da venda % FATIAS_TOTAL) para que vendas
+    # simultâneas não disputem a mesma linha; a consulta soma as fatias de cada período
+    FATIAS_TOTAL = 16
+
+    @staticmethod
+    def aplicar(vendas, items, sinal=1):
+        """
+        Soma (ou subtrai, com sinal=-1) as vendas nos resumos diário e mensal
+
+        Os totais são acumulados em memória e gravados com um único
+        INSERT ... ON CONFLICT DO UPDATE por lote de chaves, então o custo
+        não depende de quantas vendas já existem.
+
+        Args:
+            vendas (list): Vendas (Venta) a aplicar
+            items (list): Itens (VentaItem) dessas vendas
+            sinal (int): 1 para vendas criadas, -1 para vendas excluídas
+        """
+        if not vendas:
+            return
+        items_por_venda = defaultdict(list)
+        for item in items:
+            items_por_venda[item.venda_id].append(item)
+
+        ResumoVendasService._resolver_cidades(vendas)
+        deltas = ResumoVendasService._deltas(vendas, items_por_venda, sinal)
+        # Linhas que chegam a zero vendas são mantidas e ignoradas na leitura
+        ResumoVendasService._upsert(deltas)
+
+    @staticmethod
+    def cidades(cedulas):
+        """Cidade atual de cada cliente ('' quando não informada ou cliente inexistente), para gravar na venda"""
+        cedulas = {cedula for cedula in cedulas if isinstance(cedula, str) and cedula}
+        if not cedulas:
+            return {}
+        cidades = dict.fromkeys(cedulas, '')
+        cidades.update(
+            (cedula, cidade or '')
+            for cedula, cidade in Cliente.objects.filter(cedula__in=cedulas).values_list('cedula', 'cidade')
+        )
+        return cidades
+
+    @staticmethod
+    def _resolver_cidades(vendas):
+        """
+        Grava a cidade do cliente nas vendas que ainda não a têm
+
+        A dimensão cidade usa a cidade gravada na venda, e não a atual do
+        cliente, para que excluir a venda desconte da mesma linha mesmo que o
+        cliente tenha mudado de cidade.
+        """
+        pendentes = [venda for venda in vendas if venda.cliente_cedula and venda.cliente_cidade is None]
+        if not pendentes:
+            return
+        cidades = ResumoVendasService.cidades(venda.cliente_cedula for venda in pendentes)
+        for venda in pendentes:
+            venda.cliente_cidade = cidades.get(venda.cliente_cedula, '')
+        Venta.objects.bulk_update(pendentes, ['cliente_cidade'])
+
+    @staticmethod
+    def _deltas(vendas, items_por_venda, sinal):
+        deltas = defaultdict(lambda: [0, Decimal('0'), 0])
+
+        for venda in vendas:
+            data = timezone.localtime(venda.created_at).date()
+            items = items_por_venda.get(venda.id, [])
+
+            dimensoes = [('total', str(venda.id % ResumoVendasService.FATIAS_TOTAL))]
+            if venda.cliente_cedula:
+                dimensoes.append(('cliente', venda.cliente_cedula))
+                if venda.cliente_cidade:
+                    dimensoes.append(('cidade', venda.cliente_cidade))
+
+            por_produto = defaultdict(lambda: [0, Decimal('0')])
+            for item in items:
+                if item.produto_id is None:
+                    continue
+                por_produto[str(item.produto_id)][0] += item.quantidade
+                por_produto[str(item.produto_id)][1] += item.quantidade * Decimal(item.preco_unitario)
+            quantidade_venda = sum(quantidade for quantidade, _ in por_produto.values())
+
+            for granularidade, periodo in (('dia', data), ('mes', data.replace(day=1))):
+                for dimensao, chave in dimensoes:
+                    delta = deltas[(granularidade, dimensao, periodo, chave)]
+                    delta[0] += sinal * quantidade_venda
+                    delta[1] += sinal * Decimal(venda.total)
+                    delta[2] += sinal
+                for produto_id, (quantidade, valor) in por_produto.items():
+                    delta = deltas[(granularidade, 'produto', periodo, produto_id)]
+                    delta[0] += sinal * quantidade
+                    delta[1] += sinal * valor
+                    delta[2] += sinal
+
+        return deltas
+
+    @staticmethod
+    def _upsert(deltas):
+        tabela = connection.ops.quote_name(ResumoVendas._meta.db_table)
+        # Mesma ordem de chaves em todas as transações: as linhas são bloqueadas sempre na mesma sequência
+        linhas = sorted(deltas.items())
+
+        with connection.cursor() as cursor:
+            for inicio in range(0, len(linhas), ResumoVendasService.LOTE_UPSERT):
+                lote = linhas[inicio:inicio + ResumoVendasService.LOTE_UPSERT]
+                params = []
+                for (granularidade, dimensao, periodo, chave), (quantidade, total, num_vendas) in lote:
+                    params.extend([
+                        granularidade,
+                        dimensao,
+                        connection.ops.adapt_datefield_value(periodo),
+                        chave,
+                        quantidade,
+                        connection.ops.adapt_decimalfield_value(total, 14, 2),
+                        num_vendas,
+                    ])
+                valores = ', '.join(['(%s, %s, %s, %s, %s, %s, %s)'] * len(lote))
+                cursor.execute(
+                    f'INSERT INTO {tabela} '
+                    f'(granularidade, dimensao, periodo, chave, quantidade, total, num_vendas) '
+                    f'VALUES {valores} '
+                    f'ON CONFLICT (granularidade, dimensao, periodo, chave) DO UPDATE SET '
+                    f'quantidade = {tabela}.quantidade + EXCLUDED.quantidade, '
+                    f'total = {tabela}.total + EXCLUDED.total, '
+                    f'num_vendas = {tabela}.num_vendas + EXCLUDED.num_vendas',
+                    params
+                )
+
+    @staticmethod
+    def consultar(granularidade, dimensao, inicio=None, fim=None, chave=None):
+        """
+        Consulta os resumos de um período, com o nome de produtos e clientes
+
+        Returns:
+            list: Linhas {'periodo', 'chave', 'nome', 'quantidade', 'total', 'num_vendas'}
+        """
+        queryset = ResumoVendas.objects.filter(granularidade=granularidade, dimensao=dimensao)
+        if inicio:
+            queryset = queryset.filter(periodo__gte=inicio)
+        if fim:
+            queryset = queryset.filter(periodo__lte=fim)
+
+        if dimensao == 'total':
+            # Soma das fatias do total geral de cada período
+            linhas = list(
+                queryset.values('periodo').annotate(
+                    quantidade_total=Sum('quantidade'), valor_total=Sum('total'), vendas_total=Sum('num_vendas')
+                ).filter(vendas_total__gt=0).order_by('periodo')
+            )
+            return [
+                {'periodo': linha['periodo'], 'chave': '', 'quantidade': linha['quantidade_total'],
+                 'total': linha['valor_total'], 'num_vendas': linha['vendas_total'], 'nome': None}
+                for linha in linhas
+            ]
+
+        queryset = queryset.filter(num_vendas__gt=0)
+        if chave:
+            queryset = queryset.filter(chave=chave)
+
+        linhas = list(queryset.order_by('periodo', 'chave').values(
+            'periodo', 'chave', 'quantidade', 'total', 'num_vendas'
+        ))
+
+        nomes = {}
+        chaves = {linha['chave'] for linha in linhas}
+        if dimensao == 'produto':
+            ids = [int(chave) for chave in chaves if chave.isdigit()]
+            nomes = {str(pk): nome for pk, nome in Produto.objects.filter(id__in=ids).values_list('id', 'nome')}
+        elif dimensao == 'cliente':
+            nomes = dict(Cliente.objects.filter(cedula__in=chaves).values_list('cedula', 'nome'))
+        elif dimensao == 'cidade':
+            nomes = {chave: chave for chave in chaves}
+
+        for linha in linhas:
+            linha['nome'] = nomes.get(linha['chave'])
+        return linhas
+
+    @staticmethod
+    def reconstruir(tamanho_lote=2000, progresso=None):
+        """
+        Recalcula todos os resumos a partir de vendas e itens (backfill)
+
+        Args:
+            tamanho_lote (int): Quantidade de vendas lidas por vez
+            progresso (callable, optional): Chamado com o total de vendas processadas
+
+        Returns:
+            int: Total de vendas processadas
+        """
+        processadas = 0
+        ultimo_id = 0
+        with transaction.atomic():
+            ResumoVendas.objects.all().delete()
+            while True:
+                vendas = list(
+                    Venta.objects.filter(id__gt=ultimo_id).order_by('id')[:tamanho_lote]
+                )
+                if not vendas:
+                    break
+                items = list(VentaItem.objects.filter(venda_id__in=[venda.id for venda in vendas]))
+                ResumoVendasService.aplicar(vendas, items)
+                ultimo_id = vendas[-1].id
+                processadas += len(vendas)
+                if progresso:
+                    progresso(processadas)
+        return processadas
+
+
+class VendaError(Exception):
+    """Erro de validação ao registrar uma venda"""
+
+    def __init__(self, detail, status_code=status.HTTP_400_BAD_REQUEST):
+        super().__init__(detail)
+        self.detail = detail
+        self.status_code = status_code
+
+
+class VendaService:
+    """Serviço para registro de vendas com baixa de estoque em lote"""
+
+    @staticmethod
+    def _to_id(produto_id):
+        try:
+            return int(produto_id)
+        except (ValueError, TypeError):
+            return None
+
+    @staticmethod
+    def _erro_estoque(produto, disponivel=None):
+        disponivel = produto.estoque_disponivel if disponivel is None else disponivel
+        return VendaError(
+            f'Estoque insuficiente para {produto.nome}. Apenas {disponivel} unidades disponíveis.'
+        )
+
+    @staticmethod
+    def _parse_quantidade(item_data):
+        try:
+            quantidade = int(item_data.get('quantidade', item_data.get('cantidad', 1)))
+        except (ValueError, TypeError):
+            raise VendaError('A quantidade deve ser um número inteiro válido')
+        if quantidade <= 0:
+            raise VendaError('A quantidade deve ser maior que 0')
+        return quantidade
+
+    @staticmethod
+    def _parse_preco(item_data, produto):
+        preco_unitario = item_data.get('preco_unitario', item_data.get('precio_unitario'))
+        if not preco_unitario:
+            return produto.preco
+        try:
+            preco_unitario = Decimal(str(preco_unitario))
+        except (InvalidOperation, ValueError, TypeError):
+            raise VendaError('O preço unitário deve ser um número válido')
+        if not preco_unitario.is_finite():
+            raise VendaError('O preço unitário deve ser um número válido')
+        if preco_unitario <= 0:
+            raise VendaError('O preço unitário deve ser maior que 0')
+        return preco_unitario
+
+    @staticmethod
+    def _produto_ids(items_data):
+        """IDs válidos de produto referenciados por uma lista de itens"""
+        return {
+            VendaService._to_id(item_data.get('produto'))
+            for item_data in items_data
+            if isinstance(item_data, dict)
+        } - {None}
+
+    @staticmethod
+    def _carregar_produtos(produto_ids):
+        """
+        Carrega e bloqueia os produtos em uma única consulta (ordem fixa evita deadlocks)
+
+        O estoque livre é validado em memória antes da baixa, então as reservas
+        vencidas dos produtos com reserva são liberadas antes (e os produtos
+        recarregados) para não recusar a venda por carrinhos abandonados.
+        """
+        def carregar():
+            return {
+                produto.id: produto
+                for produto in Produto.objects.select_for_update()
+                                              .filter(id__in=produto_ids)
+                                              .order_by('id')
+            }
+
+        produtos = carregar()
+        com_reserva = [produto.id for produto in produtos.values() if produto.estoque_reservado]
+        if com_reserva and ReservaService.expirar(produto_ids=com_reserva):
+            produtos = carregar()
+        return produtos
+
+    @staticmethod
+    def _validar_itens(items_data, produtos, disponivel):
+        """
+        Valida os itens de uma venda em memória
+
+        Args:
+            items_data (list): Itens da venda
+            produtos (dict): Produtos carregados por ID
+            disponivel (dict): Estoque ainda disponível por ID de produto
+
+        Returns:
+            tuple: (quantidades por produto, total da venda, lista de VentaItem sem venda_id)
+        """
+        if not items_data or not isinstance(items_data, list):
+            raise VendaError('A venda deve incluir pelo menos um produto')
+
+        quantidades = {}
+        total_venda = Decimal('0')
+        items_validados = []
+
+        for item_data in items_data:
+            if not isinstance(item_data, dict):
+                raise VendaError('Item de venda inválido')
+            quantidade = VendaService._parse_quantidade(item_data)
+
+            produto_id = item_data.get('produto')
+            produto = produtos.get(VendaService._to_id(produto_id))
+            if produto is None:
+                raise VendaError(
+                    f'Produto com ID {produto_id} não encontrado',
+                    status.HTTP_404_NOT_FOUND
+                )
+
+            # Linhas repetidas do mesmo produto somam no mesmo estoque
+            quantidades[produto.id] = quantidades.get(produto.id, 0) + quantidade
+            if quantidades[produto.id] > disponivel[produto.id]:
+                raise VendaService._erro_estoque(produto, disponivel[produto.id])
+
+            preco_unitario = VendaService._parse_preco(item_data, produto)
+            total_venda += quantidade * preco_unitario
+            items_validados.append(VentaItem(
+                produto_id=produto.id,
+                quantidade=quantidade,
+                preco_unitario=preco_unitario
+            ))
+
+        return quantidades, total_venda, items_validados
+
+    @staticmethod
+    def criar_venda(cliente_cedula, items_data):
+        """
+        Registra uma venda e baixa o estoque de todos os seus itens
+
+        Todos os produtos referenciados são carregados e bloqueados em uma
+        única consulta, o estoque é validado em memória, a baixa é feita com
+        um único UPDATE condicional e os itens são gravados com bulk_create.
+        O número de consultas não depende da quantidade de itens.
+
+        Args:
+            cliente_cedula (str): Cédula do cliente (opcional)
+            items_data (list): Itens com 'produto', 'quantidade' e 'preco_unitario' opcional
+
+        Returns:
+            Venta: Venda criada
+
+        Raises:
+            VendaError: Se algum item for inválido ou não houver estoque suficiente
+        """
+        if not items_data:
+            raise VendaError('A venda deve incluir pelo menos um produto')
+
+        with transaction.atomic():
+            produtos = VendaService._carregar_produtos(VendaService._produto_ids(items_data))
+            disponivel = {produto.id: produto.estoque_disponivel for produto in produtos.values()}
+            quantidades, total_venda, items = VendaService._validar_itens(
+                items_data, produtos, disponivel
+            )
+
+            # Baixar o estoque de todos os produtos em um único UPDATE condicional
+            falhas = EstoqueService.baixar(quantidades)
+            if falhas:
+                raise VendaService._erro_estoque(produtos[falhas[0]])
+
+            venda = Venta.objects.create(
+                cliente_cedula=cliente_cedula,
+                cliente_cidade=ResumoVendasService.cidades([cliente_cedula]).get(cliente_cedula),
+                total=total_venda
+            )
+            for item in items:
+                item.venda_id = venda.id
+            VentaItem.objects.bulk_create(items)
+            ResumoVendasService.aplicar([venda], items)
+
+        return venda
+
+    @staticmethod
+    def criar_vendas_em_lote(vendas_data):
+        """
+        Registra um lote de vendas (terminais offline) em uma única transação
+
+        O estoque é validado para o lote inteiro: as vendas são alocadas em
+        ordem contra o estoque em memória e as que não couberem são
+        rejeitadas sem afetar as demais. A baixa de estoque das vendas
+        aceitas é feita com um único UPDATE condicional e as vendas e itens
+        são gravados com bulk_create.
+
+        Args:
+            vendas_data (list): Vendas no formato {'referencia', 'cliente', 'items'}
+
+        Returns:
+            dict: Resultado por venda, indexado pela 'referencia' (ou posição no lote)
+
+        Raises:
+            VendaError: Se duas vendas do lote tiverem a mesma referência
+        """
+        # Os resultados são indexados pela referência: repetidas (inclusive uma
+        # explícita igual à posição de outra venda) recusam o lote inteiro
+        referencias = set()
+        for posicao, venda_data in enumerate(vendas_data):
+            referencia = str(venda_data.get('referencia', posicao)) if isinstance(venda_data, dict) else str(posicao)
+            if referencia in referencias:
+                raise VendaError(f'Referência {referencia} repetida no lote')
+            referencias.add(referencia)
+
+        resultados = {}
+        aceitas = []
+
+        with transaction.atomic():
+            produto_ids = set()
+            for venda_data in vendas_data:
+                if isinstance(venda_data, dict) and isinstance(venda_data.get('items'), list):
+                    produto_ids |= VendaService._produto_ids(venda_data['items'])
+            produtos = VendaService._carregar_produtos(produto_ids)
+            disponivel = {produto.id: produto.estoque_disponivel for produto in produtos.values()}
+            total_lote = {}
+            cidades = ResumoVendasService.cidades(
+                venda_data.get('cliente') for venda_data in vendas_data if isinstance(venda_data, dict)
+            )
+
+            for posicao, venda_data in enumerate(vendas_data):
+                referencia = str(posicao)
+                try:
+                    if not isinstance(venda_data, dict):
+                        raise VendaError('Venda inválida')
+                    referencia = str(venda_data.get('referencia', posicao))
+
+                    quantidades, total_venda, items = VendaService._validar_itens(
+                        venda_data.get('items'), produtos, disponivel
+                    )
+                except VendaError as e:
+                    resultados[referencia] = {
+                        'status': 'erro',
+                        'detail': e.detail,
+                        'status_code': e.status_code,
+                    }
+                    continue
+
+                for produto_id, quantidade in quantidades.items():
+                    disponivel[produto_id] -= quantidade
+                    total_lote[produto_id] = total_lote.get(produto_id, 0) + quantidade
+
+                cliente = venda_data.get('cliente')
+                venda = Venta(
+                    cliente_cedula=cliente,
+                    cliente_cidade=cidades.get(cliente) if isinstance(cliente, str) else None,
+                    total=total_venda
+                )
+                aceitas.append((referencia, venda, items))
+                resultados[referencia] = None
+
+            if aceitas:
+                falhas = EstoqueService.baixar(total_lote)
+                if falhas:
+                    raise VendaService._erro_estoque(produtos[falhas[0]])
+
+                vendas = Venta.objects.bulk_create([venda for _, venda, _ in aceitas])
+                items_lote = []
+                for (referencia, _, items), venda in zip(aceitas, vendas):
+                    for item in items:
+                        item.venda_id = venda.id
+                    items_lote.extend(items)
+                    resultados[referencia] = {'status': 'criada', 'venda_id': venda.id}
+                VentaItem.objects.bulk_create(items_lote)
+                ResumoVendasService.aplicar(vendas, items_lote)
+
+        return resultados
+
+    @staticmethod
+    def criar_venda_do_carrinho(carrito_items, cliente_cedula):
+        """
+        Converte os itens de um carrinho em uma venda e esvazia o carrinho
+
+        Args:
+            carrito_items (QuerySet): Itens do carrinho (Carrito)
+            cliente_cedula (str): Cédula do cliente (opcional)
+
+        Returns:
+            Venta: Venda criada
+
+        Raises:
+            VendaError: Se o carrinho estiver vazio ou não houver estoque suficiente
+        """
+        with transaction.atomic():
+            # Bloqueia as linhas para que o expirador de reservas não as libere no meio
+            itens = list(carrito_items.select_for_update())
+            if not itens:
+                raise VendaError('O carrinho está vazio')
+
+            produtos = Produto.objects.in_bulk({item.produto_id for item in itens})
+            quantidades = {}
+            reservados = defaultdict(int)
+            total_venda = Decimal('0')
+
+            for item in itens:
+                produto = produtos.get(item.produto_id)
+                if produto is None:
+                    raise VendaError(
+                        f'Produto com ID {item.produto_id} não encontrado',
+                        status.HTTP_404_NOT_FOUND
+                    )
+                quantidades[produto.id] = quantidades.get(produto.id, 0) + item.quantidade
+                if item.reservado_ate is not None:
+                    reservados[produto.id] += item.quantidade
+                total_venda += item.quantidade * item.preco_unitario
+
+            # Valida e baixa o estoque no mesmo UPDATE condicional, consumindo as reservas
+            falhas = EstoqueService.baixar(quantidades, reservados, excluir=[item.id for item in itens])
+            if falhas:
+                produto = Produto.objects.filter(id=falhas[0]).first() or produtos[falhas[0]]
+                raise VendaService._erro_estoque(
+                    produto, produto.estoque_disponivel + reservados.get(produto.id, 0)
+                )
+
+            venda = Venta.objects.create(
+                cliente_cedula=cliente_cedula,
+                cliente_cidade=ResumoVendasService.cidades([cliente_cedula]).get(cliente_cedula),
+                total=total_venda
+            )
+            items_venda = VentaItem.objects.bulk_create([
+                VentaItem(
+                    venda_id=venda.id,
+                    produto_id=item.produto_id,
+                    quantidade=item.quantidade,
+                    preco_unitario=item.preco_unitario
+                )
+                for item in itens
+            ])
+            ResumoVendasService.aplicar([venda], items_venda)
+
+            # Limpar carrinho
+            Carrito.objects.filter(id__in=[item.id for item in itens]).delete()
+
+        return venda
+
+    @staticmethod
+    @contextmanager
+    def editando_vendas(venda_ids):
+        """
+        Mantém os resumos corretos durante a edição direta de vendas ou itens
+
+        Desconta as vendas dos resumos, executa o bloco (que grava a edição) e
+        as soma de novo com os valores gravados, tudo na mesma transação. Se o
+        cliente da venda mudou, a cidade é resolvida de novo.
+
+        Args:
+            venda_ids (iterable): IDs das vendas afetadas (None é ignorado)
+        """
+        venda_ids = {venda_id for venda_id in venda_ids if venda_id is not None}
+        with transaction.atomic():
+            antes = {venda.id: venda for venda in Venta.objects.select_for_update().filter(id__in=venda_ids)}
+            ResumoVendasService.aplicar(
+                list(antes.values()), list(VentaItem.objects.filter(venda_id__in=venda_ids)), sinal=-1
+            )
+            yield
+            depois = list(Venta.objects.filter(id__in=venda_ids))
+            for venda in depois:
+                if venda.id in antes and venda.cliente_cedula != antes[venda.id].cliente_cedula:
+                    venda.cliente_cidade = None
+            ResumoVendasService.aplicar(depois, list(VentaItem.objects.filter(venda_id__in=venda_ids)))
+
+    @staticmethod
+    def excluir_venda(venda):
+        """Exclui a venda e seus itens, descontando-a dos resumos"""
+        with transaction.atomic():
+            items = list(VentaItem.objects.filter(venda_id=venda.id))
+            ResumoVendasService.aplicar([venda], items, sinal=-1)
+            VentaItem.objects.filter(venda_id=venda.id).delete()
+            venda.delete()
+
+
+class CarrinhoError(VendaError):
+    """Erro de validação ao alterar um carrinho"""
+
+
+class CarrinhoService:
+    """Serviço para operações em lote nos carrinhos"""
+
+    LOTE_UPSERT = 500
+
+    @staticmethod
+    def _parse_usuario_id(usuario_id):
+        if not usuario_id:
+            return None
+        try:
+            return uuid.UUID(str(usuario_id))
+        except (ValueError, TypeError):
+            raise CarrinhoError('usuario_id inválido')
+
+    @staticmethod
+    def linhas(session_id=None, usuario_id=None):
+        """Linhas do carrinho de um usuário ou, sem usuário, de uma sessão anônima"""
+        if usuario_id:
+            return Carrito.objects.filter(usuario_id=usuario_id)
+        return Carrito.objects.filter(session_id=session_id, usuario_id__isnull=True)
+
+    @staticmethod
+    def _parse_itens(itens_data):
+        """Quantidade final por produto; 0 remove a linha (o último item de um produto prevalece)"""
+        if not isinstance(itens_data, list) or not itens_data:
+            raise CarrinhoError('É necessário pelo menos um item')
+
+        alvos = {}
+        for item_data in itens_data:
+            if not isinstance(item_data, dict):
+                raise CarrinhoError('Cada item deve ser um objeto')
+            produto_id = VendaService._to_id(item_data.get('produto_id', item_data.get('produto')))
+            if produto_id is None:
+                raise CarrinhoError('produto_id inválido')
+            try:
+                quantidade = int(item_data.get('quantidade', item_data.get('cantidad', 1)))
+            except (ValueError, TypeError):
+                raise CarrinhoError('A quantidade deve ser um número inteiro válido')
+            if quantidade < 0:
+                raise CarrinhoError('A quantidade não pode ser negativa')
+            alvos[produto_id] = quantidade
+        return alvos
+
+    @staticmethod
+    def atualizar_em_lote(itens_data, session_id=None, usuario_id=None):
+        """
+        Adiciona, altera ou remove várias linhas de um carrinho de uma vez
+
+        Cada item define a quantidade final do produto no carrinho (0 remove
+        a linha). As reservas de estoque de todos os produtos são ajustadas em
+        um único UPDATE condicional e as linhas são gravadas com upserts, então
+        o custo não cresce em consultas com o número de itens.
+
+        Args:
+            itens_data (list): Itens {'produto_id', 'quantidade'}
+            session_id (str, optional): Sessão do carrinho anônimo
+            usuario_id (str, optional): Usuário dono do carrinho
+
+        Returns:
+            QuerySet: Linhas do carrinho após a alteração
+
+        Raises:
+            CarrinhoError: Se os dados forem inválidos ou faltar estoque
+        """
+        usuario_id = CarrinhoService._parse_usuario_id(usuario_id)
+        if not session_id and not usuario_id:
+            raise CarrinhoError('É necessário session_id ou usuario_id')
+        alvos = CarrinhoService._parse_itens(itens_data)
+
+        with transaction.atomic():
+            produtos = Produto.objects.in_bulk(alvos)
+            for produto_id, quantidade in alvos.items():
+                if quantidade and produto_id not in produtos:
+                    raise CarrinhoError(
+                        f'Produto com ID {produto_id} não encontrado',
+                        status.HTTP_404_NOT_FOUND
+                    )
+
+            existentes = {
+                linha.produto_id: linha
+                for linha in CarrinhoService.linhas(session_id, usuario_id)
+                                            .select_for_update()
+                                            .filter(produto_id__in=alvos)
+                                            .order_by('id')
+            }
+            reservados = {
+                produto_id: linha.quantidade
+                for produto_id, linha in existentes.items()
+                if linha.reservado_ate is not None
+            }
+
+            falhas = ReservaService.ajustar({
+                produto_id: quantidade - reservados.get(produto_id, 0)
+                for produto_id, quantidade in alvos.items()
+                if produto_id in produtos
+            })
+            if falhas:
+                produto = Produto.objects.get(id=falhas[0])
+                raise VendaService._erro_estoque(
+                    produto, produto.estoque_disponivel + reservados.get(produto.id, 0)
+                )
+
+            remover = [linha.id for produto_id, linha in existentes.items() if not alvos[produto_id]]
+            if remover:
+                Carrito.objects.filter(id__in=remover).delete()
+
+            CarrinhoService._upsert(
+                [(produto_id, quantidade, produtos[produto_id].preco)
+                 for produto_id, quantidade in alvos.items() if quantidade],
+                session_id or '',
+                usuario_id
+            )
+
+        return CarrinhoService.linhas(session_id, usuario_id)
+
+    @staticmethod
+    def _upsert(linhas, session_id, usuario_id):
+        if not linhas:
+            return
+        tabela = connection.ops.quote_name(Carrito._meta.db_table)
+        if usuario_id:
+            conflito = '(usuario_id, produto_id) WHERE usuario_id IS NOT NULL'
+        else:
+            conflito = '(session_id, produto_id) WHERE usuario_id IS NULL'
+        usuario_id = Carrito._meta.get_field('usuario_id').get_db_prep_value(usuario_id, connection)
+        agora = connection.ops.adapt_datetimefield_value(timezone.now())
+        prazo = connection.ops.adapt_datetimefield_value(ReservaService.prazo())
+
+        with connection.cursor() as cursor:
+            for inicio in range(0, len(linhas), CarrinhoService.LOTE_UPSERT):
+                lote = linhas[inicio:inicio + CarrinhoService.LOTE_UPSERT]
+                params = []
+                for produto_id, quantidade, preco in lote:
+                    params.extend([
+                        session_id,
+                        usuario_id,
+                        produto_id,
+                        quantidade,
+                        connection.ops.adapt_decimalfield_value(preco, 10, 2),
+                        prazo,
+                        agora,
+                        agora,
+                    ])
+                valores = ', '.join(['(%s, %s, %s, %s, %s, %s, %s, %s)'] * len(lote))
+                # Linhas existentes mantêm o preço com que foram adicionadas
+                cursor.execute(
+                    f'INSERT INTO {tabela} '
+                    f'(session_id, usuario_id, produto_id, quantidade, preco_unitario, '
+                    f'reservado_ate, created_at, updated_at) '
+                    f'VALUES {valores} '
+                    f'ON CONFLICT {conflito} DO UPDATE SET '
+                    f'quantidade = EXCLUDED.quantidade, '
+                    f'reservado_ate = EXCLUDED.reservado_ate, '
+                    f'updated_at = EXCLUDED.updated_at',
+                    params
+                )
+
+    @staticmethod
+    def abandonados(limite_data, incluir_usuarios=False):
+        """
+        Linhas de carrinhos sem nenhuma alteração desde limite_data
+
+        Um carrinho é abandonado quando nenhuma das suas linhas foi alterada
+        desde a data limite; linhas antigas de carrinhos ativos são mantidas.
+        Por padrão apenas carrinhos anônimos (por sessão) são considerados.
+        """
+        ativas_sessao = Carrito.objects.filter(
+            session_id=OuterRef('session_id'),
+            usuario_id__isnull=True,
+            updated_at__gte=limite_data
+        )
+        linhas = Carrito.objects.filter(updated_at__lt=limite_data)
+        anonimas = Q(usuario_id__isnull=True) & ~Q(Exists(ativas_sessao))
+        if not incluir_usuarios:
+            return linhas.filter(anonimas)
+
+        ativas_usuario = Carrito.objects.filter(
+            usuario_id=OuterRef('usuario_id'),
+            updated_at__gte=limite_data
+        )
+        return linhas.filter(anonimas | (Q(usuario_id__isnull=False) & ~Q(Exists(ativas_usuario))))
+
+    @staticmethod
+    def purgar_abandonados(limite_data, incluir_usuarios=False, limite=LOTE_UPSERT):
+        """
+        Remove um lote de linhas de carrinhos abandonados, liberando as reservas
+
+        Cada lote é uma transação curta; linhas bloqueadas (checkout em
+        andamento) são ignoradas e ficam para a próxima execução.
+
+        Returns:
+            int: Quantidade de linhas removidas
+        """
+        with transaction.atomic():
+            linhas = list(
+                CarrinhoService.abandonados(limite_data, incluir_usuarios)
+                               .select_for_update(skip_locked=True)
+                               .order_by('updated_at')
+                               .values_list('id', 'produto_id', 'quantidade', 'reservado_ate')[:limite]
+            )
+            if not linhas:
+                return 0
+
+            liberar = defaultdict(int)
+            for _, produto_id, quantidade, reservado_ate in linhas:
+                if reservado_ate is not None:
+                    liberar[produto_id] -= quantidade
+            ReservaService.ajustar(liberar)
+            Carrito.objects.filter(id__in=[linha[0] for linha in linhas]).delete()
+
+        return len(linhas)
+
+    @staticmethod
+    def mesclar(session_id, usuario_id):
+        """
+        Move o carrinho anônimo de uma sessão para o usuário (usado no login)
+
+        Produtos que já estão no carrinho do usuário têm as quantidades
+        somadas e a linha anônima é removida; as demais linhas mudam de dono
+        em um único UPDATE, sem violar unique_session_produto nem
+        unique_usuario_produto.
+
+        Returns:
+            int: Quantidade de linhas anônimas incorporadas
+        """
+        usuario_id = CarrinhoService._parse_usuario_id(usuario_id)
+        if not session_id or not usuario_id:
+            raise CarrinhoError('É necessário session_id e usuario_id')
+
+        with transaction.atomic():
+            anonimas = list(
+                CarrinhoService.linhas(session_id=session_id).select_for_update().order_by('id')
+            )
+            if not anonimas:
+                return 0
+            do_usuario = {
+                linha.produto_id: linha
+                for linha in Carrito.objects.select_for_update()
+                                            .filter(usuario_id=usuario_id,
+                                                    produto_id__in=[linha.produto_id for linha in anonimas])
+                                            .order_by('id')
+            }
+
+            duplicadas = [linha for linha in anonimas if linha.produto_id in do_usuario]
+            if duplicadas:
+                quantidades = {}
+                prazos = {}
+                liberar = defaultdict(int)
+                for anonima in duplicadas:
+                    linha = do_usuario[anonima.produto_id]
+                    quantidades[linha.id] = linha.quantidade + anonima.quantidade
+                    if linha.reservado_ate and anonima.reservado_ate:
+                        prazos[linha.id] = max(linha.reservado_ate, anonima.reservado_ate)
+                    else:
+                        # Sem reserva dos dois lados a linha somada fica sem reserva
+                        prazos[linha.id] = None
+                        for parte in (linha, anonima):
+                            if parte.reservado_ate:
+                                liberar[parte.produto_id] -= parte.quantidade
+
+                Carrito.objects.filter(id__in=quantidades).update(
+                    quantidade=Case(
+                        *[When(id=linha_id, then=Value(quantidade)) for linha_id, quantidade in quantidades.items()]
+                    ),
+                    reservado_ate=Case(
+                        *[When(id=linha_id, then=Value(prazo, output_field=DateTimeField()))
+                          for linha_id, prazo in prazos.items()],
+                        output_field=DateTimeField()
+                    ),
+                    updated_at=timezone.now()
+                )
+                ReservaService.ajustar(liberar)
+                Carrito.objects.filter(id__in=[linha.id for linha in duplicadas]).delete()
+
+            CarrinhoService.linhas(session_id=session_id).update(
+                usuario_id=usuario_id,
+                updated_at=timezone.now()
+            )
+
+        return len(anonimas)
+
+
+class CarrinhoCache:
+    """
+    Carrinhos anônimos guardados no cache do Django (CARRITO_BACKEND = 'cache')
+
+    Enquanto o visitante navega, as linhas ficam apenas no cache e não geram
+    escritas no banco nem reservas de estoque; o estoque livre é conferido a
+    cada alteração. O carrinho é gravado na tabela carrito (com as reservas)
+    só no checkout ou no login, por persistir().
+
+    Cada leitura-alteração-escrita do carrinho é feita sob um bloqueio curto
+    obtido com cache.add (atômico em Redis, Memcached e no cache em banco),
+    para que requisições simultâneas da mesma sessão não percam alterações.
+    O cache precisa ser compartilhado entre os workers (verificado por
+    mi_app.checks).
+    """
+
+    PREFIXO_ID = 'c-'
+    PRAZO_BLOQUEIO = 5  # segundos; libera o carrinho se o processo morrer com o bloqueio
+    TENTATIVAS_BLOQUEIO = 50
+    ESPERA_BLOQUEIO = 0.02
+
+    @staticmethod
+    def ativo():
+        return settings.CARRITO_BACKEND == 'cache'
+
+    @staticmethod
+    def _cache():
+        return caches[settings.CARRITO_CACHE_ALIAS]
+
+    @staticmethod
+    def _chave(session_id):
+        return f'carrito:{session_id}'
+
+    @staticmethod
+    def linha_id(session_id, produto_id):
+        """ID de uma linha do cache, usado nas rotas /api/carrito/{id}/ no lugar do ID do banco"""
+        codigo = base64.urlsafe_b64encode(f'{session_id}:{produto_id}'.encode()).decode().rstrip('=')
+        return CarrinhoCache.PREFIXO_ID + codigo
+
+    @staticmethod
+    def decodificar_id(linha_id):
+        """(session_id, produto_id) de um ID gerado por linha_id, ou None se não for do cache"""
+        if not str(linha_id).startswith(CarrinhoCache.PREFIXO_ID):
+            return None
+        codigo = str(linha_id)[len(CarrinhoCache.PREFIXO_ID):]
+        try:
+            session_id, produto_id = base64.urlsafe_b64decode(codigo + '=' * (-len(codigo) % 4)).decode().rsplit(':', 1)
+            return session_id, int(produto_id)
+        except (ValueError, UnicodeDecodeError):
+            return None
+
+    @staticmethod
+    @contextmanager
+    def _bloqueio(session_id):
+        """
+        Bloqueio exclusivo do carrinho durante uma leitura-alteração-escrita
+
+        Raises:
+            CarrinhoError: Se o carrinho continuar bloqueado após as tentativas (409)
+        """
+        cache_carrinho = CarrinhoCache._cache()
+        chave = f'{CarrinhoCache._chave(session_id)}:bloqueio'
+        dono = uuid.uuid4().hex
+        for _ in range(CarrinhoCache.TENTATIVAS_BLOQUEIO):
+            if cache_carrinho.add(chave, dono, timeout=CarrinhoCache.PRAZO_BLOQUEIO):
+                break
+            time.sleep(CarrinhoCache.ESPERA_BLOQUEIO)
+        else:
+            raise CarrinhoError(
+                'O carrinho está sendo alterado por outra requisição, tente novamente',
+                status.HTTP_409_CONFLICT
+            )
+        try:
+            yield
+        finally:
+            # Não remove um bloqueio que já venceu e foi obtido por outra requisição
+            if cache_carrinho.get(chave) == dono:
+                cache_carrinho.delete(chave)
+
+    @staticmethod
+    def _ler(session_id):
+        return CarrinhoCache._cache().get(CarrinhoCache._chave(session_id)) or {}
+
+    @staticmethod
+    def _gravar(session_id, linhas):
+        if linhas:
+            CarrinhoCache._cache().set(
+                CarrinhoCache._chave(session_id),
+                linhas,
+                timeout=settings.CARRITO_ABANDONO_DIAS * 24 * 60 * 60
+            )
+        else:
+            CarrinhoCache._cache().delete(CarrinhoCache._chave(session_id))
+
+    @staticmethod
+    def linhas(session_id):
+        """Linhas do carrinho como instâncias de Carrito não salvas (mais recentes primeiro)"""
+        linhas = [
+            Carrito(session_id=session_id, produto_id=produto_id, **dados)
+            for produto_id, dados in CarrinhoCache._ler(session_id).items()
+        ]
+        return sorted(linhas, key=lambda linha: linha.created_at, reverse=True)
+
+    @staticmethod
+    def definir(session_id, alvos):
+        """
+        Define a quantidade final de produtos no carrinho (0 remove a linha)
+
+        Args:
+            session_id (str): Sessão do carrinho anônimo
+            alvos (dict): Quantidade final por ID de produto
+
+        Raises:
+            CarrinhoError: Se um produto não existir ou faltar estoque livre
+        """
+        if not session_id:
+            raise CarrinhoError('É necessário session_id')
+        with CarrinhoCache._bloqueio(session_id):
+            CarrinhoCache._definir(session_id, CarrinhoCache._ler(session_id), alvos)
+
+    @staticmethod
+    def _definir(session_id, linhas, alvos):
+        produtos = Produto.objects.in_bulk([produto_id for produto_id, quantidade in alvos.items() if quantidade])
+        agora = timezone.now()
+
+        for produto_id, quantidade in alvos.items():
+            if not quantidade:
+                linhas.pop(produto_id, None)
+                continue
+            produto = produtos.get(produto_id)
+            if produto is None:
+                raise CarrinhoError(f'Produto com ID {produto_id} não encontrado', status.HTTP_404_NOT_FOUND)
+            if quantidade > produto.estoque_disponivel:
+                raise VendaService._erro_estoque(produto)
+            linha = linhas.setdefault(produto_id, {'preco_unitario': produto.preco, 'created_at': agora})
+            linha['quantidade'] = quantidade
+            linha['updated_at'] = agora
+
+        CarrinhoCache._gravar(session_id, linhas)
+
+    @staticmethod
+    def atualizar_em_lote(itens_data, session_id):
+        """Equivalente a CarrinhoService.atualizar_em_lote para o carrinho no cache"""
+        CarrinhoCache.definir(session_id, CarrinhoService._parse_itens(itens_data))
+
+    @staticmethod
+    def adicionar(session_id, produto_id, quantidade):
+        """Soma a quantidade à linha do produto, criando-a se necessário"""
+        if not session_id:
+            raise CarrinhoError('É necessário session_id')
+        with CarrinhoCache._bloqueio(session_id):
+            linhas = CarrinhoCache._ler(session_id)
+            atual = linhas.get(produto_id, {}).get('quantidade', 0)
+            CarrinhoCache._definir(session_id, linhas, {produto_id: atual + quantidade})
+
+    @staticmethod
+    def persistir(session_id):
+        """
+        Grava o carrinho do cache na tabela carrito, reservando o estoque,
+        e o remove do cache (checkout e login)
+
+        Raises:
+            CarrinhoError: Se faltar estoque para reservar algum produto
+        """
+        linhas = CarrinhoCache._ler(session_id)
+        if not linhas:
+            return 0
+        CarrinhoService.atualizar_em_lote(
+            [{'produto_id': produto_id, 'quantidade': dados['quantidade']} for produto_id, dados in linhas.items()],
+            session_id=session_id
+        )
+        # Se a transação do checkout/login falhar, o carrinho continua no cache
+        transaction.on_commit(lambda: CarrinhoCache._descartar(session_id, linhas))
+        return len(linhas)
+
+    @staticmethod
+    def _descartar(session_id, persistidas):
+        """Remove do cache as linhas gravadas no banco, mantendo as alteradas nesse meio tempo"""
+        try:
+            with CarrinhoCache._bloqueio(session_id):
+                linhas = {
+                    produto_id: dados for produto_id, dados in CarrinhoCache._ler(session_id).items()
+                    if persistidas.get(produto_id) != dados
+                }
+                CarrinhoCache._gravar(session_id, linhas)
+        except CarrinhoError:
+            # A transação já foi confirmada; o carrinho fica no cache e um novo
+            # persistir() apenas regrava as mesmas quantidades
+            logger.warning(f'Carrinho {session_id} não foi removido do cache após persistir')
+
+
+class ExportacaoVendasService:
+    """Serviço para exportar vendas em CSV ou NDJSON com memória limitada"""
+
+    TAMANHO_LOTE = 2000
+
+    CABECALHO_CSV = [
+        'venda_id', 'data', 'cliente_cedula', 'cliente_nome', 'total',
+        'item_id', 'produto_id', 'produto_nome', 'quantidade', 'preco_unitario'
+    ]
+
+    class _Eco:
+        """Buffer que apenas devolve o que recebe (csv.writer sem acumular em memória)"""
+
+        def write(self, valor):
+            return valor
+
+    @staticmethod
+    def _lotes(queryset, tamanho_lote):
+        """
+        Percorre as vendas com cursor do servidor (iterator) e carrega em
+        lote os itens, produtos e nomes de clientes de cada bloco
+        """
+        vendas = queryset.iterator(chunk_size=tamanho_lote)
+        nomes_produtos = {}
+        while True:
+            lote = list(islice(vendas, tamanho_lote))
+            if not lote:
+                return
+
+            items_por_venda = defaultdict(list)
+            for item in VentaItem.objects.filter(venda_id__in=[venda.id for venda in lote]).order_by('id'):
+                items_por_venda[item.venda_id].append(item)
+
+            faltantes = {
+                item.produto_id
+                for items in items_por_venda.values() for item in items
+            } - nomes_produtos.keys() - {None}
+            if faltantes:
+                nomes_produtos.update(Produto.objects.filter(id__in=faltantes).values_list('id', 'nome'))
+
+            cedulas = {venda.cliente_cedula for venda in lote if venda.cliente_cedula}
+            nomes_clientes = dict(
+                Cliente.objects.filter(cedula__in=cedulas).values_list('cedula', 'nome')
+            ) if cedulas else {}
+
+            yield lote, items_por_venda, nomes_produtos, nomes_clientes
+
+    @staticmethod
+    def csv(queryset, tamanho_lote=TAMANHO_LOTE):
+        """Gera as linhas do CSV (uma por item de venda)"""
+        writer = csv.writer(ExportacaoVendasService._Eco())
+        yield writer.writerow(ExportacaoVendasService.CABECALHO_CSV)
+
+        for lote, items_por_venda, nomes_produtos, nomes_clientes in ExportacaoVendasService._lotes(queryset, tamanho_lote):
+            for venda in lote:
+                venda_colunas = [
+                    venda.id,
+                    venda.created_at.isoformat(),
+                    venda.cliente_cedula or '',
+                    nomes_clientes.get(venda.cliente_cedula, ''),
+                    venda.total,
+                ]
+                items = items_por_venda.get(venda.id)
+                if not items:
+                    yield writer.writerow(venda_colunas + [''] * 5)
+                    continue
+                for item in items:
+                    yield writer.writerow(venda_colunas + [
+                        item.id,
+                        item.produto_id,
+                        nomes_produtos.get(item.produto_id, ''),
+                        item.quantidade,
+                        item.preco_unitario,
+                    ])
+
+    @staticmethod
+    def ndjson(queryset, tamanho_lote=TAMANHO_LOTE):
+        """Gera uma linha JSON por venda, com os itens aninhados"""
+        for lote, items_por_venda, nomes_produtos, nomes_clientes in ExportacaoVendasService._lotes(queryset, tamanho_lote):
+            for venda in lote:
+                registro = {
+                    'id': venda.id,
+                    'data': venda.created_at,
+                    'cliente_cedula': venda.cliente_cedula,
+                    'cliente_nome': nomes_clientes.get(venda.cliente_cedula),
+                    'total': venda.total,
+                    'items': [
+                        {
+                            'id': item.id,
+                            'produto_id': item.produto_id,
+                            'produto_nome': nomes_produtos.get(item.produto_id),
+                            'quantidade': item.quantidade,
+                            'preco_unitario': item.preco_unitario,
+                        }
+                        for item in items_por_venda.get(venda.id, [])
+                    ],
+                }
+                yield json.dumps(registro, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n'
+
+
+class IdempotenciaService:
+    """Serviço para armazenar e reaproveitar respostas de requisições com Idempotency-Key"""
+
+    LOTE_EXPIRACAO = 100
+
+    @staticmethod
+    def hash_requisicao(dados):
+        """Impressão digital do corpo da requisição (detecta chave reutilizada com outro corpo)"""
+        conteudo = json.dumps(dados, sort_keys=True, cls=DjangoJSONEncoder)
+        return hashlib.sha256(conteudo.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def reservar(chave, endpoint, hash_requisicao, escopo=''):
+        """
+        Reserva uma chave de idempotência para o endpoint
+
+        Args:
+            chave (str): Valor do header Idempotency-Key
+            endpoint (str): Identificador do endpoint
+            hash_requisicao (str): Hash do corpo da requisição
+            escopo (str): Dono da chave (usuário ou sessão); chaves iguais de donos diferentes são independentes
+
+        Returns:
+            tuple: (ChaveIdempotencia, bool) - registro e se foi criado agora
+        """
+        agora = timezone.now()
+        registro = ChaveIdempotencia.objects.filter(escopo=escopo, chave=chave, endpoint=endpoint).first()
+        if registro is not None and registro.expira_em > agora:
+            return registro, False
+        if registro is not None:
+            registro.delete()
+
+        IdempotenciaService._expirar(agora)
+        try:
+            with transaction.atomic():
+                registro = ChaveIdempotencia.objects.create(
+                    escopo=escopo,
+                    chave=chave,
+                    endpoint=endpoint,
+                    hash_requisicao=hash_requisicao,
+                    expira_em=agora + timedelta(hours=settings.IDEMPOTENCIA_TTL_HORAS)
+                )
+            return registro, True
+        except IntegrityError:
+            # Outra requisição com a mesma chave reservou primeiro
+            return ChaveIdempotencia.objects.get(escopo=escopo, chave=chave, endpoint=endpoint), False
+
+    @staticmethod
+    def concluir(registro, status_code, resposta):
+        """Armazena a resposta final para ser reaproveitada nas repetições"""
+        ChaveIdempotencia.objects.filter(id=registro.id).update(
+            status_code=status_code,
+            resposta=resposta
+        )
+
+    @staticmethod
+    def liberar(registro):
+        """Libera a chave para que a requisição possa ser repetida (erros de servidor)"""
+        ChaveIdempotencia.objects.filter(id=registro.id).delete()
+
+    @staticmethod
+    def _expirar(agora):
+        """Remove um lote limitado de chaves expiradas"""
+        ids = list(
+            ChaveIdempotencia.objects.filter(expira_em__lte=agora)
+                                     .values_list('id', flat=True)[:IdempotenciaService.LOTE_EXPIRACAO]
+        )
+        if ids:
+            ChaveIdempotencia.objects.filter(id__in=ids).delete()
+
+
+class KanbanSnapshotService:
+    """
+    Versão e cache do quadro completo (/api/kanbans/{id}/completo/)
+
+    Kanban.versao é incrementada (pelos signals) sempre que o próprio quadro
+    é gravado ou uma coluna, card ou regra do quadro é gravada ou removida. O quadro serializado fica no
+    cache sob a chave (quadro, versão), então enquanto nada muda a leitura
+    não toca as tabelas de colunas e cards.
+    """
+
+    @staticmethod
+    def incrementar_versao(kanban_id=None, coluna_id=None):
+        """Incrementa a versão do quadro, identificado diretamente ou por uma das colunas"""
+        if kanban_id is not None:
+            quadros = Kanban.objects.filter(id=kanban_id)
+        elif coluna_id is not None:
+            quadros = Kanban.objects.filter(colunas__id=coluna_id)
+        else:
+            return
+        quadros.update(versao=F('versao') + 1)
+
+    # Campos de cliente, produto e usuário copiados no quadro serializado
+    CAMPOS_EXIBIDOS = {
+        'Cliente': {'nome', 'email', 'telefone', 'cidade', 'empresa', 'contato'},
+        'Produto': {'nome'},
+        'Usuario': {'nome'},
+    }
+
+    @staticmethod
+    def incrementar_versao_dos_que_exibem(instancia):
+        """Incrementa a versão dos quadros cujo snapshot mostra o cliente, produto ou usuário"""
+        if isinstance(instancia, Cliente):
+            condicao = Q(cliente=instancia) | Q(colunas__cards__cliente=instancia)
+        elif isinstance(instancia, Produto):
+            condicao = Q(colunas__cards__produto=instancia)
+        else:
+            condicao = Q(criado_por=instancia) | Q(colunas__cards__responsavel=instancia)
+        Kanban.objects.filter(id__in=Kanban.objects.filter(condicao).values('id')).update(
+            versao=F('versao') + 1
+        )
+
+    @staticmethod
+    def etag(kanban):
+        return f'"kanban-{kanban.id}-v{kanban.versao}"'
+
+    @staticmethod
+    def obter(kanban, gerar):
+        """
+        Quadro serializado da versão atual, gerado por gerar() apenas se não estiver no cache
+
+        Args:
+            kanban (Kanban): Quadro (apenas id e versao são usados)
+            gerar (callable): Função que serializa o quadro completo
+        """
+        return cache.get_or_set(
+            f'kanban:{kanban.id}:v{kanban.versao}',
+            gerar,
+            timeout=settings.KANBAN_SNAPSHOT_TTL
+        )
+
+
+class SincronizacaoKanbanService:
+    """
+    Sincronização incremental do quadro (/api/kanbans/{id}/mudancas/)
+
+    O cursor tem a forma ``<versão>-<microssegundos>``: se a versão do
+    quadro não mudou não há o que enviar; caso contrário são devolvidas as
+    colunas e cards com updated_at posterior ao instante do cursor e as
+    remoções (RemocaoKanban) do mesmo período. O instante gravado no cursor
+    recua KANBAN_MUDANCAS_MARGEM segundos para cobrir transações que
+    gravaram updated_at antes do commit; itens repetidos são idempotentes
+    para o cliente.
+    """
+
+    @staticmethod
+    def cursor(kanban, instante):
+        instante = instante - timedelta(seconds=settings.KANBAN_MUDANCAS_MARGEM)
+        return f'{kanban.versao}-{int(instante.timestamp() * 1_000_000)}'
+
+    @staticmethod
+    def ler_cursor(valor):
+        """
+        Interpreta o cursor devolvido pela API ou uma data ISO 8601
+
+        Returns:
+            tuple: (versão ou None, instante)
+
+        Raises:
+            ValueError: Se o valor não for um cursor nem uma data válida
+        """
+        versao, _, micros = str(valor).partition('-')
+        if versao.isdigit() and micros.isdigit():
+            instante = datetime.fromtimestamp(int(micros) / 1_000_000, tz=timezone.get_current_timezone())
+            return int(versao), instante
+
+        instante = parse_datetime(str(valor))
+        if instante is None:
+            raise ValueError(valor)
+        if timezone.is_naive(instante):
+            instante = timezone.make_aware(instante)
+        return None, instante
+
+    @staticmethod
+    def expirado(instante):
+        """Remoções mais antigas que KANBAN_REMOCOES_DIAS são descartadas; o cliente deve recarregar o quadro"""
+        return instante < timezone.now() - timedelta(days=settings.KANBAN_REMOCOES_DIAS)
+
+    @staticmethod
+    def mudancas(kanban, instante):
+        """
+        Colunas, cards e remoções do quadro desde instante
+
+        Returns:
+            dict: {'colunas': QuerySet, 'cards': QuerySet, 'removidos': {'colunas': [...], 'cards': [...]}}
+        """
+        removidos = {'colunas': [], 'cards': []}
+        for tipo, objeto_id in RemocaoKanban.objects.filter(
+                kanban_id=kanban.id, removido_em__gt=instante).values_list('tipo', 'objeto_id'):
+            removidos['colunas' if tipo == 'coluna' else 'cards'].append(objeto_id)
+
+        return {
+            'colunas': Coluna.objects.filter(kanban=kanban, updated_at__gt=instante).order_by('rank', 'id'),
+            'cards': Card.objects.filter(coluna__kanban=kanban, updated_at__gt=instante)
+                                 .select_related('coluna', 'cliente', 'produto', 'responsavel')
+                                 .order_by('rank', 'id'),
+            'removidos': removidos,
+        }
+
+    @staticmethod
+    def purgar_remocoes(dias=None):
+        """
+        Apaga os registros de remoção fora da janela de sincronização
+
+        Returns:
+            int: Quantidade de registros apagados
+        """
+        dias = settings.KANBAN_REMOCOES_DIAS if dias is None else dias
+        apagados, _ = RemocaoKanban.objects.filter(removido_em__lt=timezone.now() - timedelta(days=dias)).delete()
+        return apagados
+
+
+class OrdenacaoKanbanError(Exception):
+    """Posição inválida ao mover uma coluna ou card"""
+
+    def __init__(self, detail, status_code=status.HTTP_400_BAD_REQUEST):
+        super().__init__(detail)
+        self.detail = detail
+        self.status_code = status_code
+
+
+class OrdenacaoKanbanService:
+    """
+    Posição de colunas (no quadro) e cards (na coluna) por rank fracionário
+
+    Mover ou inserir um item só altera o rank dele: o novo valor fica entre
+    os ranks dos vizinhos. Os ranks de um quadro/coluna só são reescritos no
+    rebalanceamento, quando ficam longos demais ou repetidos.
+    """
+
+    # Campo que agrupa os itens de cada modelo (a ordem é independente em cada grupo)
+    GRUPOS = {Coluna: 'kanban_id', Card: 'coluna_id'}
+
+    # Cards aceitos numa movimentação em lote
+    LOTE_MAXIMO_CARDS = 500
+
+    @staticmethod
+    def _kanban_id(modelo, grupo_id):
+        if modelo is Coluna:
+            return grupo_id
+        return Coluna.objects.filter(id=grupo_id).values_list('kanban_id', flat=True).first()
+
+    @staticmethod
+    def _vizinhos(modelo, grupo_id, excluir=(), apos=None, antes_de=None, indice=None):
+        """Ranks (anterior, seguinte) da posição pedida, lidos com uma consulta no índice (grupo, rank)"""
+        itens = modelo.objects.filter(**{OrdenacaoKanbanService.GRUPOS[modelo]: grupo_id})
+        if excluir:
+            itens = itens.exclude(id__in=excluir)
+
+        if apos is not None or antes_de is not None:
+            referencia_id = VendaService._to_id(apos if apos is not None else antes_de)
+            if referencia_id is None:
+                raise OrdenacaoKanbanError('apos/antes_de inválido')
+            rank_referencia = Subquery(itens.filter(id=referencia_id).values('rank')[:1])
+            # Keyset (rank, id) a partir da referência: ela vem primeiro mesmo com ranks repetidos
+            if apos is not None:
+                linhas = itens.filter(Q(rank__gt=rank_referencia) | Q(rank=rank_referencia, id__gte=referencia_id))
+                linhas = list(linhas.order_by('rank', 'id').values_list('id', 'rank')[:2])
+            else:
+                linhas = itens.filter(Q(rank__lt=rank_referencia) | Q(rank=rank_referencia, id__lte=referencia_id))
+                linhas = list(linhas.order_by('-rank', '-id').values_list('id', 'rank')[:2])
+            if not linhas or linhas[0][0] != referencia_id:
+                raise OrdenacaoKanbanError('Item de referência não encontrado no destino', status.HTTP_404_NOT_FOUND)
+            outro = linhas[1][1] if len(linhas) > 1 else None
+            return (linhas[0][1], outro) if apos is not None else (outro, linhas[0][1])
+
+        if indice is None:
+            # Sem posição: fim da lista
+            ultimo = itens.order_by('-rank', '-id').values_list('rank', flat=True).first()
+            return ultimo, None
+        try:
+            indice = max(int(indice), 0)
+        except (ValueError, TypeError):
+            raise OrdenacaoKanbanError('ordem deve ser um número inteiro')
+        linhas = list(itens.order_by('rank', 'id').values_list('rank', flat=True)[max(indice - 1, 0):indice + 1])
+        if indice == 0:
+            return None, (linhas[0] if linhas else None)
+        return (linhas[0] if linhas else None), (linhas[1] if len(linhas) > 1 else None)
+
+    @staticmethod
+    def novo_rank(modelo, grupo_id, item_id=None, apos=None, antes_de=None, indice=None):
+        """
+        Rank para colocar um item numa posição do grupo
+
+        A posição é dada por apos (ID do item que fica antes), antes_de
+        (ID do item que fica depois) ou indice (posição 0-based, compatível
+        com o antigo campo ordem); sem nenhum deles, o fim da lista. Se os
+        vizinhos tiverem ranks repetidos ou longos demais, o grupo é
+        rebalanceado antes.
+
+        Raises:
+            OrdenacaoKanbanError: Se a posição for inválida
+        """
+        excluir = () if item_id is None else (item_id,)
+        return OrdenacaoKanbanService.novos_ranks(
+            modelo, grupo_id, 1, excluir=excluir, apos=apos, antes_de=antes_de, indice=indice
+        )[0]
+
+    @staticmethod
+    def novos_ranks(modelo, grupo_id, quantidade, excluir=(), apos=None, antes_de=None, indice=None):
+        """
+        Ranks consecutivos para colocar um bloco de itens numa posição do grupo
+
+        Mesmas regras de posição de novo_rank; os itens em excluir (o
+        próprio bloco) não contam como vizinhos.
+
+        Raises:
+            OrdenacaoKanbanError: Se a posição for inválida
+        """
+        for tentativa in range(2):
+            anterior, seguinte = OrdenacaoKanbanService._vizinhos(
+                modelo, grupo_id, excluir=excluir, apos=apos, antes_de=antes_de, indice=indice
+            )
+            novos = None
+            # Itens sem rank (criados com bulk_create) ou empatados exigem rebalanceamento
+            if '' not in (anterior, seguinte):
+                try:
+                    novos = ranks.varios_entre(anterior, seguinte, quantidade)
+                except ValueError:
+                    pass
+            if novos is not None and all(len(rank) <= ranks.TAMANHO_MAXIMO for rank in novos):
+                return novos
+            if tentativa == 0:
+                OrdenacaoKanbanService.rebalancear(modelo, grupo_id)
+        raise OrdenacaoKanbanError('Não foi possível calcular a posição do item')
+
+    @staticmethod
+    def rebalancear(modelo, grupo_id, ordenacao=('rank', 'id')):
+        """
+        Reescreve os ranks de um grupo (colunas de um quadro ou cards de uma
+        coluna) com valores curtos e igualmente espaçados, mantendo a ordem
+
+        Returns:
+            int: Quantidade de itens reescritos
+        """
+        with transaction.atomic():
+            itens = list(
+                modelo.objects.select_for_update()
+                              .filter(**{OrdenacaoKanbanService.GRUPOS[modelo]: grupo_id})
+                              .order_by(*ordenacao)
+                              .only('id', 'rank')
+            )
+            agora = timezone.now()
+            for item, rank in zip(itens, ranks.espalhados(len(itens))):
+                item.rank = rank
+                item.updated_at = agora
+            modelo.objects.bulk_update(itens, ['rank', 'updated_at'], batch_size=500)
+            # bulk_update não dispara signals
+            kanban_id = OrdenacaoKanbanService._kanban_id(modelo, grupo_id)
+            KanbanSnapshotService.incrementar_versao(kanban_id=kanban_id)
+            if modelo is Card:
+                eventos.publicar(kanban_id, 'cards.reposicionados',
+                                 {'cards': [{'id': item.id, 'coluna': grupo_id, 'rank': item.rank} for item in itens]})
+            else:
+                eventos.publicar(kanban_id, 'colunas.reposicionadas',
+                                 {'colunas': [{'id': item.id, 'rank': item.rank} for item in itens]})
+        return len(itens)
+
+    @staticmethod
+    def grupos_para_rebalancear(modelo):
+        """IDs dos grupos com ranks longos demais ou sem rank"""
+        campo = OrdenacaoKanbanService.GRUPOS[modelo]
+        return modelo.objects.annotate(tamanho=Length('rank')).filter(
+            Q(tamanho__gt=ranks.LIMIAR_REBALANCEAMENTO) | Q(rank='')
+        ).order_by(campo).values_list(campo, flat=True).distinct()
+
+    @staticmethod
+    def _validar_quadros(usuario, kanban_ids):
+        """Uma consulta para todos os quadros envolvidos: o usuário deve ser o criador de cada um"""
+        if Kanban.objects.filter(id__in=kanban_ids).exclude(criado_por=usuario).exists():
+            raise OrdenacaoKanbanError(
+                'Você não tem permissão para modificar este quadro', status.HTTP_403_FORBIDDEN
+            )
+
+    @staticmethod
+    def reordenar_colunas(usuario, posicoes):
+        """
+        Aplica novas posições a várias colunas de uma vez
+
+        As colunas não listadas mantêm a posição relativa. Os campos ordem
+        (renumerados 0..n-1) e rank de cada quadro afetado são gravados com
+        bulk_update; para não violar unique (kanban, ordem) no meio da troca,
+        as ordens passam antes por valores negativos temporários.
+
+        Args:
+            usuario: Usuário que deve ser o criador dos quadros
+            posicoes (list): [{'id': 1, 'ordem': 0}, ...]
+
+        Returns:
+            int: Quantidade de colunas reescritas
+
+        Raises:
+            OrdenacaoKanbanError: Se a lista for inválida, alguma coluna não existir
+                                  ou o usuário não puder alterar algum quadro
+        """
+        try:
+            novas = {VendaService._to_id(item['id']): int(item['ordem']) for item in posicoes}
+        except (KeyError, TypeError, ValueError):
+            raise OrdenacaoKanbanError('colunas deve ser uma lista de {id, ordem}')
+        if not novas:
+            return 0
+
+        encontradas = dict(Coluna.objects.filter(id__in=novas).values_list('id', 'kanban_id'))
+        if len(encontradas) != len(novas):
+            raise OrdenacaoKanbanError('Coluna não encontrada', status.HTTP_404_NOT_FOUND)
+        kanban_ids = set(encontradas.values())
+        OrdenacaoKanbanService._validar_quadros(usuario, kanban_ids)
+
+        with transaction.atomic():
+            por_quadro = defaultdict(list)
+            for coluna in Coluna.objects.select_for_update().filter(kanban_id__in=kanban_ids).only('id', 'kanban_id', 'ordem', 'rank'):
+                por_quadro[coluna.kanban_id].append(coluna)
+
+            colunas = []
+            for kanban_id, do_quadro in por_quadro.items():
+                # Em caso de empate, a coluna reposicionada fica antes da que manteve a ordem
+                do_quadro.sort(key=lambda c: (novas.get(c.id, c.ordem), c.id not in novas, c.ordem, c.id))
+                for posicao, (coluna, rank) in enumerate(zip(do_quadro, ranks.espalhados(len(do_quadro)))):
+                    coluna.ordem = -(posicao + 1)
+                    coluna.rank = rank
+                colunas.extend(do_quadro)
+
+            Coluna.objects.bulk_update(colunas, ['ordem'], batch_size=500)
+            agora = timezone.now()
+            for coluna in colunas:
+                coluna.ordem = -coluna.ordem - 1
+                coluna.updated_at = agora
+            Coluna.objects.bulk_update(colunas, ['ordem', 'rank', 'updated_at'], batch_size=500)
+
+            # bulk_update não dispara signals
+            for kanban_id in kanban_ids:
+                KanbanSnapshotService.incrementar_versao(kanban_id=kanban_id)
+                eventos.publicar(kanban_id, 'colunas.reposicionadas', {'colunas': [
+                    {'id': coluna.id, 'ordem': coluna.ordem, 'rank': coluna.rank}
+                    for coluna in por_quadro[kanban_id]
+                ]})
+        return len(colunas)
+
+    @staticmethod
+    def mover_cards(usuario, movimentos, observacao=''):
+        """
+        Move vários cards numa única transação
+
+        Cada movimento leva um bloco de cards, na ordem informada, para uma
+        posição da coluna destino (apos / antes_de / ordem, como em
+        novo_rank). A permissão é validada uma vez para todos os quadros;
+        cards e histórico são gravados com bulk_update e bulk_create.
+
+        Args:
+            usuario: Usuário que deve ser o criador dos quadros
+            movimentos (list): [{'cards': [1, 2], 'coluna_destino': 3, 'apos': 4}, ...]
+            observacao (str): Observação registrada no histórico de cada card
+
+        Returns:
+            list: IDs dos cards movidos
+
+        Raises:
+            OrdenacaoKanbanError: Se algum movimento for inválido
+        """
+        if not isinstance(movimentos, list) or not movimentos:
+            raise OrdenacaoKanbanError('movimentos deve ser uma lista não vazia')
+
+        blocos = []
+        for movimento in movimentos:
+            if not isinstance(movimento, dict) or not isinstance(movimento.get('cards'), list) or not movimento['cards']:
+                raise OrdenacaoKanbanError('Cada movimento deve ter coluna_destino e uma lista de cards')
+            blocos.append((VendaService._to_id(movimento.get('coluna_destino')),
+                           [VendaService._to_id(card_id) for card_id in movimento['cards']],
+                           movimento))
+
+        card_ids = [card_id for _, ids, _ in blocos for card_id in ids]
+        if None in card_ids:
+            raise OrdenacaoKanbanError('IDs de cards inválidos')
+        if len(card_ids) != len(set(card_ids)):
+            raise OrdenacaoKanbanError('Um card não pode aparecer em mais de um movimento')
+        if len(card_ids) > OrdenacaoKanbanService.LOTE_MAXIMO_CARDS:
+            raise OrdenacaoKanbanError(f'Máximo de {OrdenacaoKanbanService.LOTE_MAXIMO_CARDS} cards por requisição')
+
+        with transaction.atomic():
+            cards = Card.objects.select_for_update().only('id', 'coluna_id', 'rank', 'data_criacao').in_bulk(card_ids)
+            if len(cards) != len(card_ids):
+                raise OrdenacaoKanbanError('Card não encontrado', status.HTTP_404_NOT_FOUND)
+
+            destino_ids = {destino_id for destino_id, _, _ in blocos}
+            colunas = Coluna.objects.only('id', 'kanban_id', 'limite_cards').in_bulk(
+                destino_ids | {card.coluna_id for card in cards.values()}
+            )
+            if None in destino_ids or not destino_ids <= colunas.keys():
+                raise OrdenacaoKanbanError('Coluna destino não encontrada', status.HTTP_404_NOT_FOUND)
+            OrdenacaoKanbanService._validar_quadros(usuario, {coluna.kanban_id for coluna in colunas.values()})
+
+            for destino_id, ids, _ in blocos:
+                if any(colunas[cards[card_id].coluna_id].kanban_id != colunas[destino_id].kanban_id for card_id in ids):
+                    raise OrdenacaoKanbanError('As colunas devem pertencer ao mesmo quadro')
+
+            # Totais das colunas: primeiro as saídas, depois as entradas com UPDATE
+            # condicional (o limite vale mesmo com movimentações concorrentes)
+            saidas, entradas = defaultdict(int), defaultdict(int)
+            for destino_id, ids, _ in blocos:
+                for card_id in ids:
+                    if cards[card_id].coluna_id != destino_id:
+                        saidas[cards[card_id].coluna_id] += 1
+                        entradas[destino_id] += 1
+            for coluna_id, quantidade in saidas.items():
+                Coluna.liberar_vagas(coluna_id, quantidade)
+            for coluna_id, quantidade in entradas.items():
+                if not Coluna.ocupar_vagas(coluna_id, quantidade):
+                    raise OrdenacaoKanbanError(f'A coluna destino atingiu o limite de {colunas[coluna_id].limite_cards} cards')
+
+            historicos, trocas = [], []
+            pendentes = set(card_ids)
+            for destino_id, ids, movimento in blocos:
+                # Blocos anteriores já estão gravados e servem de vizinhos para os seguintes
+                novos = OrdenacaoKanbanService.novos_ranks(
+                    Card, destino_id, len(ids), excluir=pendentes,
+                    apos=movimento.get('apos'), antes_de=movimento.get('antes_de'), indice=movimento.get('ordem')
+                )
+                bloco = []
+                for card_id, rank in zip(ids, novos):
+                    card = cards[card_id]
+                    trocas.append((card_id, card.coluna_id, destino_id, card.data_criacao))
+                    historicos.append(HistoricoMovimentacao(
+                        card_id=card_id,
+                        coluna_origem_id=card.coluna_id,
+                        coluna_destino_id=destino_id,
+                        usuario=usuario,
+                        observacao=observacao
+                    ))
+                    card.coluna_id = destino_id
+                    card.rank = rank
+                    card.updated_at = timezone.now()
+                    bloco.append(card)
+                Card.objects.bulk_update(bloco, ['coluna', 'rank', 'updated_at'])
+                pendentes.difference_update(ids)
+
+            historicos = HistoricoMovimentacao.objects.bulk_create(historicos)
+
+            # bulk_update e bulk_create não disparam signals
+            MetricasKanbanService.registrar(trocas)
+            for kanban_id in {colunas[destino_id].kanban_id for destino_id in destino_ids}:
+                KanbanSnapshotService.incrementar_versao(kanban_id=kanban_id)
+                eventos.publicar(kanban_id, 'cards.movidos', {'cards': [
+                    {'id': card.id, 'coluna': card.coluna_id, 'rank': card.rank}
+                    for card in cards.values() if colunas[card.coluna_id].kanban_id == kanban_id
+                ]})
+            from .signals import processar_movimentacoes
+            processar_movimentacoes(historicos)
+        return card_ids
+
+
+class ContadorCardsService:
+    """Manutenção de Coluna.cards_count (total de cards usado nos limites de WIP)"""
+
+    @staticmethod
+    def reconciliar(coluna_ids=None):
+        """
+        Recalcula cards_count a partir dos cards, corrigindo apenas as
+        colunas divergentes (ex.: cards criados com bulk_create)
+
+        Returns:
+            int: Quantidade de colunas corrigidas
+        """
+        total = Subquery(
+            Card.objects.filter(coluna=OuterRef('pk')).order_by().values('coluna').annotate(total=Count('id')).values('total')
+        )
+        colunas = Coluna.objects.annotate(total_real=Coalesce(total, 0)).exclude(cards_count=F('total_real'))
+        if coluna_ids is not None:
+            colunas = colunas.filter(id__in=coluna_ids)
+        with transaction.atomic():
+            ids = list(colunas.select_for_update().values_list('id', flat=True))
+            Coluna.objects.filter(id__in=ids).update(cards_count=Coalesce(total, 0))
+        return len(ids)
+
+
+class BuscaCardsService:
+    """
+    Busca de texto completo em titulo e descricao dos cards
+
+    PostgreSQL usa a coluna tsvector kanban_card.busca (índice GIN) e
+    SQLite a tabela FTS5 kanban_card_busca, ambas criadas pela migração
+    0019. O índice é atualizado pelos signals de Card a cada gravação e
+    exclusão; reindexar() reconstrói tudo (ex.: após bulk_create). Em
+    outros bancos a busca cai para icontains, sem ranking.
+    """
+
+    # Peso do título em relação à descrição no ranking do SQLite (bm25)
+    PESO_TITULO = 10.0
+    LIMITE_PADRAO = 20
+    LIMITE_MAXIMO = 100
+    MAXIMO_TERMOS = 10
+
+    _TSVECTOR = (
+        "setweight(to_tsvector('portuguese', coalesce(titulo, '')), 'A') || "
+        "setweight(to_tsvector('portuguese', coalesce(descricao, '')), 'B')"
+    )
+
+    @staticmethod
+    def termos(q):
+        """Palavras da consulta (sem operadores), usadas como prefixo: busca enquanto digita"""
+        return re.findall(r'\w+', q or '')[:BuscaCardsService.MAXIMO_TERMOS]
+
+    @staticmethod
+    def indexar(card_ids):
+        """Atualiza o índice dos cards informados"""
+        card_ids = list(card_ids)
+        if not card_ids:
+            return
+        marcadores = ', '.join(['%s'] * len(card_ids))
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute(
+                    f'UPDATE kanban_card SET busca = {BuscaCardsService._TSVECTOR} WHERE id IN ({marcadores})',
+                    card_ids
+                )
+            elif connection.vendor == 'sqlite':
+                cursor.execute(f'DELETE FROM kanban_card_busca WHERE rowid IN ({marcadores})', card_ids)
+                cursor.execute(
+                    'INSERT INTO kanban_card_busca (rowid, titulo, descricao) '
+                    f"SELECT id, titulo, coalesce(descricao, '') FROM kanban_card WHERE id IN ({marcadores})",
+                    card_ids
+                )
+
+    @staticmethod
+    def remover(card_ids):
+        """Retira do índice cards excluídos (no PostgreSQL o tsvector sai junto com a linha)"""
+        card_ids = list(card_ids)
+        if card_ids and connection.vendor == 'sqlite':
+            marcadores = ', '.join(['%s'] * len(card_ids))
+            with connection.cursor() as cursor:
+                cursor.execute(f'DELETE FROM kanban_card_busca WHERE rowid IN ({marcadores})', card_ids)
+
+    @staticmethod
+    def reindexar():
+        """Reconstrói o índice de todos os cards"""
+        with transaction.atomic(), connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute(f'UPDATE kanban_card SET busca = {BuscaCardsService._TSVECTOR}')
+            elif connection.vendor == 'sqlite':
+                cursor.execute('DELETE FROM kanban_card_busca')
+                cursor.execute(
+                    'INSERT INTO kanban_card_busca (rowid, titulo, descricao) '
+                    "SELECT id, titulo, coalesce(descricao, '') FROM kanban_card"
+                )
+        return Card.objects.count()
+
+    @staticmethod
+    def buscar(usuario, q, limite=None):
+        """
+        Cards dos quadros do usuário que contêm todos os termos, do mais ao menos relevante
+
+        Returns:
+            QuerySet: Cards anotados com relevancia (maior = mais relevante)
+        """
+        termos = BuscaCardsService.termos(q)
+        cards = Card.objects.filter(coluna__kanban__criado_por=usuario)
+        if not termos:
+            return cards.none()
+        limite = min(limite or BuscaCardsService.LIMITE_PADRAO, BuscaCardsService.LIMITE_MAXIMO)
+
+        if connection.vendor == 'postgresql':
+            consulta = ' & '.join(f'{termo}:*' for termo in termos)
+            cards = cards.filter(
+                RawSQL("kanban_card.busca @@ to_tsquery('portuguese', %s)", [consulta], output_field=BooleanField())
+            ).annotate(
+                relevancia=RawSQL("ts_rank_cd(kanban_card.busca, to_tsquery('portuguese', %s))", [consulta], output_field=FloatField())
+            )
+        elif connection.vendor == 'sqlite':
+            consulta = ' '.join(f'"{termo}"*' for termo in termos)
+            cards = cards.filter(
+                id__in=RawSQL('SELECT rowid FROM kanban_card_busca WHERE kanban_card_busca MATCH %s', [consulta])
+            ).annotate(
+                relevancia=RawSQL(
+                    '(SELECT -bm25(kanban_card_busca, %s, 1.0) FROM kanban_card_busca '
+                    'WHERE kanban_card_busca MATCH %s AND rowid = kanban_card.id)',
+                    [BuscaCardsService.PESO_TITULO, consulta], output_field=FloatField()
+                )
+            )
+        else:
+            for termo in termos:
+                cards = cards.filter(Q(titulo__icontains=termo) | Q(descricao__icontains=termo))
+            cards = cards.annotate(relevancia=Value(0.0, output_field=FloatField()))
+
+        return cards.order_by('-relevancia', 'id')[:limite]
+
+
+class MetricasKanbanService:
+    """
+    Tempos de ciclo, lead time e fluxo cumulativo (CFD) dos quadros
+
+    Cada entrada de um card numa coluna abre um intervalo (PermanenciaColuna)
+    e a saída o encerra; ao mesmo tempo os totais do dia da coluna
+    (FluxoDiarioColuna) recebem a entrada, a saída e as durações. As
+    consultas leem apenas esses totais, então custam O(dias × colunas),
+    sem percorrer o histórico de movimentações.
+    """
+
+    LOTE_UPSERT = 500
+    DIAS_PADRAO = 30
+    DIAS_MAXIMO = 366
+
+    @staticmethod
+    def registrar(movimentos, instante=None):
+        """
+        Registra entradas e saídas de cards nas colunas
+
+        Args:
+            movimentos (list): Tuplas (card_id, origem_id, destino_id, data_criacao);
+                origem None para cards criados e destino None para cards excluídos
+            instante (datetime, optional): Momento da movimentação (padrão: agora)
+        """
+        movimentos = [movimento for movimento in movimentos if movimento[1] != movimento[2]]
+        if not movimentos:
+            return
+        instante = instante or timezone.now()
+        dia = timezone.localtime(instante).date()
+        deltas = defaultdict(lambda: [0, 0, 0, 0])
+
+        saindo = {card_id for card_id, origem_id, _, _ in movimentos if origem_id is not None}
+        if saindo:
+            abertos = PermanenciaColuna.objects.filter(card_id__in=saindo, saida__isnull=True)
+            for coluna_id, entrada in abertos.values_list('coluna_id', 'entrada'):
+                delta = deltas[(coluna_id, dia)]
+                delta[1] += 1
+                delta[2] += max(int((instante - entrada).total_seconds()), 0)
+            abertos.update(saida=instante)
+
+        novos = []
+        for card_id, _, destino_id, data_criacao in movimentos:
+            if destino_id is None:
+                continue
+            novos.append(PermanenciaColuna(card_id=card_id, coluna_id=destino_id, entrada=instante))
+            delta = deltas[(destino_id, dia)]
+            delta[0] += 1
+            delta[3] += max(int((instante - data_criacao).total_seconds()), 0)
+        PermanenciaColuna.objects.bulk_create(novos)
+
+        MetricasKanbanService._upsert(deltas)
+
+    @staticmethod
+    def _upsert(deltas):
+        if not deltas:
+            return
+        quadros = dict(
+            Coluna.objects.filter(id__in={coluna_id for coluna_id, _ in deltas}).values_list('id', 'kanban_id')
+        )
+        linhas = [(chave, valores) for chave, valores in deltas.items() if chave[0] in quadros]
+        tabela = connection.ops.quote_name(FluxoDiarioColuna._meta.db_table)
+
+        with connection.cursor() as cursor:
+            for inicio in range(0, len(linhas), MetricasKanbanService.LOTE_UPSERT):
+                lote = linhas[inicio:inicio + MetricasKanbanService.LOTE_UPSERT]
+                params = []
+                for (coluna_id, dia), (entradas, saidas, permanencia, ate_entrada) in lote:
+                    params.extend([
+                        quadros[coluna_id],
+                        coluna_id,
+                        connection.ops.adapt_datefield_value(dia),
+                        entradas,
+                        saidas,
+                        permanencia,
+                        ate_entrada,
+                    ])
+                valores = ', '.join(['(%s, %s, %s, %s, %s, %s, %s)'] * len(lote))
+                cursor.execute(
+                    f'INSERT INTO {tabela} '
+                    f'(kanban_id, coluna_id, data, entradas, saidas, segundos_permanencia, segundos_ate_entrada) '
+                    f'VALUES {valores} '
+                    f'ON CONFLICT (coluna_id, data) DO UPDATE SET '
+                    f'entradas = {tabela}.entradas + EXCLUDED.entradas, '
+                    f'saidas = {tabela}.saidas + EXCLUDED.saidas, '
+                    f'segundos_permanencia = {tabela}.segundos_permanencia + EXCLUDED.segundos_permanencia, '
+                    f'segundos_ate_entrada = {tabela}.segundos_ate_entrada + EXCLUDED.segundos_ate_entrada',
+                    params
+                )
+
+    @staticmethod
+    def periodo(inicio=None, fim=None):
+        """
+        Período da consulta: por padrão os últimos DIAS_PADRAO dias
+
+        Raises:
+            ValueError: Se o período for invertido ou maior que DIAS_MAXIMO
+        """
+        fim = fim or timezone.localdate()
+        inicio = inicio or fim - timedelta(days=MetricasKanbanService.DIAS_PADRAO - 1)
+        if inicio > fim:
+            raise ValueError('inicio deve ser anterior ou igual a fim')
+        if (fim - inicio).days >= MetricasKanbanService.DIAS_MAXIMO:
+            raise ValueError(f'O período deve ter no máximo {MetricasKanbanService.DIAS_MAXIMO} dias')
+        return inicio, fim
+
+    @staticmethod
+    def _horas(segundos, quantidade):
+        return round(segundos / quantidade / 3600, 2) if quantidade else None
+
+    @staticmethod
+    def resumo(kanban, inicio, fim):
+        """
+        Tempo médio em cada coluna e lead time no período
+
+        O tempo na coluna é a média das permanências encerradas no período;
+        o lead time de uma coluna é a idade média dos cards ao chegar nela
+        (na última coluna, o lead time do quadro).
+
+        Returns:
+            dict: {'inicio', 'fim', 'colunas': [...], 'lead_time_horas', 'vazao'}
+        """
+        colunas = list(kanban.colunas.order_by('rank', 'id').values('id', 'nome', 'cards_count'))
+        totais = {
+            linha['coluna_id']: linha
+            for linha in FluxoDiarioColuna.objects.filter(
+                kanban_id=kanban.id, data__gte=inicio, data__lte=fim
+            ).values('coluna_id').annotate(
+                total_entradas=Sum('entradas'),
+                total_saidas=Sum('saidas'),
+                total_permanencia=Sum('segundos_permanencia'),
+                total_ate_entrada=Sum('segundos_ate_entrada'),
+            ).order_by()
+        }
+
+        resultado = []
+        for coluna in colunas:
+            total = totais.get(coluna['id'], {})
+            entradas = total.get('total_entradas') or 0
+            saidas = total.get('total_saidas') or 0
+            resultado.append({
+                'id': coluna['id'],
+                'nome': coluna['nome'],
+                'cards_atuais': coluna['cards_count'],
+                'entradas': entradas,
+                'saidas': saidas,
+                'tempo_medio_horas': MetricasKanbanService._horas(total.get('total_permanencia') or 0, saidas),
+                'lead_time_horas': MetricasKanbanService._horas(total.get('total_ate_entrada') or 0, entradas),
+            })
+
+        ultima = resultado[-1] if resultado else None
+        return {
+            'inicio': inicio,
+            'fim': fim,
+            'colunas': resultado,
+            'lead_time_horas': ultima['lead_time_horas'] if ultima else None,
+            'vazao': ultima['entradas'] if ultima else 0,
+        }
+
+    @staticmethod
+    def fluxo(kanban, inicio, fim):
+        """
+        Fluxo cumulativo: quantidade de cards em cada coluna no fim de cada dia
+
+        Returns:
+            dict: {'inicio', 'fim', 'colunas': [{'id', 'nome'}], 'dias': [{'data', 'cards': [...]}]}
+                  com 'cards' na mesma ordem de 'colunas'
+        """
+        colunas = list(kanban.colunas.order_by('rank', 'id').values('id', 'nome'))
+        linhas = FluxoDiarioColuna.objects.filter(kanban_id=kanban.id, data__lte=fim)
+
+        # Saldo acumulado até a véspera do período, depois a variação de cada dia
+        saldo = defaultdict(int)
+        for coluna_id, entradas, saidas in linhas.filter(data__lt=inicio).values('coluna_id').annotate(
+            total_entradas=Sum('entradas'), total_saidas=Sum('saidas')
+        ).order_by().values_list('coluna_id', 'total_entradas', 'total_saidas'):
+            saldo[coluna_id] = entradas - saidas
+        variacoes = defaultdict(dict)
+        for coluna_id, dia, entradas, saidas in linhas.filter(data__gte=inicio).values_list(
+            'coluna_id', 'data', 'entradas', 'saidas'
+        ):
+            variacoes[dia][coluna_id] = entradas - saidas
+
+        dias = []
+        dia = inicio
+        while dia <= fim:
+            for coluna_id, variacao in variacoes.get(dia, {}).items():
+                saldo[coluna_id] += variacao
+            dias.append({'data': dia, 'cards': [saldo[coluna['id']] for coluna in colunas]})
+            dia += timedelta(days=1)
+
+        return {'inicio': inicio, 'fim': fim, 'colunas': colunas, 'dias': dias}
+
+    @staticmethod
+    def reconstruir(tamanho_lote=500, progresso=None):
+        """
+        Recalcula intervalos e totais diários a partir do histórico (backfill)
+
+        Cards excluídos já não têm histórico, então o saldo das colunas
+        passa a considerar apenas os cards existentes.
+
+        Args:
+            tamanho_lote (int): Quantidade de cards lidos por vez
+            progresso (callable, optional): Chamado com o total de cards processados
+
+        Returns:
+            int: Total de cards processados
+        """
+        processados = 0
+        ultimo_id = 0
+        with transaction.atomic():
+            PermanenciaColuna.objects.all().delete()
+            FluxoDiarioColuna.objects.all().delete()
+            while True:
+                cards = list(
+                    Card.objects.filter(id__gt=ultimo_id).order_by('id')
+                    .only('id', 'coluna_id', 'data_criacao', 'updated_at')[:tamanho_lote]
+                )
+                if not cards:
+                    break
+                # Movimentações antigas podem já estar no arquivo (ArquivamentoKanbanService)
+                historicos = defaultdict(list)
+                for modelo in (HistoricoMovimentacaoArquivo, HistoricoMovimentacao):
+                    for historico in modelo.objects.filter(card_id__in=[card.id for card in cards]).values_list(
+                        'card_id', 'coluna_origem_id', 'coluna_destino_id', 'data', 'id'
+                    ):
+                        historicos[historico[0]].append(historico[1:])
+                for movimentacoes in historicos.values():
+                    movimentacoes.sort(key=lambda movimentacao: movimentacao[2:])
+
+                intervalos, deltas = [], defaultdict(lambda: [0, 0, 0, 0])
+                for card in cards:
+                    MetricasKanbanService._repetir(card, historicos[card.id], intervalos, deltas)
+                colunas = set(Coluna.objects.filter(
+                    id__in={intervalo.coluna_id for intervalo in intervalos}
+                ).values_list('id', flat=True))
+                PermanenciaColuna.objects.bulk_create(
+                    [intervalo for intervalo in intervalos if intervalo.coluna_id in colunas]
+                )
+                MetricasKanbanService._upsert(deltas)
+
+                ultimo_id = cards[-1].id
+                processados += len(cards)
+                if progresso:
+                    progresso(processados)
+        return processados
+
+    @staticmethod
+    def _repetir(card, movimentacoes, intervalos, deltas):
+        """Refaz as entradas e saídas de um card a partir das suas movimentações"""
+        def entrar(coluna_id, instante):
+            intervalos.append(PermanenciaColuna(card_id=card.id, coluna_id=coluna_id, entrada=instante))
+            delta = deltas[(coluna_id, timezone.localtime(instante).date())]
+            delta[0] += 1
+            delta[3] += max(int((instante - card.data_criacao).total_seconds()), 0)
+
+        def sair(instante):
+            atual = intervalos[-1]
+            atual.saida = instante
+            delta = deltas[(atual.coluna_id, timezone.localtime(instante).date())]
+            delta[1] += 1
+            delta[2] += max(int((instante - atual.entrada).total_seconds()), 0)
+
+        movimentacoes = [movimento for movimento in movimentacoes if movimento[0] != movimento[1]]
+        inicial = movimentacoes[0][0] if movimentacoes and movimentacoes[0][0] else card.coluna_id
+        entrar(inicial, card.data_criacao)
+        for _, destino_id, instante, _ in movimentacoes:
+            # Colunas excluídas ficam nulas no histórico: o card segue na coluna conhecida
+            if destino_id is None or destino_id == intervalos[-1].coluna_id:
+                continue
+            sair(instante)
+            entrar(destino_id, instante)
+        if intervalos[-1].coluna_id != card.coluna_id:
+            # Mudança de coluna sem histórico (ex.: edição direta do card)
+            instante = max(card.updated_at, intervalos[-1].entrada)
+            sair(instante)
+            entrar(card.coluna_id, instante)
+
+
+class ArquivamentoKanbanService:
+    """
+    Retenção do histórico de movimentações e dos logs de notificação
+
+    Registros mais antigos que o horizonte configurado são copiados para as
+    tabelas de arquivo (sem FKs, com o quadro e os nomes já resolvidos) e
+    apagados das tabelas principais, em lotes com uma transação cada. As
+    consultas normais leem só os registros recentes; ?incluir_arquivo=1
+    junta os arquivados.
+    """
+
+    TAMANHO_LOTE = 1000
+
+    CAMPOS_HISTORICO = {
+        'id': 'id',
+        'kanban_id': 'card__coluna__kanban_id',
+        'card_id': 'card_id',
+        'card_titulo': 'card__titulo',
+        'coluna_origem_id': 'coluna_origem_id',
+        'coluna_origem_nome': 'coluna_origem__nome',
+        'coluna_destino_id': 'coluna_destino_id',
+        'coluna_destino_nome': 'coluna_destino__nome',
+        'usuario_id': 'usuario_id',
+        'usuario_nome': 'usuario__nome',
+        'data': 'data',
+        'observacao': 'observacao',
+    }
+
+    CAMPOS_LOGS = {
+        'id': 'id',
+        'kanban_id': 'card__coluna__kanban_id',
+        'card_id': 'card_id',
+        'card_titulo': 'card__titulo',
+        'regra_id': 'regra_id',
+        'regra_nome': 'regra__nome',
+        'destinatario': 'destinatario',
+        'mensagem': 'mensagem',
+        'status': 'status',
+        'erro_mensagem': 'erro_mensagem',
+        'data_envio': 'data_envio',
+        'tentativas': 'tentativas',
+    }
+
+    @staticmethod
+    def arquivar_historico(dias=None, tamanho_lote=None, progresso=None):
+        """
+        Arquiva as movimentações com mais de N dias (padrão: KANBAN_ARQUIVO_HISTORICO_DIAS)
+
+        Returns:
+            int: Quantidade de registros arquivados
+        """
+        dias = settings.KANBAN_ARQUIVO_HISTORICO_DIAS if dias is None else dias
+        return ArquivamentoKanbanService._arquivar(
+            HistoricoMovimentacao.objects.filter(data__lt=timezone.now() - timedelta(days=dias)),
+            'data', HistoricoMovimentacaoArquivo, ArquivamentoKanbanService.CAMPOS_HISTORICO,
+            tamanho_lote, progresso
+        )
+
+    @staticmethod
+    def arquivar_logs(dias=None, tamanho_lote=None, progresso=None):
+        """
+        Arquiva os logs de notificação com mais de N dias (padrão: KANBAN_ARQUIVO_LOGS_DIAS)
+
+        Returns:
+            int: Quantidade de registros arquivados
+        """
+        dias = settings.KANBAN_ARQUIVO_LOGS_DIAS if dias is None else dias
+        return ArquivamentoKanbanService._arquivar(
+            LogNotificacao.objects.filter(data_envio__lt=timezone.now() - timedelta(days=dias)),
+            'data_envio', LogNotificacaoArquivo, ArquivamentoKanbanService.CAMPOS_LOGS,
+            tamanho_lote, progresso
+        )
+
+    @staticmethod
+    def _arquivar(queryset, campo_data, modelo_arquivo, campos, tamanho_lote=None, progresso=None):
+        tamanho_lote = tamanho_lote or ArquivamentoKanbanService.TAMANHO_LOTE
+        arquivados = 0
+        while True:
+            # Uma transação por lote: a cópia e a exclusão são atômicas sem bloquear a tabela inteira
+            with transaction.atomic():
+                linhas = list(queryset.order_by(campo_data, 'id').values(*campos.values())[:tamanho_lote])
+                if not linhas:
+                    break
+                agora = timezone.now()
+                modelo_arquivo.objects.bulk_create([
+                    modelo_arquivo(arquivado_em=agora, **{campo: linha[origem] for campo, origem in campos.items()})
+                    for linha in linhas
+                ], ignore_conflicts=True)
+                queryset.model.objects.filter(id__in=[linha['id'] for linha in linhas]).delete()
+            arquivados += len(linhas)
+            if progresso:
+                progresso(arquivados)
+        return arquivados
@@ -1,6 +1,10 @@
-from django.db.models.signals import post_save, post_delete
+from django.db.models import F
+from django.db.models.expressions import Combinable
+from django.db.models.signals import post_save, post_delete, pre_delete, pre_save
 from django.dispatch import receiver
-from .models_kanban import Card, HistoricoMovimentacao, RegraAutomacao, LogNotificacao
+from .models import Cliente, Produto, Usuario
+from .models_kanban import Kanban, Card, Coluna, HistoricoMovimentacao, RegraAutomacao, LogNotificacao, RemocaoKanban
+from .services import BuscaCardsService, KanbanSnapshotService, MetricasKanbanService
 import logging
 
 logger = logging.getLogger(__name__)
@@ -199,4 +203,155 @@ def log_card_movement(sender, instance, created, **kwargs):
                 if regra.coluna_trigger and regra.coluna_trigger.id == instance.coluna_destino.id:
                     send_automation_notification(regra, instance.card)
         except Exception as e:
-            logger.error(f"Erro ao processar automação de movimentação: {str(e)}")
\ No newline at end of file
+            logger.error(f"Erro ao processar automação de movimentação: {str(e)}")
+
+
+def processar_movimentacoes(historicos):
+    """
+    Regras de movimentação para históricos gravados com bulk_create
+    (que não dispara post_save)
+    """
+    try:
+        regras = list(RegraAutomacao.objects.filter(
+            tipo_trigger='movimentacao',
+            ativo=True,
+            coluna_trigger_id__in={historico.coluna_destino_id for historico in historicos}
+        ))
+        if not regras:
+            return
+
+        cards = Card.objects.select_related('coluna__kanban__cliente', 'produto', 'responsavel').in_bulk(
+            {historico.card_id for historico in historicos}
+        )
+        for historico in historicos:
+            card = cards[historico.card_id]
+            for regra in regras:
+                if regra.coluna_trigger_id == historico.coluna_destino_id and regra.kanban_id == card.coluna.kanban_id:
+                    send_automation_notification(regra, card)
+    except Exception as e:
+        logger.error(f"Erro ao processar automação de movimentação: {str(e)}")
+
+
+@receiver([post_save, post_delete], sender=Coluna)
+@receiver([post_save, post_delete], sender=RegraAutomacao)
+def incrementar_versao_quadro(sender, instance, **kwargs):
+    """
+    Invalida o quadro completo em cache quando uma coluna ou regra muda
+    """
+    KanbanSnapshotService.incrementar_versao(kanban_id=instance.kanban_id)
+
+
+@receiver(pre_save, sender=Kanban)
+def incrementar_versao_do_proprio_quadro(sender, instance, update_fields=None, **kwargs):
+    """
+    Invalida o quadro completo em cache quando o próprio quadro é gravado
+
+    A versão é incrementada na mesma escrita (F('versao') + 1) para que um
+    objeto carregado antes de outras alterações não grave uma versão antiga.
+    """
+    if instance._state.adding:
+        return
+    if update_fields is not None and 'versao' not in update_fields:
+        return
+    instance.versao = F('versao') + 1
+
+
+@receiver(post_save, sender=Kanban)
+def recarregar_versao_quadro(sender, instance, created, update_fields=None, **kwargs):
+    """
+    Recarrega a versão gravada (ou a incrementa, se o save não incluiu versao)
+    """
+    if created:
+        return
+    if update_fields is not None and 'versao' not in update_fields:
+        KanbanSnapshotService.incrementar_versao(kanban_id=instance.id)
+    elif not isinstance(instance.versao, Combinable):
+        return
+    instance.refresh_from_db(fields=['versao'])
+
+
+@receiver([post_save, pre_delete], sender=Cliente)
+@receiver([post_save, pre_delete], sender=Produto)
+@receiver([post_save, pre_delete], sender=Usuario)
+def incrementar_versao_quadros_que_exibem(sender, instance, update_fields=None, **kwargs):
+    """
+    Invalida os quadros que mostram o nome (ou os dados) de um cliente,
+    produto ou usuário alterado ou removido
+    """
+    if kwargs.get('created'):
+        return
+    if update_fields is not None and \
+            not set(update_fields) & KanbanSnapshotService.CAMPOS_EXIBIDOS[sender.__name__]:
+        return
+    KanbanSnapshotService.incrementar_versao_dos_que_exibem(instance)
+
+
+@receiver([post_save, post_delete], sender=Card)
+def incrementar_versao_quadro_do_card(sender, instance, **kwargs):
+    """
+    Invalida o quadro completo em cache quando um card muda
+    """
+    KanbanSnapshotService.incrementar_versao(coluna_id=instance.coluna_id)
+
+
+@receiver(post_delete, sender=Card)
+def liberar_vaga_coluna(sender, instance, **kwargs):
+    """
+    Mantém Coluna.cards_count ao excluir um card
+    """
+    Coluna.liberar_vagas(instance.coluna_id)
+
+
+@receiver(post_delete, sender=Coluna)
+def registrar_remocao_coluna(sender, instance, **kwargs):
+    """
+    Tombstone da coluna para /api/kanbans/{id}/mudancas/
+    """
+    RemocaoKanban.objects.create(kanban_id=instance.kanban_id, tipo='coluna', objeto_id=instance.id)
+
+
+@receiver(post_delete, sender=Card)
+def registrar_remocao_card(sender, instance, **kwargs):
+    """
+    Tombstone do card para /api/kanbans/{id}/mudancas/
+    """
+    # Em exclusões em cascata os cards saem antes da coluna, então ela ainda existe aqui
+    kanban_id = Coluna.objects.filter(pk=instance.coluna_id).values_list('kanban_id', flat=True).first()
+    if kanban_id is not None:
+        RemocaoKanban.objects.create(kanban_id=kanban_id, tipo='card', objeto_id=instance.id)
+
+
+@receiver(post_save, sender=Card)
+def indexar_card_busca(sender, instance, created, update_fields=None, **kwargs):
+    """
+    Mantém o índice de texto completo (/api/cards/busca/) quando titulo ou descricao podem ter mudado
+    """
+    if created or update_fields is None or {'titulo', 'descricao'} & set(update_fields):
+        BuscaCardsService.indexar([instance.id])
+
+
+@receiver(post_delete, sender=Card)
+def remover_card_busca(sender, instance, **kwargs):
+    """
+    Retira o card excluído do índice de texto completo
+    """
+    BuscaCardsService.remover([instance.id])
+
+
+@receiver(post_save, sender=Card)
+def registrar_metricas_card(sender, instance, created, **kwargs):
+    """
+    Abre e encerra os intervalos do card nas colunas (/api/kanbans/{id}/metricas/)
+    """
+    # Card.save só atualiza _coluna_id_original depois dos signals
+    origem = None if created else getattr(instance, '_coluna_id_original', None)
+    if created or (origem is not None and origem != instance.coluna_id):
+        MetricasKanbanService.registrar([(instance.id, origem, instance.coluna_id, instance.data_criacao)])
+
+
+@receiver(pre_delete, sender=Card)
+def registrar_metricas_exclusao_card(sender, instance, **kwargs):
+    """
+    Conta a saída do card excluído (antes que a exclusão em cascata apague seus intervalos)
+    """
+    MetricasKanbanService.registrar([(instance.id, instance.coluna_id, None, instance.data_criacao)])
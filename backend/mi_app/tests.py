@@ -1,3 +1,1246 @@
-from django.test import TestCase
+import asyncio
+import csv
+import json
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import OperationalError, connection, transaction
+from django.test import AsyncClient, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .models import Carrito, Cliente, Produto, ResumoVendas, Usuario, Venta, VentaItem
+from .models_kanban import (
+    Card, Coluna, HistoricoMovimentacao, HistoricoMovimentacaoArquivo, Kanban, LimiteCardsError,
+    LogNotificacao, LogNotificacaoArquivo, RemocaoKanban
+)
+from . import checks, eventos, rank
+from .services import (
+    CarrinhoCache, EstoqueService, ExportacaoVendasService, IdempotenciaService, OrdenacaoKanbanService, ReservaService
+)
+
+
+class EstoqueServiceTest(TestCase):
+    def setUp(self):
+        self.produto_a = Produto.objects.create(nome='A', preco='10.00', estoque=5)
+        self.produto_b = Produto.objects.create(nome='B', preco='20.00', estoque=1)
+
+    def test_baixa_todos_os_produtos(self):
+        falhas = EstoqueService.baixar({self.produto_a.id: 3, self.produto_b.id: 1})
+
+        self.assertEqual(falhas, [])
+        self.assertEqual(Produto.objects.get(id=self.produto_a.id).estoque, 2)
+        self.assertEqual(Produto.objects.get(id=self.produto_b.id).estoque, 0)
+
+    def test_reporta_falhas_sem_baixa_parcial(self):
+        falhas = EstoqueService.baixar({self.produto_a.id: 3, self.produto_b.id: 2})
+
+        self.assertEqual(falhas, [self.produto_b.id])
+        self.assertEqual(Produto.objects.get(id=self.produto_a.id).estoque, 5)
+        self.assertEqual(Produto.objects.get(id=self.produto_b.id).estoque, 1)
+
+    def test_reduzir_e_aumentar_estoque(self):
+        self.assertTrue(self.produto_b.reduzir_estoque(1))
+        self.assertFalse(self.produto_b.reduzir_estoque(1))
+        self.assertEqual(self.produto_b.estoque, 0)
+
+        self.produto_b.aumentar_estoque(2)
+        self.assertEqual(self.produto_b.estoque, 2)
+
+
+class ReservaCarrinhoTest(TestCase):
+    def setUp(self):
+        self.produto = Produto.objects.create(nome='A', preco='10.00', estoque=5)
+        self.client = APIClient()
+
+    def _adicionar(self, session_id, quantidade):
+        return self.client.post('/api/carrito/', {
+            'session_id': session_id, 'produto_id': self.produto.id, 'quantidade': quantidade
+        }, format='json')
+
+    def test_reserva_bloqueia_outros_carrinhos_e_e_consumida_na_venda(self):
+        self.assertEqual(self._adicionar('s1', 4).status_code, 201)
+        self.assertEqual(self._adicionar('s2', 2).status_code, 400)
+
+        response = self.client.post('/api/vendas/procesar_desde_carrito/', {'session_id': 's1'}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.produto.refresh_from_db()
+        self.assertEqual((self.produto.estoque, self.produto.estoque_reservado), (1, 0))
+
+    def test_reserva_vencida_e_liberada(self):
+        self._adicionar('s1', 5)
+        Carrito.objects.update(reservado_ate=timezone.now() - timedelta(minutes=1))
+
+        self.assertEqual(ReservaService.expirar(), 1)
+        self.produto.refresh_from_db()
+        self.assertEqual(self.produto.estoque_reservado, 0)
+        self.assertEqual(self._adicionar('s2', 5).status_code, 201)
+
+    def test_venda_libera_reservas_vencidas_dos_produtos(self):
+        self._adicionar('s1', 4)
+        self._adicionar('s2', 1)
+        Carrito.objects.filter(session_id='s1').update(reservado_ate=timezone.now() - timedelta(minutes=1))
+
+        # PDV: só as unidades da reserva vencida de s1 ficam livres
+        self.assertEqual(EstoqueService.baixar({self.produto.id: 5}), [self.produto.id])
+        self.assertEqual(EstoqueService.baixar({self.produto.id: 3}), [])
+        self.produto.refresh_from_db()
+        self.assertEqual((self.produto.estoque, self.produto.estoque_reservado), (2, 1))
+
+        # O checkout de um carrinho vencido consome a própria reserva, sem liberá-la antes
+        Carrito.objects.filter(session_id='s2').update(reservado_ate=timezone.now() - timedelta(minutes=1))
+        response = self.client.post('/api/vendas/procesar_desde_carrito/', {'session_id': 's2'}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.produto.refresh_from_db()
+        self.assertEqual((self.produto.estoque, self.produto.estoque_reservado), (1, 0))
+
+    def test_venda_direta_e_lote_nao_contam_reservas_vencidas(self):
+        self._adicionar('s1', 4)
+        Carrito.objects.update(reservado_ate=timezone.now() - timedelta(minutes=1))
+
+        response = self.client.post('/api/vendas/', {
+            'items': [{'produto': self.produto.id, 'quantidade': 3}]
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+
+        self._adicionar('s2', 2)
+        Carrito.objects.update(reservado_ate=timezone.now() - timedelta(minutes=1))
+        response = self.client.post('/api/vendas/lote/', [
+            {'items': [{'produto': self.produto.id, 'quantidade': 2}]}
+        ], format='json')
+        self.assertEqual(response.data['criadas'], 1)
+        self.produto.refresh_from_db()
+        self.assertEqual((self.produto.estoque, self.produto.estoque_reservado), (0, 0))
+
+    def test_listagem_do_carrinho_carrega_produtos_em_uma_consulta(self):
+        for indice in range(10):
+            produto = Produto.objects.create(nome=f'P{indice}', preco='1.00', estoque=5)
+            Carrito.objects.create(session_id='s1', produto_id=produto.id, quantidade=1, preco_unitario='1.00')
+
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/carrito/', {'session_id': 's1'})
+        self.assertEqual(len(response.data), 10)
+
+
+class VendasLoteTest(TestCase):
+    def setUp(self):
+        self.produto = Produto.objects.create(nome='A', preco='10.00', estoque=5)
+        self.client = APIClient()
+
+    def _lote(self, corpo, content_type='application/json'):
+        return self.client.post('/api/vendas/lote/', corpo, content_type=content_type)
+
+    def test_lote_misto_cria_as_validas_e_rejeita_as_demais(self):
+        response = self._lote(json.dumps([
+            {'referencia': 'a', 'items': [{'produto': self.produto.id, 'quantidade': 3}]},
+            {'referencia': 'b', 'items': [{'produto': self.produto.id, 'quantidade': 3}]},
+            {'referencia': 'c', 'items': [{'produto': 999999, 'quantidade': 1}]},
+            {'items': [{'produto': self.produto.id, 'quantidade': 2}]},
+        ]))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['criadas'], response.data['rejeitadas']), (2, 2))
+        resultados = response.data['resultados']
+        self.assertEqual({referencia: resultado['status'] for referencia, resultado in resultados.items()},
+                         {'a': 'criada', 'b': 'erro', 'c': 'erro', '3': 'criada'})
+        self.assertEqual(resultados['c']['status_code'], 404)
+        self.produto.refresh_from_db()
+        self.assertEqual(self.produto.estoque, 0)
+
+    def test_referencia_repetida_recusa_o_lote(self):
+        item = {'produto': self.produto.id, 'quantidade': 1}
+        for vendas in (
+            [{'referencia': 'x', 'items': [item]}, {'referencia': 'x', 'items': [item]}],
+            # Referência explícita igual à posição de outra venda
+            [{'items': [item]}, {'referencia': '0', 'items': [item]}],
+        ):
+            response = self._lote(json.dumps(vendas))
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(Venta.objects.count(), 0)
+
+    def test_json_malformado(self):
+        item = json.dumps({'items': [{'produto': self.produto.id, 'quantidade': 1}]})
+        for corpo in ('[1 2]', '[,,', f'[{item}] lixo', f'[{item},]', f'[{item}', '{}'):
+            self.assertEqual(self._lote(corpo).status_code, 400, corpo)
+        self.assertEqual(self._lote('{"items": [\n', 'application/x-ndjson').status_code, 400)
+        self.assertEqual(Venta.objects.count(), 0)
+
+        response = self._lote(f'  [ {item} , {item} ]  ')
+        self.assertEqual(response.data['criadas'], 2)
+
+
+class ResumoVendasTest(TestCase):
+    def setUp(self):
+        self.produto = Produto.objects.create(nome='A', preco='10.00', estoque=100)
+        self.cliente = Cliente.objects.create(cedula='123', nome='Cliente', email='cli@teste.com', cidade='Recife')
+        usuario = Usuario.objects.create_user(email='rv@teste.com', username='rv', nome='RV', password='senha-forte-123')
+        self.client = APIClient()
+        self.client.force_authenticate(usuario)
+
+    def _vender(self, quantidade, cliente='123'):
+        response = self.client.post('/api/vendas/', {
+            'cliente': cliente, 'items': [{'produto': self.produto.id, 'quantidade': quantidade}]
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        return response.data['id']
+
+    def _relatorio(self, agrupar, **parametros):
+        response = self.client.get('/api/relatorios/vendas/', {'agrupar': agrupar, **parametros})
+        self.assertEqual(response.status_code, 200)
+        return [(linha['chave'], linha['quantidade'], linha['num_vendas']) for linha in response.data['resultados']]
+
+    def test_upsert_acumula_e_exclusao_desconta_da_cidade_da_venda(self):
+        venda_id = self._vender(2)
+        self._vender(3)
+        self._vender(1, cliente=None)
+
+        self.assertEqual(self._relatorio('total'), [('', 6, 3)])
+        self.assertEqual(self._relatorio('total', granularidade='mes'), [('', 6, 3)])
+        self.assertEqual(self._relatorio('cidade'), [('Recife', 5, 2)])
+        # O total geral fica em fatias, para vendas simultâneas não disputarem a mesma linha
+        self.assertEqual(ResumoVendas.objects.filter(granularidade='dia', dimensao='total').count(), 3)
+
+        Cliente.objects.filter(cedula='123').update(cidade='Natal')
+        self.assertEqual(self.client.delete(f'/api/vendas/{venda_id}/').status_code, 204)
+
+        self.assertEqual(self._relatorio('cidade'), [('Recife', 3, 1)])
+        self.assertEqual(self._relatorio('total'), [('', 4, 2)])
+
+    def test_reconstruir_reproduz_os_resumos_incrementais(self):
+        for quantidade in range(1, 6):
+            self._vender(quantidade, cliente='123' if quantidade % 2 else None)
+        dimensoes = ('total', 'produto', 'cliente', 'cidade')
+        incrementais = {agrupar: self._relatorio(agrupar) for agrupar in dimensoes}
+
+        ResumoVendas.objects.all().delete()
+        call_command('reconstruir_resumo_vendas', '--tamanho-lote=2', stdout=StringIO())
+
+        self.assertEqual({agrupar: self._relatorio(agrupar) for agrupar in dimensoes}, incrementais)
+
+    def test_edicao_de_venda_e_itens_atualiza_os_resumos(self):
+        Cliente.objects.create(cedula='456', nome='Outro', email='outro@teste.com', cidade='Natal')
+        venda_id = self._vender(2)
+        self._vender(1)
+        item = VentaItem.objects.get(venda_id=venda_id)
+        dimensoes = ('total', 'produto', 'cliente', 'cidade')
+
+        edicoes = [
+            lambda: self.client.patch(f'/api/vendas/{venda_id}/', {'cliente_cedula': '456', 'total': '25.00'}, format='json'),
+            lambda: self.client.patch(f'/api/venda-items/{item.id}/', {'quantidade': 5}, format='json'),
+            lambda: self.client.post('/api/venda-items/', {
+                'venda_id': venda_id, 'produto_id': self.produto.id, 'quantidade': 1, 'preco_unitario': '10.00'
+            }, format='json'),
+            lambda: self.client.delete(f'/api/venda-items/{item.id}/'),
+        ]
+        for editar in edicoes:
+            self.assertLess(editar().status_code, 300)
+            incrementais = {agrupar: self._relatorio(agrupar) for agrupar in dimensoes}
+            ResumoVendas.objects.all().delete()
+            call_command('reconstruir_resumo_vendas', stdout=StringIO())
+            self.assertEqual({agrupar: self._relatorio(agrupar) for agrupar in dimensoes}, incrementais)
+
+        self.assertEqual(sorted(self._relatorio('cidade')), [('Natal', 1, 1), ('Recife', 1, 1)])
+
+    def test_data_impossivel(self):
+        for valor in ('2025-02-30', '2025-13-01', 'ontem'):
+            response = self.client.get('/api/relatorios/vendas/', {'fecha_inicio': valor})
+            self.assertEqual(response.status_code, 400, valor)
+
+
+class IdempotenciaTest(TestCase):
+    def setUp(self):
+        self.produto = Produto.objects.create(nome='A', preco='10.00', estoque=5)
+        self.usuario = Usuario.objects.create_user(email='i@teste.com', username='i', nome='I', password='senha-forte-123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.usuario)
+        self.corpo = {'items': [{'produto': self.produto.id, 'quantidade': 1}]}
+
+    def _vender(self, cliente=None, corpo=None, chave='chave-1'):
+        return (cliente or self.client).post('/api/vendas/', corpo or self.corpo, format='json',
+                                             HTTP_IDEMPOTENCY_KEY=chave)
+
+    def test_repeticao_devolve_a_resposta_original(self):
+        primeira = self._vender()
+        repetida = self._vender()
+
+        self.assertEqual(primeira.status_code, 201)
+        self.assertEqual((repetida.status_code, repetida.data['id']), (201, primeira.data['id']))
+        self.assertEqual(repetida['Idempotent-Replayed'], 'true')
+        self.assertEqual(Venta.objects.count(), 1)
+
+    def test_mesma_chave_com_outro_corpo_ou_em_processamento(self):
+        self._vender()
+        response = self._vender(corpo={'items': [{'produto': self.produto.id, 'quantidade': 2}]})
+        self.assertEqual(response.status_code, 422)
+
+        corpo = {'items': [{'produto': self.produto.id, 'quantidade': 3}]}
+        IdempotenciaService.reservar('chave-2', 'venta.create', IdempotenciaService.hash_requisicao(corpo),
+                                     f'usuario:{self.usuario.pk}')
+        self.assertEqual(self._vender(corpo=corpo, chave='chave-2').status_code, 409)
+        self.assertEqual(Venta.objects.count(), 1)
+
+    def test_chave_de_outro_usuario_nao_reaproveita_a_resposta(self):
+        self._vender()
+        outro = Usuario.objects.create_user(email='j@teste.com', username='j', nome='J', password='senha-forte-123')
+        cliente = APIClient()
+        cliente.force_authenticate(outro)
+
+        response = self._vender(cliente)
+
+        self.assertEqual(response.status_code, 201)
+        self.assertNotIn('Idempotent-Replayed', response)
+        self.assertEqual(Venta.objects.count(), 2)
+
+    def test_anonimos_sem_sessao_nao_compartilham_a_chave(self):
+        for _ in range(2):
+            response = self._vender(APIClient())
+            self.assertEqual(response.status_code, 201)
+            self.assertNotIn('Idempotent-Replayed', response)
+        self.assertEqual(Venta.objects.count(), 2)
+
+        # No checkout o dono da chave é o carrinho do corpo
+        Carrito.objects.create(session_id='s1', produto_id=self.produto.id, quantidade=1, preco_unitario='10.00')
+        corpo = {'session_id': 's1'}
+        primeira = APIClient().post('/api/vendas/procesar_desde_carrito/', corpo, format='json', HTTP_IDEMPOTENCY_KEY='k')
+        repetida = APIClient().post('/api/vendas/procesar_desde_carrito/', corpo, format='json', HTTP_IDEMPOTENCY_KEY='k')
+        self.assertEqual((repetida.status_code, repetida.data['id']), (201, primeira.data['id']))
+        self.assertEqual(repetida['Idempotent-Replayed'], 'true')
+
+
+class CarrinhoLoteTest(TestCase):
+    def setUp(self):
+        self.produtos = [Produto.objects.create(nome=f'P{indice}', preco='2.00', estoque=10) for indice in range(3)]
+        self.client = APIClient()
+
+    def _lote(self, itens, **dono):
+        return self.client.post('/api/carrito/lote/', {'itens': itens, **dono}, format='json')
+
+    def test_lote_adiciona_altera_e_remove(self):
+        a, b, c = self.produtos
+        self._lote([{'produto_id': a.id, 'quantidade': 2}, {'produto_id': b.id, 'quantidade': 2}], session_id='s1')
+        response = self._lote([
+            {'produto_id': a.id, 'quantidade': 0},
+            {'produto_id': b.id, 'quantidade': 5},
+            {'produto_id': c.id, 'quantidade': 1},
+        ], session_id='s1')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual({linha['produto_id']: linha['quantidade'] for linha in response.data}, {b.id: 5, c.id: 1})
+        reservados = dict(Produto.objects.values_list('id', 'estoque_reservado'))
+        self.assertEqual(reservados, {a.id: 0, b.id: 5, c.id: 1})
+
+        response = self._lote([{'produto_id': c.id, 'quantidade': 11}], session_id='s1')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Carrito.objects.get(session_id='s1', produto_id=c.id).quantidade, 1)
+
+    def test_mesclar_soma_produtos_repetidos(self):
+        a, b, _ = self.produtos
+        usuario_id = str(uuid.uuid4())
+        self._lote([{'produto_id': a.id, 'quantidade': 2}, {'produto_id': b.id, 'quantidade': 1}], session_id='s1')
+        self._lote([{'produto_id': a.id, 'quantidade': 3}], usuario_id=usuario_id)
+
+        response = self.client.post('/api/carrito/mesclar/', {'session_id': 's1', 'usuario_id': usuario_id}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual({linha['produto_id']: linha['quantidade'] for linha in response.data}, {a.id: 5, b.id: 1})
+        self.assertFalse(Carrito.objects.filter(usuario_id__isnull=True).exists())
+        self.assertEqual(Produto.objects.get(id=a.id).estoque_reservado, 5)
+
+    def test_session_id_e_usuario_id_juntos_usam_o_carrinho_do_usuario(self):
+        a, b, _ = self.produtos
+        usuario_id = str(uuid.uuid4())
+        self._lote([{'produto_id': a.id, 'quantidade': 1}], session_id='s1')
+        dono = {'session_id': 's1', 'usuario_id': usuario_id}
+
+        self.client.post('/api/carrito/', {**dono, 'produto_id': b.id, 'quantidade': 2}, format='json')
+        self.client.post('/api/carrito/', {**dono, 'produto_id': b.id, 'quantidade': 1}, format='json')
+
+        linhas = self.client.get('/api/carrito/', dono).data
+        self.assertEqual([(linha['produto_id'], linha['quantidade']) for linha in linhas], [(b.id, 3)])
+        response = self.client.post('/api/vendas/procesar_desde_carrito/', dono, format='json')
+        self.assertEqual([(item['produto_id'], item['quantidade']) for item in response.data['items']], [(b.id, 3)])
+        # O carrinho anônimo da sessão continua intacto
+        self.assertEqual(list(Carrito.objects.values_list('session_id', 'produto_id', 'quantidade')), [('s1', a.id, 1)])
+
+    def test_limpeza_remove_so_carrinhos_abandonados(self):
+        a, b, _ = self.produtos
+        self._lote([{'produto_id': a.id, 'quantidade': 2}], session_id='velha')
+        self._lote([{'produto_id': a.id, 'quantidade': 1}, {'produto_id': b.id, 'quantidade': 1}], session_id='ativa')
+        antigo = timezone.now() - timedelta(days=60)
+        Carrito.objects.filter(session_id='velha').update(updated_at=antigo)
+        Carrito.objects.filter(session_id='ativa', produto_id=a.id).update(updated_at=antigo)
+
+        saida = StringIO()
+        call_command('limpar_carrinhos_abandonados', '--dry-run', stdout=saida)
+        self.assertEqual(saida.getvalue().strip(), '1 linhas seriam removidas (1 carrinhos anônimos, '
+                                                   '0 carrinhos de usuários, 2 unidades reservadas liberadas)')
+        self.assertEqual(Carrito.objects.count(), 3)
+
+        saida = StringIO()
+        call_command('limpar_carrinhos_abandonados', stdout=saida)
+        self.assertIn('1 linhas de carrinhos abandonados removidas', saida.getvalue())
+        self.assertEqual(set(Carrito.objects.values_list('session_id', flat=True)), {'ativa'})
+        self.assertEqual(Produto.objects.get(id=a.id).estoque_reservado, 1)
+
+
+@override_settings(CARRITO_BACKEND='cache')
+class CarrinhoCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.produto = Produto.objects.create(nome='A', preco='2.00', estoque=5)
+        self.client = APIClient()
+
+    def test_carrinho_anonimo_so_vai_ao_banco_no_checkout(self):
+        for _ in range(2):
+            self.client.post('/api/carrito/', {
+                'session_id': 's1', 'produto_id': self.produto.id, 'quantidade': 2
+            }, format='json')
+        linhas = self.client.get('/api/carrito/', {'session_id': 's1'}).data
+        self.assertEqual([linha['quantidade'] for linha in linhas], [4])
+        self.assertEqual(self.client.patch(f'/api/carrito/{linhas[0]["id"]}/', {'quantidade': 3}).status_code, 200)
+        self.assertFalse(Carrito.objects.exists())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/vendas/procesar_desde_carrito/', {'session_id': 's1'}, format='json')
+
+        self.assertEqual(response.status_code, 201)
+        self.produto.refresh_from_db()
+        self.assertEqual((self.produto.estoque, self.produto.estoque_reservado), (2, 0))
+        self.assertEqual(self.client.get('/api/carrito/', {'session_id': 's1'}).data, [])
+
+    def test_login_grava_o_carrinho_do_usuario(self):
+        usuario_id = str(uuid.uuid4())
+        self.client.post('/api/carrito/', {'session_id': 's1', 'produto_id': self.produto.id, 'quantidade': 2}, format='json')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/carrito/mesclar/', {'session_id': 's1', 'usuario_id': usuario_id}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Carrito.objects.get(usuario_id=usuario_id).quantidade, 2)
+        self.assertEqual(Produto.objects.get(id=self.produto.id).estoque_reservado, 2)
+
+    def test_carrinho_bloqueado_retorna_409(self):
+        with mock.patch.object(CarrinhoCache, 'TENTATIVAS_BLOQUEIO', 2), CarrinhoCache._bloqueio('s1'):
+            response = self.client.post('/api/carrito/', {
+                'session_id': 's1', 'produto_id': self.produto.id, 'quantidade': 1
+            }, format='json')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(self.client.post('/api/carrito/', {
+            'session_id': 's1', 'produto_id': self.produto.id, 'quantidade': 1
+        }, format='json').status_code, 201)
+
+    def test_exige_cache_compartilhado(self):
+        self.assertEqual([erro.id for erro in checks.verificar_cache_do_carrinho(None)], ['mi_app.E001'])
+        redis = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://'}}
+        with override_settings(CACHES=redis):
+            self.assertEqual(checks.verificar_cache_do_carrinho(None), [])
+        with override_settings(CARRITO_BACKEND='banco'):
+            self.assertEqual(checks.verificar_cache_do_carrinho(None), [])
+
+
+@override_settings(CARRITO_BACKEND='cache')
+class CarrinhoCacheConcorrenciaTest(TransactionTestCase):
+    """Adições simultâneas ao mesmo carrinho no cache não se perdem"""
+
+    THREADS = 8
+    ADICOES_POR_THREAD = 5
+
+    def _adicionar(self, produto_id):
+        try:
+            for _ in range(self.ADICOES_POR_THREAD):
+                CarrinhoCache.adicionar('s1', produto_id, 1)
+        finally:
+            connection.close()
+
+    def test_adicoes_concorrentes(self):
+        cache.clear()
+        produto = Produto.objects.create(nome='A', preco='1.00', estoque=100)
+        threads = [threading.Thread(target=self._adicionar, args=(produto.id,)) for _ in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        linhas = CarrinhoCache.linhas('s1')
+        self.assertEqual([linha.quantidade for linha in linhas], [self.THREADS * self.ADICOES_POR_THREAD])
+
+
+class EstoqueConcorrenciaTest(TransactionTestCase):
+    """Várias threads disputando o mesmo produto nunca vendem além do estoque"""
+
+    ESTOQUE = 20
+    THREADS = 8
+    TENTATIVAS_POR_THREAD = 5
+
+    def _vender(self, produto_id, vendidos, lock):
+        try:
+            for _ in range(self.TENTATIVAS_POR_THREAD):
+                while True:
+                    try:
+                        falhas = EstoqueService.baixar({produto_id: 1})
+                        break
+                    except OperationalError:
+                        # SQLite serializa escritas concorrentes ("database is locked")
+                        time.sleep(0.005)
+                if not falhas:
+                    with lock:
+                        vendidos.append(1)
+        finally:
+            connection.close()
+
+    def test_nao_vende_alem_do_estoque(self):
+        produto = Produto.objects.create(nome='Flash', preco='1.00', estoque=self.ESTOQUE)
+        vendidos = []
+        lock = threading.Lock()
+
+        threads = [
+            threading.Thread(target=self._vender, args=(produto.id, vendidos, lock))
+            for _ in range(self.THREADS)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        produto.refresh_from_db()
+        self.assertEqual(len(vendidos), self.ESTOQUE)
+        self.assertEqual(produto.estoque, 0)
+
+
+class IndicesVendasTest(TestCase):
+    """Os filtros de vendas usam índices (verificado com EXPLAIN)"""
+
+    def _plano(self, queryset):
+        with transaction.atomic():
+            if connection.vendor == 'postgresql':
+                # Tabelas de teste são pequenas; força o planejador a considerar os índices
+                with connection.cursor() as cursor:
+                    cursor.execute('SET LOCAL enable_seqscan = off')
+            return queryset.explain()
+
+    def test_filtro_por_data_usa_indice(self):
+        inicio = timezone.make_aware(datetime(2025, 1, 1))
+        queryset = Venta.objects.filter(created_at__gte=inicio, created_at__lt=inicio + timedelta(days=1))
+        self.assertIn('vendas_created_id_idx', self._plano(queryset))
+
+    def test_filtro_por_cliente_e_data_usa_indice_composto(self):
+        inicio = timezone.make_aware(datetime(2025, 1, 1))
+        queryset = Venta.objects.filter(cliente_cedula='123', created_at__gte=inicio)
+        self.assertIn('vendas_cliente_created_idx', self._plano(queryset))
+
+    def test_itens_por_venda_usam_indice(self):
+        queryset = VentaItem.objects.filter(venda_id__in=[1, 2, 3])
+        self.assertIn('detalles_venda_venda_idx', self._plano(queryset))
+
+    def test_filtro_de_data_da_api_e_semiaberto(self):
+        venda = Venta.objects.create(total='10.00')
+        data = timezone.localtime(venda.created_at).date().isoformat()
+        client = APIClient()
+
+        response = client.get('/api/vendas/', {'fecha_inicio': data, 'fecha_fin': data})
+        self.assertEqual([v['id'] for v in response.data], [venda.id])
+
+        response = client.get('/api/vendas/', {'fecha_inicio': 'ontem'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_data_impossivel_retorna_400(self):
+        client = APIClient()
+        for parametro in ('fecha_inicio', 'fecha_fin'):
+            response = client.get('/api/vendas/', {parametro: '2025-02-30'})
+            self.assertEqual(response.status_code, 400)
+            self.assertIn(parametro, response.data)
+
+
+class VendasComItensTestCase(TestCase):
+    """12 vendas de 4 clientes, com 1 a 3 itens cada"""
+
+    def setUp(self):
+        self.client = APIClient()
+        produtos = [Produto.objects.create(nome=f'P{indice}', preco='1.00', estoque=100) for indice in range(3)]
+        for indice in range(4):
+            Cliente.objects.create(cedula=f'c{indice}', nome=f'Cliente {indice}', email=f'c{indice}@teste.com')
+        self.vendas = []
+        for indice in range(12):
+            venda = Venta.objects.create(cliente_cedula=f'c{indice % 4}', total='2.00')
+            for produto in produtos[:indice % 3 + 1]:
+                VentaItem.objects.create(venda_id=venda.id, produto_id=produto.id, quantidade=1, preco_unitario='1.00')
+            self.vendas.append(venda)
+
+
+class ListagemVendasTest(VendasComItensTestCase):
+    def test_listagem_e_detalhe_em_numero_fixo_de_consultas(self):
+        # Vendas, itens, produtos e nomes de clientes: uma consulta cada, qualquer que seja a página
+        with self.assertNumQueries(4):
+            response = self.client.get('/api/vendas/')
+        self.assertEqual(len(response.data), 12)
+        self.assertEqual(response.data[-1]['cliente_nome'], 'Cliente 0')
+        self.assertEqual(sorted(item['produto_nome'] for item in response.data[0]['items']), ['P0', 'P1', 'P2'])
+
+        with self.assertNumQueries(4):
+            response = self.client.get('/api/vendas/', {'tamanho': 5})
+        self.assertEqual(len(response.data['results']), 5)
+
+        with self.assertNumQueries(4):
+            response = self.client.get(f'/api/vendas/{self.vendas[0].id}/')
+        self.assertEqual(response.data['cliente_nome'], 'Cliente 0')
+        self.assertEqual(len(response.data['items']), 1)
+
+
+class ExportacaoVendasTest(VendasComItensTestCase):
+    def test_exportacao_csv_e_ndjson_com_filtros(self):
+        data = timezone.localtime(self.vendas[0].created_at).date().isoformat()
+        filtros = {'cliente': 'c1', 'fecha_inicio': data, 'fecha_fin': data}
+        # Vendas 9, 5 e 1 do cliente c1, mais recente primeiro, com 1, 3 e 2 itens
+        esperadas = [self.vendas[indice].id for indice in (9, 5, 1)]
+
+        response = self.client.get('/api/vendas/exportar/', {**filtros, 'formato': 'csv'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertIn('vendas.csv', response['Content-Disposition'])
+        linhas = list(csv.reader(b''.join(response.streaming_content).decode().splitlines()))
+        self.assertEqual(linhas[0], ExportacaoVendasService.CABECALHO_CSV)
+        # Uma linha por item, na ordem da listagem
+        self.assertEqual([int(linha[0]) for linha in linhas[1:]],
+                         [esperadas[0]] + [esperadas[1]] * 3 + [esperadas[2]] * 2)
+        self.assertEqual({linha[3] for linha in linhas[1:]}, {'Cliente 1'})
+
+        response = self.client.get('/api/vendas/exportar/', {**filtros, 'formato': 'ndjson'})
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson; charset=utf-8')
+        registros = [json.loads(linha) for linha in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([registro['id'] for registro in registros], esperadas)
+        self.assertEqual([len(registro['items']) for registro in registros], [1, 3, 2])
+        self.assertEqual(registros[0]['cliente_nome'], 'Cliente 1')
+
+        response = self.client.get('/api/vendas/exportar/', {**filtros, 'fecha_inicio': '2025-02-30'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get('/api/vendas/exportar/', {'formato': 'xml'}).status_code, 400)
+
+
+class CursorPaginacaoTest(VendasComItensTestCase):
+    def test_cursor_avanca_e_volta_com_empates(self):
+        # Grupos de vendas com o mesmo created_at: o cursor compara (created_at, id)
+        instante = timezone.now()
+        for indice, venda in enumerate(self.vendas):
+            Venta.objects.filter(id=venda.id).update(created_at=instante - timedelta(seconds=indice // 5))
+        esperadas = list(Venta.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+
+        paginas = []
+        url = '/api/vendas/?tamanho=4'
+        while url:
+            response = self.client.get(url)
+            paginas.append([venda['id'] for venda in response.data['results']])
+            url = response.data['next']
+        self.assertEqual(sum(paginas, []), esperadas)
+        self.assertEqual(len(paginas), 3)
+
+        voltando = []
+        url = response.data['previous']
+        while url:
+            response = self.client.get(url)
+            voltando.insert(0, [venda['id'] for venda in response.data['results']])
+            url = response.data['previous']
+        self.assertEqual(voltando, paginas[:-1])
+
+        # Avança de novo a partir da primeira página, obtida voltando
+        response = self.client.get(self.client.get(response.data['next']).data['next'])
+        self.assertEqual([venda['id'] for venda in response.data['results']], paginas[2])
+
+        self.assertEqual(self.client.get('/api/vendas/', {'cursor': 'invalido'}).status_code, 404)
+
+
+class KanbanCompletoTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.usuario = Usuario.objects.create_user(email='k@teste.com', username='k', nome='K', password='senha-forte-123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.usuario)
+
+    def _criar_quadro(self, colunas, cards_por_coluna):
+        cliente = Cliente.objects.create(cedula=f'c{colunas}{cards_por_coluna}', nome='Cliente', email=f'c{colunas}{cards_por_coluna}@teste.com')
+        produto = Produto.objects.create(nome='P', preco='1.00', estoque=1)
+        kanban = Kanban.objects.create(nome='Quadro', criado_por=self.usuario, cliente=cliente)
+        for ordem in range(colunas):
+            coluna = Coluna.objects.create(kanban=kanban, nome=f'C{ordem}', ordem=ordem)
+            Card.objects.bulk_create([
+                Card(coluna=coluna, titulo=f'Card {indice}', ordem=indice,
+                     cliente=cliente, produto=produto, responsavel=self.usuario)
+                for indice in range(cards_por_coluna)
+            ])
+        return kanban
+
+    def test_quadro_completo_em_numero_fixo_de_consultas(self):
+        pequeno = self._criar_quadro(1, 1)
+        grande = self._criar_quadro(6, 50)
+
+        # Quadro (versão), depois quadro, colunas e cards na geração do snapshot
+        with self.assertNumQueries(4):
+            self.client.get(f'/api/kanbans/{pequeno.id}/completo/')
+        with self.assertNumQueries(4):
+            response = self.client.get(f'/api/kanbans/{grande.id}/completo/')
+
+        self.assertEqual(len(response.data['colunas']), 6)
+        coluna = response.data['colunas'][0]
+        self.assertEqual(coluna['total_cards'], 50)
+        self.assertEqual([card['ordem'] for card in coluna['cards']], list(range(50)))
+        self.assertEqual(coluna['cards'][0]['coluna_nome'], 'C0')
+
+    def test_snapshot_em_cache_e_etag(self):
+        kanban = self._criar_quadro(2, 3)
+        url = f'/api/kanbans/{kanban.id}/completo/'
+        etag = self.client.get(url)['ETag']
+
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(url).status_code, 200)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        card = Card.objects.filter(coluna__kanban=kanban).first()
+        card.titulo = 'Alterado'
+        card.save()
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertIn('Alterado', [c['titulo'] for coluna in response.data['colunas'] for c in coluna['cards']])
+
+    def test_alterar_o_quadro_invalida_snapshot(self):
+        kanban = self._criar_quadro(1, 1)
+        url = f'/api/kanbans/{kanban.id}/completo/'
+        etag = self.client.get(url)['ETag']
+
+        # Objeto carregado antes de um card mudar não pode regravar a versão antiga
+        carregado = Kanban.objects.get(id=kanban.id)
+        versao = carregado.versao
+        Card.objects.filter(coluna__kanban=kanban).first().save()
+        carregado.nome = 'Renomeado'
+        carregado.save()
+        self.assertEqual(carregado.versao, versao + 2)
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['nome'], 'Renomeado')
+
+        etag = response['ETag']
+        carregado.ativo = False
+        carregado.save(update_fields=['ativo'])
+        self.assertEqual(carregado.versao, versao + 3)
+        self.assertNotEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_renomear_cliente_produto_ou_usuario_invalida_snapshot(self):
+        kanban = self._criar_quadro(1, 1)
+        url = f'/api/kanbans/{kanban.id}/completo/'
+        card = Card.objects.select_related('cliente', 'produto', 'responsavel').get(coluna__kanban=kanban)
+
+        for objeto, campo in ((card.cliente, 'cliente_nome'), (card.produto, 'produto_nome'),
+                              (card.responsavel, 'responsavel_nome')):
+            etag = self.client.get(url)['ETag']
+            objeto.nome = f'Novo {campo}'
+            objeto.save()
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.data['colunas'][0]['cards'][0][campo], f'Novo {campo}')
+
+        # Gravações que não mudam o que o quadro mostra não o invalidam
+        etag = self.client.get(url)['ETag']
+        self.usuario.save(update_fields=['last_login'])
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_lista_de_quadros_em_uma_consulta(self):
+        for colunas, cards in ((1, 2), (2, 3), (3, 1)):
+            self._criar_quadro(colunas, cards)
+        call_command('reconciliar_contadores_colunas', stdout=StringIO())
+
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/kanbans/')
+
+        totais = sorted((quadro['total_colunas'], quadro['total_cards']) for quadro in response.data)
+        self.assertEqual(totais, [(1, 2), (2, 6), (3, 3)])
+        self.assertEqual(response.data[0]['criado_por_nome'], 'K')
+        self.assertEqual(response.data[0]['cliente_nome'], 'Cliente')
+
+
+class OrdenacaoKanbanTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.usuario = Usuario.objects.create_user(email='o@teste.com', username='o', nome='O', password='senha-forte-123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.usuario)
+        cliente = Cliente.objects.create(cedula='ord', nome='Cliente', email='ord@teste.com')
+        self.kanban = Kanban.objects.create(nome='Quadro', criado_por=self.usuario, cliente=cliente)
+        self.origem = Coluna.objects.create(kanban=self.kanban, nome='A', ordem=0)
+        self.destino = Coluna.objects.create(kanban=self.kanban, nome='B', ordem=1)
+        self.cards = [Card.objects.create(coluna=self.destino, titulo=f'Card {i}') for i in range(5)]
+
+    def _titulos(self, coluna):
+        return list(Card.objects.filter(coluna=coluna).values_list('titulo', flat=True))
+
+    def test_rank_entre_vizinhos(self):
+        self.assertLess(rank.entre('a', 'b'), 'b')
+        self.assertGreater(rank.entre('a', 'b'), 'a')
+        self.assertGreater(rank.entre('zz', None), 'zz')
+        self.assertLess(rank.entre(None, '01'), '01')
+        self.assertEqual(len(rank.espalhados(1000)), len(set(rank.espalhados(1000))))
+        self.assertEqual(rank.espalhados(1000), sorted(rank.espalhados(1000)))
+
+    def test_mover_altera_apenas_o_card_movido(self):
+        card = Card.objects.create(coluna=self.origem, titulo='Movido')
+        ranks_antes = dict(Card.objects.filter(coluna=self.destino).values_list('id', 'rank'))
+
+        response = self.client.post(f'/api/cards/{card.id}/mover/', {
+            'coluna_destino': self.destino.id, 'apos': self.cards[1].id
+        }, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self._titulos(self.destino), ['Card 0', 'Card 1', 'Movido', 'Card 2', 'Card 3', 'Card 4'])
+        self.assertEqual(dict(Card.objects.filter(coluna=self.destino).exclude(id=card.id).values_list('id', 'rank')), ranks_antes)
+
+        # Posição por índice e por antes_de
+        self.client.post(f'/api/cards/{card.id}/mover/', {'coluna_destino': self.destino.id, 'ordem': 0}, format='json')
+        self.assertEqual(self._titulos(self.destino)[0], 'Movido')
+        self.client.post(f'/api/cards/{card.id}/mover/', {
+            'coluna_destino': self.destino.id, 'antes_de': self.cards[4].id
+        }, format='json')
+        self.assertEqual(self._titulos(self.destino)[-2:], ['Movido', 'Card 4'])
+
+    def test_vizinho_de_outra_coluna_e_rejeitado(self):
+        outro = Card.objects.create(coluna=self.origem, titulo='Outro')
+        response = self.client.post(f'/api/cards/{self.cards[0].id}/mover/', {
+            'coluna_destino': self.destino.id, 'apos': outro.id
+        }, format='json')
+        self.assertEqual(response.status_code, 404)
+
+    def test_mover_coluna(self):
+        response = self.client.post(f'/api/colunas/{self.destino.id}/mover/', {'antes_de': self.origem.id}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(Coluna.objects.filter(kanban=self.kanban).values_list('nome', flat=True)), ['B', 'A'])
+
+    def test_referencia_invalida_retorna_400(self):
+        for url, corpo in (
+            (f'/api/colunas/{self.destino.id}/mover/', {'apos': 'abc'}),
+            (f'/api/cards/{self.cards[0].id}/mover/', {'coluna_destino': self.destino.id, 'antes_de': 'abc'}),
+        ):
+            response = self.client.post(url, corpo, format='json')
+            self.assertEqual((response.status_code, response.data['detail']), (400, 'apos/antes_de inválido'))
+
+    def test_insercoes_repetidas_sao_rebalanceadas(self):
+        card = Card.objects.create(coluna=self.origem, titulo='Movido')
+        for _ in range(200):
+            self.client.post(f'/api/cards/{card.id}/mover/', {
+                'coluna_destino': self.destino.id, 'apos': self.cards[0].id
+            }, format='json')
+            self.client.post(f'/api/cards/{self.cards[1].id}/mover/', {
+                'coluna_destino': self.destino.id, 'apos': self.cards[0].id
+            }, format='json')
+
+        ranks = list(Card.objects.filter(coluna=self.destino).values_list('rank', flat=True))
+        self.assertEqual(ranks, sorted(ranks))
+        self.assertTrue(all(len(r) <= rank.TAMANHO_MAXIMO for r in ranks))
+
+        Card.objects.filter(id=card.id).update(rank='1' * (rank.LIMIAR_REBALANCEAMENTO + 1))
+        ordem = self._titulos(self.destino)
+        call_command('rebalancear_ranks_kanban', stdout=StringIO())
+        self.assertEqual(self._titulos(self.destino), ordem)
+        self.assertFalse(OrdenacaoKanbanService.grupos_para_rebalancear(Card))
+
+    def test_reordenar_colunas_troca_posicoes(self):
+        terceira = Coluna.objects.create(kanban=self.kanban, nome='C', ordem=2)
+        response = self.client.post('/api/colunas/reordenar/', {'colunas': [
+            {'id': self.origem.id, 'ordem': 1}, {'id': self.destino.id, 'ordem': 0}, {'id': terceira.id, 'ordem': 2}
+        ]}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(Coluna.objects.filter(kanban=self.kanban).values_list('nome', 'ordem')),
+                         [('B', 0), ('A', 1), ('C', 2)])
+
+    def _mover_lote(self, quantidade):
+        cards = [Card.objects.create(coluna=self.origem, titulo=f'Lote {i}') for i in range(quantidade)]
+        with CaptureQueriesContext(connection) as consultas:
+            response = self.client.post('/api/cards/mover-lote/', {
+                'movimentos': [{'cards': [c.id for c in cards], 'coluna_destino': self.destino.id, 'apos': self.cards[0].id}],
+                'observacao': 'Triagem'
+            }, format='json')
+        self.assertEqual(response.status_code, 200)
+        Card.objects.filter(coluna=self.destino).exclude(id__in=[c.id for c in self.cards]).update(coluna=self.origem, rank='')
+        return len(consultas)
+
+    def test_mover_cards_em_lote(self):
+        self.assertEqual(self._mover_lote(5), self._mover_lote(50))
+
+        cards = [Card.objects.create(coluna=self.origem, titulo=f'X{i}') for i in range(3)]
+        response = self.client.post('/api/cards/mover-lote/', {
+            'cards': [cards[2].id, cards[0].id], 'coluna_destino': self.destino.id, 'ordem': 1
+        }, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self._titulos(self.destino)[:4], ['Card 0', 'X2', 'X0', 'Card 1'])
+        self.assertEqual(HistoricoMovimentacao.objects.filter(card_id__in=[cards[0].id, cards[2].id],
+                                                              coluna_destino=self.destino).count(), 2)
+
+    def test_mover_lote_valida_permissao_e_limite(self):
+        outro = Usuario.objects.create_user(email='x@teste.com', username='x', nome='X', password='senha-forte-123')
+        alheio = Kanban.objects.create(nome='Alheio', criado_por=outro, cliente=self.kanban.cliente)
+        coluna_alheia = Coluna.objects.create(kanban=alheio, nome='Z', ordem=0)
+        card_alheio = Card.objects.create(coluna=coluna_alheia, titulo='Alheio')
+        response = self.client.post('/api/cards/mover-lote/', {
+            'cards': [card_alheio.id], 'coluna_destino': coluna_alheia.id
+        }, format='json')
+        self.assertEqual(response.status_code, 403)
+
+        Coluna.objects.filter(id=self.destino.id).update(limite_cards=6)
+        cards = [Card.objects.create(coluna=self.origem, titulo=f'L{i}') for i in range(2)]
+        response = self.client.post('/api/cards/mover-lote/', {
+            'cards': [c.id for c in cards], 'coluna_destino': self.destino.id
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self._titulos(self.origem), ['L0', 'L1'])
+
+    def test_mover_lote_com_referencia_invalida(self):
+        card = Card.objects.create(coluna=self.origem, titulo='Movido')
+        response = self.client.post('/api/cards/mover-lote/', {
+            'cards': [card.id], 'coluna_destino': self.destino.id, 'apos': 'abc'
+        }, format='json')
+        self.assertEqual((response.status_code, response.data['detail']), (400, 'apos/antes_de inválido'))
+        self.assertEqual(self._titulos(self.origem), ['Movido'])
+
+
+class ContadorCardsTest(TestCase):
+    def setUp(self):
+        self.usuario = Usuario.objects.create_user(email='w@teste.com', username='w', nome='W', password='senha-forte-123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.usuario)
+        self.kanban = Kanban.objects.create(nome='Quadro', criado_por=self.usuario)
+        self.origem = Coluna.objects.create(kanban=self.kanban, nome='A', ordem=0)
+        self.destino = Coluna.objects.create(kanban=self.kanban, nome='B', ordem=1, limite_cards=2)
+
+    def _total(self, coluna):
+        coluna.refresh_from_db(fields=['cards_count'])
+        return coluna.cards_count
+
+    def test_total_mantido_ao_criar_mover_e_excluir(self):
+        card = Card.objects.create(coluna=self.origem, titulo='Um')
+        Card.objects.create(coluna=self.origem, titulo='Dois')
+        self.assertEqual(self._total(self.origem), 2)
+
+        response = self.client.post(f'/api/cards/{card.id}/mover/', {'coluna_destino': self.destino.id}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((self._total(self.origem), self._total(self.destino)), (1, 1))
+
+        self.client.delete(f'/api/cards/{card.id}/')
+        self.assertEqual(self._total(self.destino), 0)
+
+    def test_limite_aplicado_pelo_update_condicional(self):
+        Card.objects.create(coluna=self.destino, titulo='Um')
+        Card.objects.create(coluna=self.destino, titulo='Dois')
+        with self.assertRaises(LimiteCardsError):
+            Card.objects.create(coluna=self.destino, titulo='Três')
+
+        # Pela API o limite também é respeitado
+        response = self.client.post('/api/cards/', {'coluna': self.destino.id, 'titulo': 'Três'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self._total(self.destino), 2)
+        self.assertEqual(Card.objects.filter(coluna=self.destino).count(), 2)
+
+    def test_reconciliacao(self):
+        Card.objects.bulk_create([Card(coluna=self.origem, titulo=f'C{i}', rank=f'{i + 1}') for i in range(3)])
+        self.assertEqual(self._total(self.origem), 0)
+
+        call_command('reconciliar_contadores_colunas', stdout=StringIO())
+        self.assertEqual(self._total(self.origem), 3)
+
+
+@override_settings(KANBAN_EVENTOS_DURACAO=0.2, KANBAN_EVENTOS_PING=0.1)
+class EventosKanbanTest(TestCase):
+    def setUp(self):
+        self.usuario = Usuario.objects.create_user(email='e@teste.com', username='e', nome='E', password='senha-forte-123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.usuario)
+        self.kanban = Kanban.objects.create(nome='Quadro', criado_por=self.usuario)
+        self.coluna = Coluna.objects.create(kanban=self.kanban, nome='A', ordem=0)
+        self.outra = Coluna.objects.create(kanban=self.kanban, nome='B', ordem=1)
+        patcher = mock.patch.object(eventos, 'transmissor', eventos.Transmissor())
+        self.transmissor = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _ler(self, parametros, headers=None):
+        # Requisição ASGI: o fluxo é um gerador assíncrono que termina após KANBAN_EVENTOS_DURACAO.
+        # async_to_sync mantém a view na thread do teste (mesma conexão e transação)
+        async def ler():
+            response = await AsyncClient().get(f'/api/kanbans/{self.kanban.id}/eventos/', parametros,
+                                               headers={'accept': 'text/event-stream', **(headers or {})})
+            self.assertEqual(response['Content-Type'], 'text/event-stream')
+            return b''.join([parte async for parte in response.streaming_content]).decode()
+        return async_to_sync(ler)()
+
+    @staticmethod
+    def _mensagens(conteudo):
+        return [dict(linha.split(': ', 1) for linha in mensagem.split('\n'))
+                for mensagem in conteudo.split('\n\n') if mensagem.startswith(('id', 'event'))]
+
+    def _eventos(self, **parametros):
+        parametros.setdefault('token', str(AccessToken.for_user(self.usuario)))
+        return self._mensagens(self._ler(parametros))
+
+    def test_views_publicam_e_cliente_retoma_do_ultimo_evento(self):
+        inicio = self.client.get(f'/api/kanbans/{self.kanban.id}/completo/')['X-Ultimo-Evento']
+        with self.captureOnCommitCallbacks(execute=True):
+            card = self.client.post('/api/cards/', {'coluna': self.coluna.id, 'titulo': 'Novo'}, format='json').data
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/cards/{card["id"]}/mover/', {'coluna_destino': self.outra.id}, format='json')
+
+        recebidos = self._eventos(ultimo_evento=inicio)
+        self.assertEqual([evento['event'] for evento in recebidos], ['card.criado', 'card.movido'])
+        self.assertIn('"titulo": "Novo"', recebidos[0]['data'])
+
+        # Reconexão com Last-Event-ID: só o que veio depois
+        conteudo = self._ler({'token': str(AccessToken.for_user(self.usuario))},
+                             headers={'last-event-id': recebidos[0]['id']})
+        self.assertIn('event: card.movido', conteudo)
+        self.assertNotIn('event: card.criado', conteudo)
+
+    def test_retomada_impossivel_pede_recarga(self):
+        self.assertEqual([e['event'] for e in self._eventos(ultimo_evento='outroprocesso-3')], ['recarregar'])
+
+        transmissor = eventos.Transmissor(tamanho_historico=2)
+        for indice in range(5):
+            transmissor.publicar(self.kanban.id, 'card.atualizado', {'id': indice})
+
+        async def pendentes(ultimo_id):
+            fila, pendentes = transmissor.assinar(self.kanban.id, ultimo_id)
+            transmissor.cancelar(self.kanban.id, fila)
+            return pendentes
+
+        self.assertEqual([e.dados['id'] for e in asyncio.run(pendentes(f'{transmissor.instancia}-3'))], [3, 4])
+        self.assertIsNone(asyncio.run(pendentes(f'{transmissor.instancia}-1')))
+
+    def test_wsgi_responde_na_hora_sem_prender_o_worker(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/cards/', {'coluna': self.coluna.id, 'titulo': 'Novo'}, format='json')
+        self.kanban.refresh_from_db()
+
+        response = self.client.get(f'/api/kanbans/{self.kanban.id}/eventos/', HTTP_ACCEPT='text/event-stream')
+        conteudo = b''.join(response.streaming_content).decode()
+
+        self.assertTrue(conteudo.startswith('retry: '))
+        recebidos = self._mensagens(conteudo)
+        self.assertEqual([evento['event'] for evento in recebidos], ['sincronizar'])
+        self.assertIn(f'"versao": {self.kanban.versao}', recebidos[0]['data'])
+
+    def test_quadro_de_outro_usuario(self):
+        outro = Usuario.objects.create_user(email='f@teste.com', username='f', nome='F', password='senha-forte-123')
+        response = APIClient().get(f'/api/kanbans/{self.kanban.id}/eventos/', {'token': str(AccessToken.for_user(outro))})
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(KANBAN_MUDANCAS_MARGEM=0)
+class SincronizacaoKanbanTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.usuario = Usuario.objects.create_user(email='s@teste.com', username='s', nome='S', password='senha-forte-123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.usuario)
+        self.kanban = Kanban.objects.create(nome='Quadro', criado_por=self.usuario)
+        self.coluna = Coluna.objects.create(kanban=self.kanban, nome='A', ordem=0)
+        self.extra = Coluna.objects.create(kanban=self.kanban, nome='B', ordem=1)
+        self.cards = [Card.objects.create(coluna=self.coluna, titulo=f'Card {i}') for i in range(3)]
+        self.url = f'/api/kanbans/{self.kanban.id}/mudancas/'
+
+    def test_quadro_sem_mudancas(self):
+        cursor = self.client.get(f'/api/kanbans/{self.kanban.id}/completo/')['X-Cursor-Mudancas']
+
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, {'desde': cursor})
+
+        self.assertEqual(response.data['cards'], [])
+        self.assertLess(len(response.content), 300)
+
+    def test_mudancas_e_remocoes_desde_o_cursor(self):
+        cursor = self.client.get(f'/api/kanbans/{self.kanban.id}/completo/')['X-Cursor-Mudancas']
+        self.client.patch(f'/api/cards/{self.cards[0].id}/', {'titulo': 'Alterado'}, format='json')
+        self.client.post(f'/api/cards/{self.cards[1].id}/mover/', {'coluna_destino': self.extra.id}, format='json')
+        self.client.delete(f'/api/cards/{self.cards[2].id}/')
+
+        response = self.client.get(self.url, {'desde': cursor})
+
+        self.assertEqual(sorted(c['titulo'] for c in response.data['cards']), ['Alterado', 'Card 1'])
+        self.assertEqual(response.data['removidos'], {'colunas': [], 'cards': [self.cards[2].id]})
+
+        # Exclusão da coluna em cascata: remoção da coluna e dos seus cards
+        self.client.delete(f'/api/colunas/{self.extra.id}/')
+        response = self.client.get(self.url, {'desde': response.data['cursor']})
+        self.assertEqual(response.data['removidos'], {'colunas': [self.extra.id], 'cards': [self.cards[1].id]})
+
+    def test_cursor_invalido_ou_expirado(self):
+        self.assertEqual(self.client.get(self.url, {'desde': 'ontem'}).status_code, 400)
+        antigo = (timezone.now() - timedelta(days=365)).isoformat()
+        self.assertEqual(self.client.get(self.url, {'desde': antigo}).status_code, 410)
+
+        RemocaoKanban.objects.create(kanban_id=self.kanban.id, tipo='card', objeto_id=1,
+                                     removido_em=timezone.now() - timedelta(days=365))
+        call_command('limpar_remocoes_kanban', stdout=StringIO())
+        self.assertFalse(RemocaoKanban.objects.exists())
+
+
+class BuscaCardsTest(TestCase):
+    def setUp(self):
+        self.usuario = Usuario.objects.create_user(email='b@teste.com', username='b', nome='B', password='senha-forte-123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.usuario)
+        kanban = Kanban.objects.create(nome='Vendas', criado_por=self.usuario)
+        self.coluna = Coluna.objects.create(kanban=kanban, nome='A', ordem=0)
+        outro = Usuario.objects.create_user(email='c@teste.com', username='c', nome='C', password='senha-forte-123')
+        self.alheia = Coluna.objects.create(kanban=Kanban.objects.create(nome='Outro', criado_por=outro), nome='A', ordem=0)
+
+    def _buscar(self, q):
+        response = self.client.get('/api/cards/busca/', {'q': q})
+        self.assertEqual(response.status_code, 200)
+        return [card['titulo'] for card in response.data]
+
+    def test_busca_ranqueada_nos_quadros_do_usuario(self):
+        Card.objects.create(coluna=self.coluna, titulo='Ligar para cliente', descricao='Proposta de orçamento')
+        Card.objects.create(coluna=self.coluna, titulo='Orçamento da reforma', descricao='Enviar ao cliente')
+        Card.objects.create(coluna=self.coluna, titulo='Reunião', descricao='Sem relação')
+        Card.objects.create(coluna=self.alheia, titulo='Orçamento de outro usuário')
+
+        # Título pesa mais que descrição; acentos e prefixos são ignorados
+        self.assertEqual(self._buscar('orcam'), ['Orçamento da reforma', 'Ligar para cliente'])
+        self.assertEqual(self._buscar('cliente orçamento reforma'), ['Orçamento da reforma'])
+        self.assertEqual(self._buscar('"inexistente" OR'), [])
+        self.assertEqual(self.client.get('/api/cards/busca/').status_code, 400)
+
+    def test_indice_acompanha_gravacoes(self):
+        card = Card.objects.create(coluna=self.coluna, titulo='Antigo')
+        self.client.patch(f'/api/cards/{card.id}/', {'titulo': 'Renomeado'}, format='json')
+        self.assertEqual(self._buscar('antigo'), [])
+        self.assertEqual(self._buscar('renomeado'), ['Renomeado'])
+
+        self.client.delete(f'/api/cards/{card.id}/')
+        self.assertEqual(self._buscar('renomeado'), [])
+
+        Card.objects.bulk_create([Card(coluna=self.coluna, titulo='Importado', rank='1')])
+        self.assertEqual(self._buscar('importado'), [])
+        call_command('reindexar_busca_cards', stdout=StringIO())
+        self.assertEqual(self._buscar('importado'), ['Importado'])
+
+
+class MetricasKanbanTest(TestCase):
+    def setUp(self):
+        self.usuario = Usuario.objects.create_user(email='m@teste.com', username='m', nome='M', password='senha-forte-123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.usuario)
+        self.kanban = Kanban.objects.create(nome='Fluxo', criado_por=self.usuario)
+        self.fazendo = Coluna.objects.create(kanban=self.kanban, nome='Fazendo', ordem=0)
+        self.feito = Coluna.objects.create(kanban=self.kanban, nome='Feito', ordem=1)
+        self.hoje = timezone.localtime().replace(hour=10, minute=0, second=0, microsecond=0)
+
+    def _em(self, dias, horas=0):
+        return mock.patch('django.utils.timezone.now', return_value=self.hoje - timedelta(days=dias) + timedelta(hours=horas))
+
+    def _get(self, url, **params):
+        response = self.client.get(f'/api/kanbans/{self.kanban.id}/{url}', params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_tempos_e_fluxo_cumulativo(self):
+        with self._em(2):
+            primeiro = Card.objects.create(coluna=self.fazendo, titulo='Primeiro', data_criacao=timezone.now())
+            segundo = Card.objects.create(coluna=self.fazendo, titulo='Segundo', data_criacao=timezone.now())
+        with self._em(1):
+            self.client.post(f'/api/cards/{primeiro.id}/mover/', {'coluna_destino': self.feito.id}, format='json')
+        with self._em(1, horas=6):
+            self.client.post('/api/cards/mover-lote/', {'cards': [segundo.id], 'coluna_destino': self.feito.id}, format='json')
+        with self._em(0):
+            self.client.delete(f'/api/cards/{segundo.id}/')
+
+        inicio = (self.hoje - timedelta(days=2)).date()
+        metricas = self._get('metricas/', inicio=inicio.isoformat())
+        fazendo, feito = metricas['colunas']
+        self.assertEqual((fazendo['entradas'], fazendo['saidas'], fazendo['tempo_medio_horas']), (2, 2, 27.0))
+        self.assertEqual((feito['entradas'], feito['saidas'], feito['tempo_medio_horas']), (2, 1, 18.0))
+        self.assertEqual((metricas['lead_time_horas'], metricas['vazao']), (27.0, 2))
+
+        # Cada dia sai dos totais diários, com o saldo anterior ao período como ponto de partida
+        with self.assertNumQueries(4):
+            fluxo = self._get('metricas/fluxo/', inicio=inicio.isoformat())
+        self.assertEqual([coluna['nome'] for coluna in fluxo['colunas']], ['Fazendo', 'Feito'])
+        self.assertEqual([dia['cards'] for dia in fluxo['dias']], [[2, 0], [0, 2], [0, 1]])
+        fluxo = self._get('metricas/fluxo/', inicio=(inicio + timedelta(days=1)).isoformat())
+        self.assertEqual([dia['cards'] for dia in fluxo['dias']], [[0, 2], [0, 1]])
+
+        response = self.client.get(f'/api/kanbans/{self.kanban.id}/metricas/', {'inicio': '2020-01-01'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_reconstruir_a_partir_do_historico(self):
+        cards = [Card.objects.create(coluna=self.fazendo, titulo=f'Card {i}') for i in range(3)]
+        self.client.post(f'/api/cards/{cards[0].id}/mover/', {'coluna_destino': self.feito.id}, format='json')
+        self.client.post('/api/cards/mover-lote/', {'cards': [cards[1].id], 'coluna_destino': self.feito.id}, format='json')
+        antes = self._get('metricas/fluxo/')['dias'][-1]['cards']
+        self.assertEqual(antes, [1, 2])
+
+        call_command('reconstruir_metricas_kanban', stdout=StringIO())
+        self.assertEqual(self._get('metricas/fluxo/')['dias'][-1]['cards'], antes)
+        self.assertEqual(cards[1].permanencias.filter(saida__isnull=True).get().coluna_id, self.feito.id)
+
+
+class ArquivamentoKanbanTest(TestCase):
+    def setUp(self):
+        self.usuario = Usuario.objects.create_user(email='r@teste.com', username='r', nome='R', password='senha-forte-123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.usuario)
+        self.kanban = Kanban.objects.create(nome='Retenção', criado_por=self.usuario)
+        self.origem = Coluna.objects.create(kanban=self.kanban, nome='A', ordem=0)
+        self.destino = Coluna.objects.create(kanban=self.kanban, nome='B', ordem=1)
+        self.card = Card.objects.create(coluna=self.origem, titulo='Antigo')
+        agora = timezone.now()
+        for dias in (400, 300, 10, 1):
+            HistoricoMovimentacao.objects.create(card=self.card, coluna_origem=self.origem, coluna_destino=self.destino,
+                                                 usuario=self.usuario, data=agora - timedelta(days=dias))
+            LogNotificacao.objects.create(card=self.card, destinatario='5511999999999', mensagem=f'{dias} dias',
+                                          status='enviado', data_envio=agora - timedelta(days=dias))
+
+    def test_arquiva_em_lotes_e_consulta_com_arquivo(self):
+        call_command('arquivar_historico_kanban', '--dias-historico=100', '--dias-logs=5', '--tamanho-lote=1', stdout=StringIO())
+        self.assertEqual(HistoricoMovimentacao.objects.count(), 2)
+        self.assertEqual(LogNotificacao.objects.count(), 1)
+        arquivado = HistoricoMovimentacaoArquivo.objects.order_by('data').first()
+        self.assertEqual((arquivado.kanban_id, arquivado.card_titulo, arquivado.coluna_destino_nome, arquivado.usuario_nome),
+                         (self.kanban.id, 'Antigo', 'B', 'R'))
+        self.assertEqual(LogNotificacaoArquivo.objects.count(), 3)
+
+        url = '/api/historico-movimentacao/'
+        self.assertEqual(len(self.client.get(url, {'kanban': self.kanban.id}).data), 2)
+        completo = self.client.get(url, {'kanban': self.kanban.id, 'incluir_arquivo': 1}).json()
+        self.assertEqual(len(completo), 4)
+        self.assertEqual(completo[2], {**completo[0], 'id': completo[2]['id'], 'data': completo[2]['data']})
+
+        # Paginação por cursor atravessa da tabela principal para o arquivo, nos dois sentidos
+        paginas, resposta = [], self.client.get(url, {'incluir_arquivo': 1, 'tamanho': 3})
+        while True:
+            paginas.append([registro['id'] for registro in resposta.data['results']])
+            if not resposta.data['next']:
+                break
+            resposta = self.client.get(resposta.data['next'])
+        self.assertEqual(sum(paginas, []), [registro['id'] for registro in completo])
+        anterior = self.client.get(resposta.data['previous'])
+        self.assertEqual([registro['id'] for registro in anterior.data['results']], paginas[0])
+
+        logs = self.client.get('/api/log-notificacao/', {'card': self.card.id, 'incluir_arquivo': 'true'}).data
+        self.assertEqual([log['mensagem'] for log in logs], ['1 dias', '10 dias', '300 dias', '400 dias'])
+        historico = self.client.get(f'/api/cards/{self.card.id}/historico/', {'incluir_arquivo': 1}).data
+        self.assertEqual(len(historico), 4)
+
+    def test_metricas_reconstruidas_com_historico_arquivado(self):
+        self.card.coluna = self.destino
+        self.card.save()
+        call_command('arquivar_historico_kanban', '--dias-historico=0', '--dias-logs=0', stdout=StringIO())
+        call_command('reconstruir_metricas_kanban', stdout=StringIO())
+        self.assertEqual(self.card.permanencias.count(), 2)
+        self.assertEqual(self.card.permanencias.get(saida__isnull=True).coluna_id, self.destino.id)
@@ -18,7 +18,8 @@ from .views import (
     CardViewSet,
     RegraAutomacaoViewSet,
     HistoricoMovimentacaoViewSet,
-    LogNotificacaoViewSet
+    LogNotificacaoViewSet,
+    relatorio_vendas
 )
 
 router = DefaultRouter()
@@ -45,4 +46,5 @@ urlpatterns = [
     path('usuarios/perfil/', PerfilUsuarioView.as_view(), name='perfil_usuario'),
     path('usuarios/', ListaUsuariosView.as_view(), name='lista_usuarios'),
     path('usuarios/<uuid:pk>/', UsuarioDetailView.as_view(), name='detalle_usuario'),
+    path('relatorios/vendas/', relatorio_vendas, name='relatorio_vendas'),
 ]
\ No newline at end of file
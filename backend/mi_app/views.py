@@ -1,13 +1,24 @@
+import codecs
+import functools
+import json
+from datetime import datetime, time, timedelta
 from rest_framework import viewsets, permissions
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.decorators import action, api_view, permission_classes
+from rest_framework.exceptions import ValidationError
+from rest_framework.renderers import BaseRenderer, JSONRenderer
 from django.contrib.auth import get_user_model
+from rest_framework_simplejwt.authentication import JWTAuthentication
 from rest_framework_simplejwt.views import TokenObtainPairView
 from rest_framework.generics import CreateAPIView, RetrieveUpdateAPIView, ListAPIView, RetrieveUpdateDestroyAPIView
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
 from django.db import transaction
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
 from django.utils import timezone
+from django.utils.dateparse import parse_date
+from django.utils.http import parse_etags
 from .serializers import (
     UsuarioSerializer,
     CustomTokenObtainPairSerializer,
@@ -21,15 +32,196 @@ from .serializers import (
     KanbanCompletoSerializer,
     ColunaSerializer,
     CardSerializer,
+    CardBuscaSerializer,
     RegraAutomacaoSerializer,
     HistoricoMovimentacaoSerializer,
-    LogNotificacaoSerializer
+    LogNotificacaoSerializer,
+    CacheRequisicao
 )
-from .models import Cliente, Produto, Categoria, Venta, VentaItem, Carrito
-from .models_kanban import Kanban, Coluna, Card, RegraAutomacao, HistoricoMovimentacao, LogNotificacao
+from .models import Cliente, Produto, Categoria, Venta, VentaItem, Carrito, ResumoVendas
+from .models_kanban import (
+    Kanban, Coluna, Card, RegraAutomacao, HistoricoMovimentacao, HistoricoMovimentacaoArquivo,
+    LogNotificacao, LogNotificacaoArquivo, LimiteCardsError
+)
+from .authentication import JWTQueryParamAuthentication
+from .pagination import ConsultaComArquivo, CursorPaginacao
+from . import eventos as eventos_kanban
+from .services import BuscaCardsService, KanbanSnapshotService, MetricasKanbanService, SincronizacaoKanbanService, OrdenacaoKanbanError, OrdenacaoKanbanService, VendaService, VendaError, CarrinhoCache, CarrinhoService, IdempotenciaService, ReservaService, ResumoVendasService, ExportacaoVendasService
 
 Usuario = get_user_model()
 
+
+def _escopo_idempotencia(request):
+    """
+    Dono de uma Idempotency-Key: o usuário autenticado, a sessão do Django ou,
+    sem login nem sessão, o carrinho informado no corpo (session_id ou
+    usuario_id). Sem nenhum deles não há como separar os clientes e a chave é
+    ignorada (None).
+    """
+    if request.user and request.user.is_authenticated:
+        return f'usuario:{request.user.pk}'
+    if request.session.session_key:
+        return f'sessao:{request.session.session_key}'
+    dados = request.data if isinstance(request.data, dict) else {}
+    for campo in ('session_id', 'usuario_id'):
+        if dados.get(campo):
+            return f'carrinho:{campo}:{dados[campo]}'
+    return None
+
+
+def idempotente(view_method):
+    """
+    Reaproveita a resposta de requisições repetidas com o mesmo header
+    Idempotency-Key, sem executar a view novamente.
+    """
+    @functools.wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        chave = request.headers.get('Idempotency-Key')
+        if not chave:
+            return view_method(self, request, *args, **kwargs)
+        if len(chave) > 255:
+            return Response(
+                {'detail': 'Idempotency-Key deve ter no máximo 255 caracteres'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        escopo = _escopo_idempotencia(request)
+        if escopo is None:
+            return view_method(self, request, *args, **kwargs)
+
+        endpoint = f'{self.basename}.{view_method.__name__}'
+        hash_requisicao = IdempotenciaService.hash_requisicao(request.data)
+        registro, criado = IdempotenciaService.reservar(chave, endpoint, hash_requisicao, escopo)
+
+        if not criado:
+            if registro.hash_requisicao != hash_requisicao:
+                return Response(
+                    {'detail': 'Idempotency-Key já utilizada com outro corpo de requisição'},
+                    status=status.HTTP_422_UNPROCESSABLE_ENTITY
+                )
+            if registro.status_code is None:
+                return Response(
+                    {'detail': 'Uma requisição com esta Idempotency-Key ainda está em processamento'},
+                    status=status.HTTP_409_CONFLICT
+                )
+            response = Response(registro.resposta, status=registro.status_code)
+            response['Idempotent-Replayed'] = 'true'
+            return response
+
+        try:
+            response = view_method(self, request, *args, **kwargs)
+        except Exception:
+            IdempotenciaService.liberar(registro)
+            raise
+
+        if response.status_code >= 500:
+            IdempotenciaService.liberar(registro)
+        else:
+            IdempotenciaService.concluir(registro, response.status_code, response.data)
+        return response
+
+    return wrapper
+
+
+def _etag_corresponde(request, etag):
+    """Se o If-None-Match da requisição contém o ETag (comparação fraca, sem o prefixo W/)"""
+    etags = {
+        valor[2:] if valor.startswith('W/') else valor
+        for valor in parse_etags(request.headers.get('If-None-Match', ''))
+    }
+    return '*' in etags or etag in etags
+
+
+class EventStreamRenderer(BaseRenderer):
+    """Aceita Accept: text/event-stream; o fluxo SSE é montado pela própria view (erros saem em JSON)"""
+    media_type = 'text/event-stream'
+    format = 'eventos'
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return json.dumps(data).encode()
+
+
+def _incluir_arquivo(request):
+    """Se a consulta deve juntar os registros arquivados (?incluir_arquivo=1)"""
+    return request.query_params.get('incluir_arquivo') in ('1', 'true')
+
+
+def _inicio_do_dia(valor, parametro):
+    """Converte AAAA-MM-DD no início do dia (aware) no fuso horário configurado"""
+    try:
+        data = parse_date(valor) if isinstance(valor, str) else None
+    except ValueError:
+        # Formato certo, mas data impossível (ex.: 2025-02-30)
+        data = None
+    if data is None:
+        raise ValidationError({parametro: 'Data inválida, use o formato AAAA-MM-DD'})
+    return timezone.make_aware(datetime.combine(data, time.min))
+
+
+def _ler_json_stream(stream, ndjson=False, tamanho_bloco=64 * 1024):
+    """
+    Lê objetos de um array JSON ou de NDJSON à medida que o corpo chega,
+    sem carregar o corpo inteiro em memória antes de decodificar.
+    """
+    if stream is None:
+        return
+    if ndjson:
+        for linha in stream:
+            linha = linha.strip()
+            if linha:
+                yield json.loads(linha)
+        return
+
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    buffer = ''
+    # Estados: 'inicio' (antes do '['), 'primeiro' (após '['), 'valor' (após ','),
+    # 'separador' (após um valor) e 'fechado' (após ']', só espaços são aceitos)
+    estado = 'inicio'
+    fim = False
+    while True:
+        if not fim:
+            bloco = stream.read(tamanho_bloco)
+            fim = not bloco
+            buffer += utf8.decode(bloco, final=fim)
+
+        while True:
+            buffer = buffer.lstrip()
+            if not buffer:
+                break
+            caractere = buffer[0]
+            if estado == 'inicio':
+                if caractere != '[':
+                    raise ValueError('O corpo deve ser um array JSON')
+                estado = 'primeiro'
+                buffer = buffer[1:]
+            elif estado == 'fechado':
+                raise ValueError('Conteúdo após o fim do array JSON')
+            elif estado == 'separador':
+                if caractere not in ',]':
+                    raise ValueError('Esperado "," ou "]" entre os itens do array')
+                estado = 'valor' if caractere == ',' else 'fechado'
+                buffer = buffer[1:]
+            elif caractere == ']' and estado == 'primeiro':
+                estado = 'fechado'
+                buffer = buffer[1:]
+            else:
+                try:
+                    objeto, posicao = decoder.raw_decode(buffer)
+                except json.JSONDecodeError:
+                    if fim:
+                        raise
+                    break  # Objeto incompleto, ler mais um bloco
+                yield objeto
+                estado = 'separador'
+                buffer = buffer[posicao:]
+
+        if fim:
+            if estado != 'fechado':
+                raise ValueError('Array JSON incompleto')
+            return
+
 class RegistroUsuarioView(CreateAPIView):
     queryset = Usuario.objects.all()
     permission_classes = (permissions.IsAuthenticated,)
@@ -86,6 +278,8 @@ class VentaViewSet(viewsets.ModelViewSet):
     queryset = Venta.objects.all()
     serializer_class = VentaSerializer
     permission_classes = [permissions.AllowAny]  # Temporalmente permitir acceso sin autenticación
+    pagination_class = CursorPaginacao
+    ordenacao_cursor = ('-created_at', '-id')
 
     def get_queryset(self):
         queryset = Venta.objects.all()
@@ -99,116 +293,31 @@ class VentaViewSet(viewsets.ModelViewSet):
         fecha_inicio = self.request.query_params.get('fecha_inicio', None)
         fecha_fin = self.request.query_params.get('fecha_fin', None)
         
+        # Intervalo semiaberto [início do dia, início do dia seguinte) no fuso
+        # configurado: compara a coluna diretamente e usa os índices de created_at
         if fecha_inicio:
-            queryset = queryset.filter(created_at__date__gte=fecha_inicio)
+            queryset = queryset.filter(created_at__gte=_inicio_do_dia(fecha_inicio, 'fecha_inicio'))
         if fecha_fin:
-            queryset = queryset.filter(created_at__date__lte=fecha_fin)
+            queryset = queryset.filter(
+                created_at__lt=_inicio_do_dia(fecha_fin, 'fecha_fin') + timedelta(days=1)
+            )
         
         return queryset.order_by('-created_at')
 
+    @idempotente
     def create(self, request, *args, **kwargs):
         """Criar venda direta e reduzir estoque de produtos"""
         try:
-            with transaction.atomic():
-                # Obter os itens da venda
-                items_data = request.data.get('items', [])
-                if not items_data:
-                    return Response(
-                        {'detail': 'A venda deve incluir pelo menos um produto'},
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
-                
-                # Verificar estoque disponível para todos os produtos
-                total_venda = 0
-                items_validados = []
-                
-                for item_data in items_data:
-                    produto_id = item_data.get('produto')
-                    
-                    # Validar e converter quantidade
-                    try:
-                        quantidade = int(item_data.get('quantidade', item_data.get('cantidad', 1)))
-                        if quantidade <= 0:
-                            return Response(
-                                {'detail': 'A quantidade deve ser maior que 0'},
-                                status=status.HTTP_400_BAD_REQUEST
-                            )
-                    except (ValueError, TypeError):
-                        return Response(
-                            {'detail': 'A quantidade deve ser um número inteiro válido'},
-                            status=status.HTTP_400_BAD_REQUEST
-                        )
-                    
-                    preco_unitario = item_data.get('preco_unitario', item_data.get('precio_unitario'))
-                    
-                    try:
-                        produto = Produto.objects.get(id=produto_id)
-                    except Produto.DoesNotExist:
-                        return Response(
-                            {'detail': f'Produto com ID {produto_id} não encontrado'},
-                            status=status.HTTP_404_NOT_FOUND
-                        )
-                    
-                    if quantidade > produto.estoque:
-                        return Response(
-                            {'detail': f'Estoque insuficiente para {produto.nome}. Apenas {produto.estoque} unidades disponíveis.'},
-                            status=status.HTTP_400_BAD_REQUEST
-                        )
-                    
-                    # Validar e converter preço unitário
-                    try:
-                        if not preco_unitario:
-                            preco_unitario = float(produto.preco)
-                        else:
-                            preco_unitario = float(preco_unitario)
-                            if preco_unitario <= 0:
-                                return Response(
-                                    {'detail': 'O preço unitário deve ser maior que 0'},
-                                    status=status.HTTP_400_BAD_REQUEST
-                                )
-                    except (ValueError, TypeError):
-                        return Response(
-                            {'detail': 'O preço unitário deve ser um número válido'},
-                            status=status.HTTP_400_BAD_REQUEST
-                        )
-                    
-                    subtotal = quantidade * preco_unitario
-                    total_venda += subtotal
-                    items_validados.append({
-                        'produto': produto,
-                        'quantidade': quantidade,
-                        'preco_unitario': preco_unitario,
-                        'subtotal': subtotal
-                    })
-                
-                # Criar a venda
-                venda_data = {
-                    'cliente_cedula': request.data.get('cliente'),
-                    'total': total_venda
-                }
-                venda = Venta.objects.create(**venda_data)
-                
-                # Criar os itens de venda e reduzir estoque
-                for item_data in items_validados:
-                    produto = item_data['produto']
-                    quantidade = item_data['quantidade']
-                    preco_unitario = item_data['preco_unitario']
-                    
-                    # Reduzir estoque
-                    produto.reduzir_estoque(quantidade)
-                    
-                    # Criar item de venda
-                    VentaItem.objects.create(
-                        venda_id=venda.id,
-                        produto_id=produto.id,
-                        quantidade=quantidade,
-                        preco_unitario=preco_unitario
-                    )
-                
-                # Serializar y retornar la venda creada
-                serializer = VentaSerializer(venda)
-                return Response(serializer.data, status=status.HTTP_201_CREATED)
-                
+            venda = VendaService.criar_venda(
+                request.data.get('cliente'),
+                request.data.get('items', [])
+            )
+            # Serializar y retornar la venda creada
+            serializer = VentaSerializer(venda)
+            return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+        except VendaError as e:
+            return Response({'detail': e.detail}, status=e.status_code)
         except Exception as e:
             return Response(
                 {'detail': f'Error al procesar la venda: {str(e)}'},
@@ -227,13 +336,86 @@ class VentaViewSet(viewsets.ModelViewSet):
         # Obtener la instancia de la venda
         instance = self.get_object()
         
-        # Eliminar todos los VentaItem relacionados antes de eliminar la venda
-        VentaItem.objects.filter(venda_id=instance.id).delete()
-        
-        # Ahora eliminar la venda
-        return super().destroy(request, *args, **kwargs)
+        # Eliminar la venda y sus VentaItem, descontándola de los resúmenes
+        VendaService.excluir_venda(instance)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    def perform_update(self, serializer):
+        # Edição direta (cliente, total): recalcula a venda nos resúmenes
+        with VendaService.editando_vendas([serializer.instance.id]):
+            serializer.save()
     
+    @action(detail=False, methods=['get'])
+    def exportar(self, request):
+        """Exportar vendas filtradas em CSV ou NDJSON (streaming, memória constante)"""
+        formato = request.query_params.get('formato', 'csv')
+        if formato not in ('csv', 'ndjson'):
+            return Response(
+                {'detail': 'formato deve ser "csv" ou "ndjson"'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        queryset = self.get_queryset()
+        if formato == 'csv':
+            response = StreamingHttpResponse(
+                ExportacaoVendasService.csv(queryset),
+                content_type='text/csv; charset=utf-8'
+            )
+        else:
+            response = StreamingHttpResponse(
+                ExportacaoVendasService.ndjson(queryset),
+                content_type='application/x-ndjson; charset=utf-8'
+            )
+        response['Content-Disposition'] = f'attachment; filename="vendas.{formato}"'
+        return response
+
+    @action(detail=False, methods=['post'])
+    def lote(self, request):
+        """Registrar um lote de vendas (array JSON ou NDJSON) em uma única transação"""
+        content_type = request.content_type or ''
+        ndjson = 'ndjson' in content_type or 'jsonlines' in content_type
+        limite = settings.VENDAS_LOTE_MAX
+
+        try:
+            vendas_data = []
+            for venda_data in _ler_json_stream(request.stream, ndjson=ndjson):
+                vendas_data.append(venda_data)
+                if len(vendas_data) > limite:
+                    return Response(
+                        {'detail': f'O lote pode ter no máximo {limite} vendas'},
+                        status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+                    )
+        except ValueError as e:
+            return Response(
+                {'detail': f'Lote inválido: {str(e)}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        if not vendas_data:
+            return Response(
+                {'detail': 'O lote deve incluir pelo menos uma venda'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            resultados = VendaService.criar_vendas_em_lote(vendas_data)
+        except VendaError as e:
+            return Response({'detail': e.detail}, status=e.status_code)
+        except Exception as e:
+            return Response(
+                {'detail': f'Erro ao processar o lote: {str(e)}'},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+        criadas = sum(1 for resultado in resultados.values() if resultado['status'] == 'criada')
+        return Response({
+            'criadas': criadas,
+            'rejeitadas': len(resultados) - criadas,
+            'resultados': resultados,
+        })
+
     @action(detail=False, methods=['post'])
+    @idempotente
     def procesar_desde_carrito(self, request):
         """Processa uma venda do carrinho e reduz o estoque"""
         session_id = request.data.get('session_id')
@@ -246,81 +428,22 @@ class VentaViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
+        # Obter itens do carrinho (o do usuário, se informado; senão o da sessão anônima)
+        carrito_items = CarrinhoService.linhas(session_id, usuario_id)
+
         try:
             with transaction.atomic():
-                # Obter itens do carrinho
-                if session_id:
-                    carrito_items = Carrito.objects.filter(session_id=session_id)
-                else:
-                    carrito_items = Carrito.objects.filter(usuario_id=usuario_id)
-                
-                if not carrito_items.exists():
-                    return Response(
-                        {'detail': 'O carrinho está vazio'},
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
-                
-                # Verificar estoque disponível para todos os produtos
-                total_venda = 0
-                items_validados = []
-                
-                for item in carrito_items:
-                    produto = item.get_produto()
-                    if not produto:
-                        return Response(
-                            {'detail': f'Produto com ID {item.produto_id} não encontrado'},
-                            status=status.HTTP_404_NOT_FOUND
-                        )
-                    
-                    quantidade_item = getattr(item, 'quantidade', getattr(item, 'cantidad', 1))
-                    preco_unitario_item = getattr(item, 'preco_unitario', getattr(item, 'precio_unitario', 0))
-                    
-                    if not produto.tem_estoque(quantidade_item):
-                        return Response(
-                            {'detail': f'Estoque insuficiente para {produto.nome}. Apenas {produto.estoque} unidades disponíveis.'},
-                            status=status.HTTP_400_BAD_REQUEST
-                        )
-                    
-                    subtotal = quantidade_item * preco_unitario_item
-                    total_venda += subtotal
-                    items_validados.append({
-                        'produto': produto,
-                        'item': item,
-                        'subtotal': subtotal
-                    })
-                
-                # Criar a venda
-                venda = Venta.objects.create(
-                    cliente_cedula=cliente_cedula,
-                    total=total_venda
-                )
-                
-                # Criar os itens de venda e reduzir estoque
-                for item_data in items_validados:
-                    produto = item_data['produto']
-                    carrito_item = item_data['item']
-                    
-                    quantidade_item = getattr(carrito_item, 'quantidade', getattr(carrito_item, 'cantidad', 1))
-                    preco_unitario_item = getattr(carrito_item, 'preco_unitario', getattr(carrito_item, 'precio_unitario', 0))
-                    
-                    # Reduzir estoque
-                    produto.reduzir_estoque(quantidade_item)
-                    
-                    # Criar item de venda
-                    VentaItem.objects.create(
-                        venda_id=venda.id,
-                        produto_id=produto.id,
-                        quantidade=quantidade_item,
-                        preco_unitario=preco_unitario_item
-                    )
-                
-                # Limpar carrinho
-                carrito_items.delete()
-                
-                # Serializar e retornar a venda criada
-                serializer = VentaSerializer(venda)
-                return Response(serializer.data, status=status.HTTP_201_CREATED)
-                
+                if not usuario_id and CarrinhoCache.ativo():
+                    # Carrinho anônimo guardado no cache: gravar no banco antes da venda
+                    CarrinhoCache.persistir(session_id)
+                venda = VendaService.criar_venda_do_carrinho(carrito_items, cliente_cedula)
+
+            # Serializar e retornar a venda criada
+            serializer = VentaSerializer(venda)
+            return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+        except VendaError as e:
+            return Response({'detail': e.detail}, status=e.status_code)
         except Exception as e:
             return Response(
                 {'detail': f'Erro ao processar a venda: {str(e)}'},
@@ -342,6 +465,20 @@ class VentaItemViewSet(viewsets.ModelViewSet):
         
         return queryset.order_by('-created_at')
 
+    # Itens alterados por aqui mudam a venda: os resúmenes são recalculados para ela
+    def perform_create(self, serializer):
+        with VendaService.editando_vendas([serializer.validated_data.get('venda_id')]):
+            serializer.save()
+
+    def perform_update(self, serializer):
+        venda_ids = [serializer.instance.venda_id, serializer.validated_data.get('venda_id')]
+        with VendaService.editando_vendas(venda_ids):
+            serializer.save()
+
+    def perform_destroy(self, instance):
+        with VendaService.editando_vendas([instance.venda_id]):
+            instance.delete()
+
 class ListaUsuariosView(ListAPIView):
     serializer_class = UsuarioSerializer
     permission_classes = (permissions.IsAuthenticated,)
@@ -515,6 +652,8 @@ class ProdutoViewSet(viewsets.ModelViewSet):
     queryset = Produto.objects.all()
     serializer_class = ProdutoSerializer
     permission_classes = [permissions.AllowAny]  # Temporalmente permitir acceso sin autenticación
+    pagination_class = CursorPaginacao
+    ordenacao_cursor = ('-created_at', '-id')
 
     def get_queryset(self):
         queryset = Produto.objects.all().order_by('-created_at')
@@ -561,19 +700,58 @@ class CarritoViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         queryset = Carrito.objects.all()
         
-        # Filtrar por session_id o usuario_id
+        # Filtrar por usuario_id o, sin usuario, por session_id (misma regla de CarrinhoService.linhas)
         session_id = self.request.query_params.get('session_id', None)
         usuario_id = self.request.query_params.get('usuario_id', None)
         
-        if session_id:
-            queryset = queryset.filter(session_id=session_id)
-        elif usuario_id:
-            queryset = queryset.filter(usuario_id=usuario_id)
+        if session_id or usuario_id:
+            queryset = CarrinhoService.linhas(session_id, usuario_id)
         
         return queryset.order_by('-created_at')
 
+    def _sessao_em_cache(self, dados):
+        """session_id do carrinho anônimo quando os carrinhos anônimos ficam no cache"""
+        if CarrinhoCache.ativo() and dados.get('session_id') and not dados.get('usuario_id'):
+            return dados.get('session_id')
+        return None
+
+    def _dados_cache(self, session_id, produto_id=None):
+        linhas = CarrinhoCache.linhas(session_id)
+        if produto_id is not None:
+            linhas = [linha for linha in linhas if linha.produto_id == produto_id]
+        dados = self.get_serializer(linhas, many=True).data
+        for item, linha in zip(dados, linhas):
+            item['id'] = CarrinhoCache.linha_id(session_id, linha.produto_id)
+        return dados
+
+    def _linha_cache(self, session_id, produto_id):
+        dados = self._dados_cache(session_id, produto_id)
+        if not dados:
+            return Response({'detail': 'Item do carrinho não encontrado'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(dados[0])
+
+    def list(self, request, *args, **kwargs):
+        session_id = self._sessao_em_cache(request.query_params)
+        if session_id:
+            return Response(self._dados_cache(session_id))
+        return super().list(request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        linha = CarrinhoCache.decodificar_id(kwargs.get('pk'))
+        if linha:
+            return self._linha_cache(*linha)
+        return super().retrieve(request, *args, **kwargs)
+
+    def _sem_estoque(self, produto_id, no_carrinho=0):
+        produto = Produto.objects.filter(id=produto_id).first()
+        disponivel = produto.estoque_disponivel if produto else 0
+        detalhe = f'Estoque insuficiente. Apenas {disponivel} unidades disponíveis'
+        if no_carrinho:
+            detalhe += f' e você já tem {no_carrinho} no carrinho'
+        return Response({'detail': detalhe + '.'}, status=status.HTTP_400_BAD_REQUEST)
+
     def create(self, request, *args, **kwargs):
-        """Agregar produto al carrito"""
+        """Agregar produto al carrito, reservando o estoque por CARRITO_RESERVA_MINUTOS"""
         serializer = self.get_serializer(data=request.data)
         if serializer.is_valid():
             try:
@@ -582,41 +760,38 @@ class CarritoViewSet(viewsets.ModelViewSet):
                 session_id = serializer.validated_data.get('session_id')
                 usuario_id = serializer.validated_data.get('usuario_id')
                 
-                produto = Produto.objects.get(id=produto_id)
+                if self._sessao_em_cache(serializer.validated_data):
+                    CarrinhoCache.adicionar(session_id, produto_id, quantidade)
+                    response = self._linha_cache(session_id, produto_id)
+                    response.status_code = status.HTTP_201_CREATED
+                    return response
                 
-                # Verificar si el produto ya está en el carrito
-                existing_item = None
-                if session_id:
-                    existing_item = Carrito.objects.filter(
-                        session_id=session_id, 
-                        produto_id=produto_id
-                    ).first()
-                elif usuario_id:
-                    existing_item = Carrito.objects.filter(
-                        usuario_id=usuario_id, 
-                        produto_id=produto_id
-                    ).first()
-                
-                if existing_item:
-                    # Verificar estoque total (existente + novo)
-                    nova_quantidade = existing_item.quantidade + quantidade
-                    if nova_quantidade > produto.estoque:
-                        return Response(
-                            {'detail': f'Estoque insuficiente. Apenas {produto.estoque} unidades disponíveis e você já tem {existing_item.quantidade} no carrinho.'},
-                            status=status.HTTP_400_BAD_REQUEST
-                        )
-                    existing_item.quantidade = nova_quantidade
-                    existing_item.save()
-                    serializer = self.get_serializer(existing_item)
-                else:
-                    # Verificar estoque para novo item
-                    if quantidade > produto.estoque:
-                        return Response(
-                            {'detail': f'Estoque insuficiente. Apenas {produto.estoque} unidades disponíveis.'},
-                            status=status.HTTP_400_BAD_REQUEST
-                        )
-                    carrito_item = serializer.save()
+                with transaction.atomic():
+                    # Verificar si el produto ya está en el carrito
+                    existing_item = None
+                    if session_id or usuario_id:
+                        existing_item = CarrinhoService.linhas(session_id, usuario_id).select_for_update().filter(
+                            produto_id=produto_id
+                        ).first()
+                    
+                    if existing_item:
+                        # Uma linha com reserva vencida e já liberada precisa reservar tudo de novo
+                        a_reservar = quantidade
+                        if existing_item.reservado_ate is None:
+                            a_reservar += existing_item.quantidade
+                        if not ReservaService.reservar(produto_id, a_reservar):
+                            return self._sem_estoque(produto_id, existing_item.quantidade)
+                        existing_item.quantidade += quantidade
+                        existing_item.reservado_ate = ReservaService.prazo()
+                        existing_item.save()
+                        serializer = self.get_serializer(existing_item)
+                    else:
+                        if not ReservaService.reservar(produto_id, quantidade):
+                            return self._sem_estoque(produto_id)
+                        serializer.save(reservado_ate=ReservaService.prazo())
                 
+                # A reserva mudou o estoque livre do produto já carregado na validação
+                CacheRequisicao.obter(serializer.context).descartar_produtos([produto_id])
                 return Response(serializer.data, status=status.HTTP_201_CREATED)
                 
             except Produto.DoesNotExist:
@@ -624,6 +799,8 @@ class CarritoViewSet(viewsets.ModelViewSet):
                     {'detail': 'O produto não existe'},
                     status=status.HTTP_404_NOT_FOUND
                 )
+            except VendaError as e:
+                return Response({'detail': e.detail}, status=e.status_code)
             except Exception as e:
                 return Response(
                     {'detail': str(e)},
@@ -632,12 +809,21 @@ class CarritoViewSet(viewsets.ModelViewSet):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
     def update(self, request, *args, **kwargs):
-        """Atualizar quantidade no carrinho"""
-        partial = kwargs.pop('partial', False)
-        instance = self.get_object()
+        """Atualizar quantidade no carrinho, ajustando a reserva pela diferença"""
+        linha_cache = CarrinhoCache.decodificar_id(kwargs.get('pk'))
+        instance = None if linha_cache else self.get_object()
+        produto_atual = linha_cache[1] if linha_cache else instance.produto_id
+        
+        produto_param = request.data.get('produto_id')
+        if produto_param is not None and str(produto_param) != str(produto_atual):
+            return Response(
+                {'detail': 'Não é possível trocar o produto de um item do carrinho'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
         # Verificar estoque antes de atualizar
         quantidade_param = request.data.get('quantidade', request.data.get('cantidad'))
+        nova_quantidade = None
         if quantidade_param:
             try:
                 nova_quantidade = int(quantidade_param)
@@ -651,22 +837,137 @@ class CarritoViewSet(viewsets.ModelViewSet):
                     {'detail': 'A quantidade deve ser um número inteiro válido'},
                     status=status.HTTP_400_BAD_REQUEST
                 )
-            
-            produto = instance.get_produto()
-            if produto and nova_quantidade > produto.estoque:
-                return Response(
-                    {'detail': f'Estoque insuficiente. Apenas {produto.estoque} unidades disponíveis.'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            
-            instance.quantidade = nova_quantidade
-            instance.save()
         
-        return super().update(request, *args, **kwargs)
+        if linha_cache:
+            session_id, produto_id = linha_cache
+            if not any(linha.produto_id == produto_id for linha in CarrinhoCache.linhas(session_id)):
+                return Response({'detail': 'Item do carrinho não encontrado'}, status=status.HTTP_404_NOT_FOUND)
+            if nova_quantidade is not None:
+                try:
+                    CarrinhoCache.definir(session_id, {produto_id: nova_quantidade})
+                except VendaError as e:
+                    return Response({'detail': e.detail}, status=e.status_code)
+            return self._linha_cache(session_id, produto_id)
+        
+        with transaction.atomic():
+            instance = Carrito.objects.select_for_update().get(pk=instance.pk)
+            if nova_quantidade is not None:
+                reservado = instance.quantidade if instance.reservado_ate is not None else 0
+                diferenca = nova_quantidade - reservado
+                if diferenca > 0 and not ReservaService.reservar(instance.produto_id, diferenca):
+                    return self._sem_estoque(instance.produto_id)
+                if diferenca < 0:
+                    ReservaService.liberar(instance.produto_id, -diferenca)
+                
+                instance.quantidade = nova_quantidade
+                instance.reservado_ate = ReservaService.prazo()
+                instance.save()
+            
+            return super().update(request, *args, **kwargs)
 
     def destroy(self, request, *args, **kwargs):
-        """Remover produto do carrinho"""
-        return super().destroy(request, *args, **kwargs)
+        """Remover produto do carrinho, liberando a reserva"""
+        linha_cache = CarrinhoCache.decodificar_id(kwargs.get('pk'))
+        if linha_cache:
+            session_id, produto_id = linha_cache
+            if not any(linha.produto_id == produto_id for linha in CarrinhoCache.linhas(session_id)):
+                return Response({'detail': 'Item do carrinho não encontrado'}, status=status.HTTP_404_NOT_FOUND)
+            CarrinhoCache.definir(session_id, {produto_id: 0})
+            return Response(status=status.HTTP_204_NO_CONTENT)
+        
+        instance = self.get_object()
+        with transaction.atomic():
+            instance = Carrito.objects.select_for_update().get(pk=instance.pk)
+            if instance.reservado_ate is not None:
+                ReservaService.liberar(instance.produto_id, instance.quantidade)
+            instance.delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+    @action(detail=False, methods=['post'])
+    def lote(self, request):
+        """Adiciona, altera ou remove várias linhas do carrinho em uma requisição"""
+        session_id = self._sessao_em_cache(request.data)
+        try:
+            if session_id:
+                CarrinhoCache.atualizar_em_lote(request.data.get('itens'), session_id)
+                return Response(self._dados_cache(session_id))
+            linhas = CarrinhoService.atualizar_em_lote(
+                request.data.get('itens'),
+                session_id=request.data.get('session_id'),
+                usuario_id=request.data.get('usuario_id')
+            )
+        except VendaError as e:
+            return Response({'detail': e.detail}, status=e.status_code)
+
+        serializer = self.get_serializer(linhas.order_by('-created_at'), many=True)
+        return Response(serializer.data)
+
+    @action(detail=False, methods=['post'])
+    def mesclar(self, request):
+        """Move o carrinho anônimo da sessão para o usuário (chamado após o login)"""
+        usuario_id = request.user.id if request.user.is_authenticated else request.data.get('usuario_id')
+        session_id = request.data.get('session_id')
+        try:
+            with transaction.atomic():
+                if session_id and CarrinhoCache.ativo():
+                    CarrinhoCache.persistir(session_id)
+                CarrinhoService.mesclar(session_id, usuario_id)
+        except VendaError as e:
+            return Response({'detail': e.detail}, status=e.status_code)
+
+        linhas = CarrinhoService.linhas(usuario_id=usuario_id).order_by('-created_at')
+        return Response(self.get_serializer(linhas, many=True).data)
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def relatorio_vendas(request):
+    """Relatório de vendas por dia ou mês, servido a partir dos resumos pré-agregados"""
+    granularidade = request.query_params.get('granularidade', 'dia')
+    agrupar = request.query_params.get('agrupar', 'total')
+
+    if granularidade not in dict(ResumoVendas.GRANULARIDADE_CHOICES):
+        return Response(
+            {'detail': 'granularidade deve ser "dia" ou "mes"'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    if agrupar not in dict(ResumoVendas.DIMENSAO_CHOICES):
+        return Response(
+            {'detail': 'agrupar deve ser "total", "produto", "cliente" ou "cidade"'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    datas = {}
+    for parametro in ('fecha_inicio', 'fecha_fin'):
+        valor = request.query_params.get(parametro)
+        try:
+            # parse_date devolve None para formatos inválidos e levanta ValueError para datas impossíveis
+            datas[parametro] = parse_date(valor) if valor else None
+        except ValueError:
+            datas[parametro] = None
+        if valor and datas[parametro] is None:
+            return Response(
+                {'detail': f'{parametro} deve estar no formato AAAA-MM-DD'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+    inicio = datas['fecha_inicio']
+    if inicio and granularidade == 'mes':
+        inicio = inicio.replace(day=1)
+
+    linhas = ResumoVendasService.consultar(
+        granularidade,
+        agrupar,
+        inicio=inicio,
+        fim=datas['fecha_fin'],
+        chave=request.query_params.get('chave')
+    )
+    return Response({
+        'granularidade': granularidade,
+        'agrupar': agrupar,
+        'resultados': linhas,
+    })
 
 
 @api_view(['GET'])
@@ -733,7 +1034,10 @@ class KanbanViewSet(viewsets.ModelViewSet):
 
     def get_queryset(self):
         """Retornar apenas quadros do usuário logado"""
-        return Kanban.objects.filter(criado_por=self.request.user).order_by('-data_criacao')
+        queryset = Kanban.objects.filter(criado_por=self.request.user).order_by('-data_criacao')
+        if self.action in ('list', 'retrieve'):
+            queryset = KanbanSerializer.otimizar_queryset(queryset)
+        return queryset
 
     def perform_create(self, serializer):
         """Criar quadro com o usuário atual como criador"""
@@ -741,10 +1045,123 @@ class KanbanViewSet(viewsets.ModelViewSet):
 
     @action(detail=True, methods=['get'])
     def completo(self, request, pk=None):
-        """Retornar quadro completo com colunas e cards"""
+        """
+        Retornar quadro completo com colunas e cards
+
+        Servido do cache enquanto a versão do quadro não muda; com
+        If-None-Match igual ao ETag da versão atual retorna 304.
+        """
+        # Lidos antes da versão: eventos e mudanças a partir daqui nunca ficam de fora do snapshot
+        ultimo_evento = eventos_kanban.transmissor.ultimo_id(int(pk)) if str(pk).isdigit() else None
+        inicio = timezone.now()
         kanban = self.get_object()
-        serializer = KanbanCompletoSerializer(kanban)
-        return Response(serializer.data)
+        etag = KanbanSnapshotService.etag(kanban)
+        headers = {
+            'ETag': etag,
+            'X-Ultimo-Evento': ultimo_evento,
+            'X-Cursor-Mudancas': SincronizacaoKanbanService.cursor(kanban, inicio),
+        }
+        if _etag_corresponde(request, etag):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+        def gerar():
+            completo = KanbanCompletoSerializer.otimizar_queryset(Kanban.objects.filter(pk=kanban.pk)).get()
+            return KanbanCompletoSerializer(completo).data
+
+        return Response(KanbanSnapshotService.obter(kanban, gerar), headers=headers)
+
+    @action(detail=True, methods=['get'])
+    def mudancas(self, request, pk=None):
+        """
+        Colunas e cards criados, alterados ou excluídos desde o cursor
+
+        desde: cursor devolvido pela chamada anterior (ou X-Cursor-Mudancas
+        de /completo/) ou uma data ISO 8601.
+        """
+        inicio = timezone.now()
+        kanban = self.get_object()
+        desde = request.query_params.get('desde')
+        if not desde:
+            return Response({'detail': 'desde é obrigatório'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            versao, instante = SincronizacaoKanbanService.ler_cursor(desde)
+        except ValueError:
+            return Response({'detail': 'Cursor inválido'}, status=status.HTTP_400_BAD_REQUEST)
+        if SincronizacaoKanbanService.expirado(instante):
+            return Response(
+                {'detail': 'Cursor expirado, carregue o quadro completo novamente'},
+                status=status.HTTP_410_GONE
+            )
+
+        resposta = {
+            'cursor': SincronizacaoKanbanService.cursor(kanban, inicio),
+            'colunas': [],
+            'cards': [],
+            'removidos': {'colunas': [], 'cards': []},
+        }
+        # Mesma versão do cursor: nada mudou, sem consultar colunas e cards
+        if versao != kanban.versao:
+            mudancas = SincronizacaoKanbanService.mudancas(kanban, instante)
+            resposta.update(
+                colunas=ColunaSerializer(mudancas['colunas'], many=True).data,
+                cards=CardSerializer(mudancas['cards'], many=True).data,
+                removidos=mudancas['removidos'],
+            )
+        return Response(resposta)
+
+    def _periodo_metricas(self, request):
+        datas = {}
+        for parametro in ('inicio', 'fim'):
+            valor = request.query_params.get(parametro)
+            datas[parametro] = parse_date(valor) if valor else None
+            if valor and datas[parametro] is None:
+                raise ValidationError({'detail': f'{parametro} deve estar no formato AAAA-MM-DD'})
+        try:
+            return MetricasKanbanService.periodo(datas['inicio'], datas['fim'])
+        except ValueError as e:
+            raise ValidationError({'detail': str(e)})
+
+    @action(detail=True, methods=['get'])
+    def metricas(self, request, pk=None):
+        """
+        Tempo médio por coluna, lead time e vazão do período (inicio/fim, padrão: últimos 30 dias)
+        """
+        kanban = self.get_object()
+        inicio, fim = self._periodo_metricas(request)
+        return Response(MetricasKanbanService.resumo(kanban, inicio, fim))
+
+    @action(detail=True, methods=['get'], url_path='metricas/fluxo', url_name='metricas-fluxo')
+    def metricas_fluxo(self, request, pk=None):
+        """
+        Fluxo cumulativo (CFD): cards em cada coluna no fim de cada dia do período
+        """
+        kanban = self.get_object()
+        inicio, fim = self._periodo_metricas(request)
+        return Response(MetricasKanbanService.fluxo(kanban, inicio, fim))
+
+    @action(detail=True, methods=['get'],
+            renderer_classes=[JSONRenderer, EventStreamRenderer],
+            authentication_classes=[JWTAuthentication, JWTQueryParamAuthentication])
+    def eventos(self, request, pk=None):
+        """
+        Alterações do quadro em tempo real (Server-Sent Events)
+
+        Retoma a partir do header Last-Event-ID (reconexão do EventSource)
+        ou do parâmetro ultimo_evento (X-Ultimo-Evento de /completo/).
+        Só transmite continuamente em ASGI; em WSGI responde na hora com
+        o evento sincronizar (ver eventos.sincronizar).
+        """
+        kanban = self.get_object()
+        ultimo_id = request.headers.get('Last-Event-ID') or request.query_params.get('ultimo_evento')
+
+        if isinstance(request._request, ASGIRequest):
+            conteudo = eventos_kanban.fluxo(kanban.id, ultimo_id)
+        else:
+            conteudo = eventos_kanban.sincronizar(kanban.id, kanban.versao)
+        response = StreamingHttpResponse(conteudo, content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
 
     @action(detail=True, methods=['get'])
     def regras(self, request, pk=None):
@@ -775,7 +1192,7 @@ class ColunaViewSet(viewsets.ModelViewSet):
 
     def get_queryset(self):
         """Filtrar colunas por quadro se fornecido"""
-        queryset = Coluna.objects.all().order_by('ordem')
+        queryset = Coluna.objects.all().order_by('rank', 'id')
         kanban_id = self.request.query_params.get('kanban', None)
         if kanban_id:
             queryset = queryset.filter(kanban_id=kanban_id)
@@ -819,47 +1236,61 @@ class ColunaViewSet(viewsets.ModelViewSet):
 
     def perform_create(self, serializer):
         """Just save - ordem is already set in create()"""
-        serializer.save()
+        coluna = serializer.save()
+        eventos_kanban.publicar(coluna.kanban_id, 'coluna.criada', serializer.data)
 
     def perform_update(self, serializer):
         """Validar permissão antes de atualizar"""
         kanban = serializer.instance.kanban
         if kanban.criado_por != self.request.user:
             raise permissions.PermissionDenied("Você não tem permissão para modificar este quadro")
-        serializer.save()
+        coluna = serializer.save()
+        eventos_kanban.publicar(coluna.kanban_id, 'coluna.atualizada', serializer.data)
 
     def perform_destroy(self, instance):
         """Validar permissão antes de deletar"""
         if instance.kanban.criado_por != self.request.user:
             raise permissions.PermissionDenied("Você não tem permissão para modificar este quadro")
+        dados = {'id': instance.id}
         instance.delete()
+        eventos_kanban.publicar(instance.kanban_id, 'coluna.excluida', dados)
+
+    @action(detail=True, methods=['post'])
+    def mover(self, request, pk=None):
+        """Mover a coluna para outra posição do quadro (altera apenas o rank desta coluna)"""
+        coluna = self.get_object()
+        if coluna.kanban.criado_por != request.user:
+            raise permissions.PermissionDenied("Você não tem permissão para modificar este quadro")
+
+        try:
+            with transaction.atomic():
+                coluna.rank = OrdenacaoKanbanService.novo_rank(
+                    Coluna,
+                    coluna.kanban_id,
+                    item_id=coluna.id,
+                    apos=request.data.get('apos'),
+                    antes_de=request.data.get('antes_de'),
+                    indice=request.data.get('ordem')
+                )
+                coluna.save(update_fields=['rank', 'updated_at'])
+        except OrdenacaoKanbanError as e:
+            return Response({'detail': e.detail}, status=e.status_code)
+
+        dados = self.get_serializer(coluna).data
+        eventos_kanban.publicar(coluna.kanban_id, 'coluna.atualizada', dados)
+        return Response(dados)
 
     @action(detail=False, methods=['post'])
     def reordenar(self, request):
-        """Reordenar colunas"""
+        """Reordenar colunas (uma ou mais, em uma única transação)"""
         colunas_ordem = request.data.get('colunas', [])  # [{'id': 1, 'ordem': 0}, ...]
 
         try:
-            with transaction.atomic():
-                for item in colunas_ordem:
-                    coluna = Coluna.objects.get(id=item['id'])
-                    # Verificar permissão
-                    if coluna.kanban.criado_por != request.user:
-                        raise permissions.PermissionDenied("Você não tem permissão para modificar este quadro")
-                    coluna.ordem = item['ordem']
-                    coluna.save()
-
-                return Response({'detail': 'Colunas reordenadas com sucesso'})
-        except Coluna.DoesNotExist:
-            return Response(
-                {'detail': 'Coluna não encontrada'},
-                status=status.HTTP_404_NOT_FOUND
-            )
-        except Exception as e:
-            return Response(
-                {'detail': str(e)},
-                status=status.HTTP_400_BAD_REQUEST
-            )
+            OrdenacaoKanbanService.reordenar_colunas(request.user, colunas_ordem)
+        except OrdenacaoKanbanError as e:
+            return Response({'detail': e.detail}, status=e.status_code)
+
+        return Response({'detail': 'Colunas reordenadas com sucesso'})
 
 
 class CardViewSet(viewsets.ModelViewSet):
@@ -867,10 +1298,12 @@ class CardViewSet(viewsets.ModelViewSet):
     queryset = Card.objects.all()
     serializer_class = CardSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = CursorPaginacao
+    ordenacao_cursor = ('rank', 'id')
 
     def get_queryset(self):
         """Filtrar cards por coluna ou kanban"""
-        queryset = Card.objects.all().order_by('ordem', '-data_criacao')
+        queryset = Card.objects.all().order_by('rank', 'id')
 
         coluna_id = self.request.query_params.get('coluna', None)
         if coluna_id:
@@ -904,15 +1337,8 @@ class CardViewSet(viewsets.ModelViewSet):
                     status=status.HTTP_400_BAD_REQUEST
                 )
 
-            # Auto-incrementar ordem
-            ultimo_card = Card.objects.filter(coluna=coluna).order_by('-ordem').first()
-            ordem = (ultimo_card.ordem + 1) if ultimo_card else 0
-
-            # Create data with ordem
-            data = request.data.copy()
-            data['ordem'] = ordem
-
-            serializer = self.get_serializer(data=data)
+            # A posição (rank, no fim da coluna) é definida por Card.save()
+            serializer = self.get_serializer(data=request.data)
             serializer.is_valid(raise_exception=True)
             self.perform_create(serializer)
 
@@ -923,30 +1349,44 @@ class CardViewSet(viewsets.ModelViewSet):
                 {'detail': 'Coluna não encontrada'},
                 status=status.HTTP_404_NOT_FOUND
             )
+        except LimiteCardsError as e:
+            # Coluna preenchida por outra requisição entre a validação e a gravação
+            return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
     def perform_create(self, serializer):
-        """Just save - ordem is already set in create()"""
-        serializer.save()
+        """Just save - rank is set by Card.save()"""
+        card = serializer.save()
+        eventos_kanban.publicar(card.coluna.kanban_id, 'card.criado', serializer.data)
 
     def perform_update(self, serializer):
         """Validar permissão antes de atualizar"""
         kanban = serializer.instance.coluna.kanban
         if kanban.criado_por != self.request.user:
             raise permissions.PermissionDenied("Você não tem permissão para modificar este quadro")
-        serializer.save()
+        try:
+            card = serializer.save()
+        except LimiteCardsError as e:
+            raise ValidationError(str(e))
+        eventos_kanban.publicar(card.coluna.kanban_id, 'card.atualizado', serializer.data)
 
     def perform_destroy(self, instance):
         """Validar permissão antes de deletar"""
         if instance.coluna.kanban.criado_por != self.request.user:
             raise permissions.PermissionDenied("Você não tem permissão para modificar este quadro")
+        dados = {'id': instance.id, 'coluna': instance.coluna_id}
         instance.delete()
+        eventos_kanban.publicar(instance.coluna.kanban_id, 'card.excluido', dados)
 
     @action(detail=True, methods=['post'])
     def mover(self, request, pk=None):
-        """Mover card entre colunas"""
+        """
+        Mover card entre colunas ou dentro da coluna
+
+        A posição no destino é dada por apos / antes_de (ID do card vizinho)
+        ou por ordem (posição 0-based); só o rank deste card é alterado.
+        """
         card = self.get_object()
         coluna_destino_id = request.data.get('coluna_destino')
-        nova_ordem = request.data.get('ordem', 0)
 
         try:
             with transaction.atomic():
@@ -974,8 +1414,15 @@ class CardViewSet(viewsets.ModelViewSet):
 
                 # Atualizar card primeiro
                 card.coluna = coluna_destino
-                card.ordem = nova_ordem
-                card.save(update_fields=['coluna', 'ordem'])
+                card.rank = OrdenacaoKanbanService.novo_rank(
+                    Card,
+                    coluna_destino.id,
+                    item_id=card.id,
+                    apos=request.data.get('apos'),
+                    antes_de=request.data.get('antes_de'),
+                    indice=request.data.get('ordem', 0)
+                )
+                card.save(update_fields=['coluna', 'rank', 'updated_at'])
 
                 # Registrar histórico após atualização
                 HistoricoMovimentacao.objects.create(
@@ -987,6 +1434,7 @@ class CardViewSet(viewsets.ModelViewSet):
                 )
 
                 serializer = CardSerializer(card)
+                eventos_kanban.publicar(coluna_destino.kanban_id, 'card.movido', serializer.data)
                 return Response(serializer.data)
 
         except Coluna.DoesNotExist:
@@ -994,17 +1442,67 @@ class CardViewSet(viewsets.ModelViewSet):
                 {'detail': 'Coluna destino não encontrada'},
                 status=status.HTTP_404_NOT_FOUND
             )
+        except OrdenacaoKanbanError as e:
+            return Response({'detail': e.detail}, status=e.status_code)
         except Exception as e:
             return Response(
                 {'detail': str(e)},
                 status=status.HTTP_400_BAD_REQUEST
             )
 
+    @action(detail=False, methods=['get'])
+    def busca(self, request):
+        """
+        Busca de texto completo em título e descrição dos cards de todos os quadros do usuário
+
+        q: termos (todos devem aparecer; cada um vale como prefixo)
+        limite: máximo de resultados (padrão 20, máximo 100)
+        """
+        q = request.query_params.get('q', '').strip()
+        if not q:
+            return Response({'detail': 'q é obrigatório'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            limite = int(request.query_params.get('limite', BuscaCardsService.LIMITE_PADRAO))
+        except ValueError:
+            return Response({'detail': 'limite deve ser um número inteiro'}, status=status.HTTP_400_BAD_REQUEST)
+
+        cards = BuscaCardsService.buscar(request.user, q, limite=max(limite, 1)).select_related(
+            'coluna__kanban', 'cliente', 'produto', 'responsavel'
+        )
+        return Response(CardBuscaSerializer(cards, many=True).data)
+
+    @action(detail=False, methods=['post'], url_path='mover-lote')
+    def mover_lote(self, request):
+        """
+        Mover vários cards em uma única transação
+
+        Aceita {"movimentos": [{"cards": [...], "coluna_destino": id, "apos": id}, ...]}
+        ou um único movimento com os mesmos campos no corpo da requisição.
+        """
+        movimentos = request.data.get('movimentos')
+        if movimentos is None:
+            movimentos = [request.data]
+
+        try:
+            card_ids = OrdenacaoKanbanService.mover_cards(
+                request.user, movimentos, observacao=request.data.get('observacao', '')
+            )
+        except OrdenacaoKanbanError as e:
+            return Response({'detail': e.detail}, status=e.status_code)
+
+        cards = Card.objects.filter(id__in=card_ids).select_related('coluna', 'cliente', 'produto', 'responsavel')
+        serializer = CardSerializer(cards, many=True)
+        return Response(serializer.data)
+
     @action(detail=True, methods=['get'])
     def historico(self, request, pk=None):
-        """Obter histórico de movimentações do card"""
+        """Obter histórico de movimentações do card (com ?incluir_arquivo=1, também o arquivado)"""
         card = self.get_object()
         historico = HistoricoMovimentacao.objects.filter(card=card).order_by('-data')
+        if _incluir_arquivo(request):
+            historico = ConsultaComArquivo(
+                historico, HistoricoMovimentacaoArquivo.objects.filter(card_id=card.id).order_by('-data')
+            )
         serializer = HistoricoMovimentacaoSerializer(historico, many=True)
         return Response(serializer.data)
 
@@ -1028,19 +1526,23 @@ class RegraAutomacaoViewSet(viewsets.ModelViewSet):
         kanban = serializer.validated_data['kanban']
         if kanban.criado_por != self.request.user:
             raise permissions.PermissionDenied("Você não tem permissão para modificar este quadro")
-        serializer.save()
+        regra = serializer.save()
+        eventos_kanban.publicar(regra.kanban_id, 'regra.criada', serializer.data)
 
     def perform_update(self, serializer):
         """Validar permissão antes de atualizar"""
         if serializer.instance.kanban.criado_por != self.request.user:
             raise permissions.PermissionDenied("Você não tem permissão para modificar este quadro")
-        serializer.save()
+        regra = serializer.save()
+        eventos_kanban.publicar(regra.kanban_id, 'regra.atualizada', serializer.data)
 
     def perform_destroy(self, instance):
         """Validar permissão antes de deletar"""
         if instance.kanban.criado_por != self.request.user:
             raise permissions.PermissionDenied("Você não tem permissão para modificar este quadro")
+        dados = {'id': instance.id}
         instance.delete()
+        eventos_kanban.publicar(instance.kanban_id, 'regra.excluida', dados)
 
 
 class HistoricoMovimentacaoViewSet(viewsets.ReadOnlyModelViewSet):
@@ -1048,19 +1550,27 @@ class HistoricoMovimentacaoViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = HistoricoMovimentacao.objects.all()
     serializer_class = HistoricoMovimentacaoSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = CursorPaginacao
+    ordenacao_cursor = ('-data', '-id')
 
     def get_queryset(self):
-        """Filtrar histórico por card ou kanban"""
+        """Filtrar histórico por card ou kanban (com ?incluir_arquivo=1, também o arquivado)"""
         queryset = HistoricoMovimentacao.objects.all().order_by('-data')
+        arquivo = HistoricoMovimentacaoArquivo.objects.all().order_by('-data')
 
         card_id = self.request.query_params.get('card', None)
         if card_id:
             queryset = queryset.filter(card_id=card_id)
+            arquivo = arquivo.filter(card_id=card_id)
 
         kanban_id = self.request.query_params.get('kanban', None)
         if kanban_id:
             queryset = queryset.filter(card__coluna__kanban_id=kanban_id)
+            # O arquivo guarda o quadro no próprio registro, sem joins
+            arquivo = arquivo.filter(kanban_id=kanban_id)
 
+        if _incluir_arquivo(self.request):
+            return ConsultaComArquivo(queryset, arquivo)
         return queryset
 
 
@@ -1069,25 +1579,34 @@ class LogNotificacaoViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = LogNotificacao.objects.all()
     serializer_class = LogNotificacaoSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = CursorPaginacao
+    ordenacao_cursor = ('-data_envio', '-id')
 
     def get_queryset(self):
-        """Filtrar logs por card, regra ou kanban"""
+        """Filtrar logs por card, regra ou kanban (com ?incluir_arquivo=1, também os arquivados)"""
         queryset = LogNotificacao.objects.all().order_by('-data_envio')
+        arquivo = LogNotificacaoArquivo.objects.all().order_by('-data_envio')
 
         card_id = self.request.query_params.get('card', None)
         if card_id:
             queryset = queryset.filter(card_id=card_id)
+            arquivo = arquivo.filter(card_id=card_id)
 
         regra_id = self.request.query_params.get('regra', None)
         if regra_id:
             queryset = queryset.filter(regra_id=regra_id)
+            arquivo = arquivo.filter(regra_id=regra_id)
 
         kanban_id = self.request.query_params.get('kanban', None)
         if kanban_id:
             queryset = queryset.filter(card__coluna__kanban_id=kanban_id)
+            arquivo = arquivo.filter(kanban_id=kanban_id)
 
         status_filter = self.request.query_params.get('status', None)
         if status_filter:
             queryset = queryset.filter(status=status_filter)
+            arquivo = arquivo.filter(status=status_filter)
 
+        if _incluir_arquivo(self.request):
+            return ConsultaComArquivo(queryset, arquivo)
         return queryset